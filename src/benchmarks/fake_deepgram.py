@@ -0,0 +1,202 @@
+"""
+Local websocket stand-in for Deepgram's live transcription endpoint, to exercise the STT
+connection handling offline (see benchmarks/stt_failover.py).
+
+It speaks enough of the protocol for the SDK: audio in binary messages, KeepAlive /
+Finalize / CloseStream text messages, and "Results" messages out, sent `latency_ms` after
+the audio they cover like a real server. It doesn't recognize speech: the audio is cut in
+frames of `frame_bytes`, the first sample of every frame carries its index (see
+encode_frame), and every `frames_per_word` frames make up the word "w<n>". So the words a
+client got back tell exactly which audio was transcribed, across reconnects.
+
+Failures are injected from any thread: drop_streaming(), drop_all(), refuse_connections(),
+stall(), and `connect_delay` for handshake latency. Connections that get no message for
+`idle_timeout` seconds are closed with 1011, like Deepgram's NET-0001.
+"""
+from http import HTTPStatus
+import asyncio
+import json
+import struct
+import threading
+import time
+
+from websockets.asyncio.server import serve
+
+
+def encode_frame(index: int, frame_bytes: int) -> bytes:
+    return struct.pack("<h", index % 32768) + bytes(frame_bytes - 2)
+
+
+def decode_frame(frame: bytes) -> int:
+    return struct.unpack_from("<h", frame)[0]
+
+
+class _Stream:
+    def __init__(self, connection) -> None:
+        self.connection = connection
+        self.buffer = bytearray()
+        self.received_frames = 0
+        # [word index, start, end] of the words of the segment not finalized yet
+        self.segment = []
+        self.last_message_time = time.time()
+        self.stalled_until = 0.0
+
+
+class FakeDeepgramServer:
+    def __init__(self, host="127.0.0.1", port=0, sample_rate=16000, frame_ms=20, frames_per_word=10,
+                 words_per_segment=20, latency_ms=300, idle_timeout=10.0) -> None:
+        self.host = host
+        self.port = port
+        self.sample_rate = sample_rate
+        self.frame_bytes = 2 * int(sample_rate * frame_ms / 1000)
+        self.frame_seconds = frame_ms / 1000
+        self.frames_per_word = frames_per_word
+        self.words_per_segment = words_per_segment
+        self.latency = latency_ms / 1000
+        self.idle_timeout = idle_timeout
+        self.connect_delay = 0.0
+        self.refused = 0
+        self.streams = set()
+        self.stats = {"connections": 0, "refused": 0, "dropped": 0, "idle_closed": 0, "keepalives": 0, "finalizes": 0}
+        self.loop = None
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self) -> "FakeDeepgramServer":
+        self.thread.start()
+        self.ready.wait()
+        return self
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.stop_event.set)
+        self.thread.join(timeout=5)
+
+    # Failure injection, callable from any thread
+    def drop_streaming(self):
+        """
+        Abort the connections that received audio, leaving idle (standby) ones alone.
+        """
+        self.loop.call_soon_threadsafe(self.__drop, True)
+
+    def drop_all(self):
+        self.loop.call_soon_threadsafe(self.__drop, False)
+
+    def refuse_connections(self, count: int):
+        self.refused += count
+
+    def stall(self, seconds: float):
+        """
+        The connections that received audio keep accepting it but send nothing back for a while.
+        """
+        self.loop.call_soon_threadsafe(self.__stall, time.time() + seconds)
+
+    def __run(self):
+        self.loop = asyncio.new_event_loop()
+        self.loop.run_until_complete(self.__serve())
+
+    async def __serve(self):
+        self.stop_event = asyncio.Event()
+        async with serve(self.__handle, self.host, self.port, process_request=self.__process_request) as server:
+            self.port = server.sockets[0].getsockname()[1]
+            self.ready.set()
+            idle_task = asyncio.ensure_future(self.__close_idle())
+            await self.stop_event.wait()
+            idle_task.cancel()
+
+    async def __process_request(self, connection, request):
+        if self.connect_delay > 0:
+            await asyncio.sleep(self.connect_delay)
+        if self.refused > 0:
+            self.refused -= 1
+            self.stats["refused"] += 1
+            return connection.respond(HTTPStatus.SERVICE_UNAVAILABLE, "Refused by FakeDeepgramServer\n")
+        return None
+
+    async def __handle(self, connection):
+        stream = _Stream(connection)
+        self.streams.add(stream)
+        self.stats["connections"] += 1
+        try:
+            async for message in connection:
+                stream.last_message_time = time.time()
+                if isinstance(message, bytes):
+                    self.__receive_audio(stream, message)
+                    continue
+                message_type = json.loads(message).get("type")
+                if message_type == "KeepAlive":
+                    self.stats["keepalives"] += 1
+                elif message_type == "Finalize":
+                    self.stats["finalizes"] += 1
+                    self.__send_later(stream, self.__result(stream, is_final=True, speech_final=False, from_finalize=True))
+                elif message_type == "CloseStream":
+                    await connection.close(1000)
+        except Exception:
+            pass
+        finally:
+            self.streams.discard(stream)
+
+    def __receive_audio(self, stream: _Stream, audio: bytes):
+        stream.buffer += audio
+        frames = len(stream.buffer) // self.frame_bytes
+        for offset in range(0, frames * self.frame_bytes, self.frame_bytes):
+            word = decode_frame(stream.buffer[offset:offset + self.frame_bytes]) // self.frames_per_word
+            frame_start = stream.received_frames * self.frame_seconds
+            if len(stream.segment) == 0 or stream.segment[-1][0] != word:
+                stream.segment.append([word, frame_start, frame_start])
+            stream.received_frames += 1
+            stream.segment[-1][2] = stream.received_frames * self.frame_seconds
+            # An interim result every 5 frames, a final one every words_per_segment words (at the end of a word)
+            if stream.received_frames % 5 == 0:
+                is_final = len(stream.segment) >= self.words_per_segment and stream.received_frames % self.frames_per_word == 0
+                self.__send_later(stream, self.__result(stream, is_final=is_final, speech_final=False))
+        del stream.buffer[:frames * self.frame_bytes]
+
+    def __result(self, stream: _Stream, is_final: bool, speech_final: bool, from_finalize=False) -> str:
+        end = stream.received_frames * self.frame_seconds
+        start = stream.segment[0][1] if len(stream.segment) > 0 else end
+        words = [{"word": f"w{word}", "punctuated_word": f"w{word}", "start": word_start, "end": word_end, "confidence": 1.0}
+                 for word, word_start, word_end in stream.segment]
+        if is_final:
+            stream.segment = []
+        return json.dumps({
+            "type": "Results", "channel_index": [0, 1], "start": start, "duration": end - start,
+            "is_final": is_final, "speech_final": speech_final, "from_finalize": from_finalize,
+            "channel": {"alternatives": [{"transcript": " ".join(word["word"] for word in words), "confidence": 1.0, "words": words}]},
+            "metadata": {"request_id": "fake", "model_info": {"name": "fake", "version": "0", "arch": "fake"}, "model_uuid": "fake"},
+        })
+
+    def __send_later(self, stream: _Stream, message: str):
+        async def send():
+            await asyncio.sleep(self.latency)
+            if time.time() < stream.stalled_until:
+                return
+            try:
+                await stream.connection.send(message)
+            except Exception:
+                pass
+        asyncio.ensure_future(send())
+
+    def __stall(self, until: float):
+        for stream in self.streams:
+            if stream.received_frames > 0:
+                stream.stalled_until = until
+
+    def __drop(self, streaming_only: bool):
+        for stream in list(self.streams):
+            if streaming_only and stream.received_frames == 0:
+                continue
+            self.stats["dropped"] += 1
+            stream.connection.transport.abort()
+
+    async def __close_idle(self):
+        while True:
+            await asyncio.sleep(0.5)
+            now = time.time()
+            for stream in list(self.streams):
+                if now - stream.last_message_time > self.idle_timeout:
+                    self.stats["idle_closed"] += 1
+                    await stream.connection.close(1011, "NET-0001 no audio received")
@@ -0,0 +1,146 @@
+"""
+Local stand-in for an OpenAI compatible server (vLLM), to measure the LLM client offline.
+
+Serves GET /v1/models and POST /v1/chat/completions, streamed as server-sent events like
+vLLM or not: the first token comes `ttft_ms` after the request, the next ones every
+`token_ms`, up to max_tokens or `reply_tokens` (the reply is "w0 w1 w2 ...", or the tokens of
+`reply_text` over and over, words with their leading space and punctuation on its own like
+a BPE tokenizer splits them). A `stall_share` of the tokens take `stall_ms` more (seeded),
+like a server under load. A client that closes the stream
+aborts the generation, as vLLM does when it sees the disconnect. `connect_delay_ms` is
+spent on every new connection before its first request, standing in for TCP + TLS setup
+to a remote server. Connections are HTTP/1.1 keep-alive.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import re
+import threading
+import time
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "_Server"
+
+    def setup(self):
+        super(_Handler, self).setup()
+        self.server.owner.count("connections")
+        time.sleep(self.server.owner.connect_delay)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.server.owner.count("requests")
+        if self.path.rstrip("/").endswith("/models"):
+            self.__send_json({"object": "list", "data": [{"id": "fake", "object": "model", "created": 0, "owned_by": "fake"}]})
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        owner = self.server.owner
+        owner.count("requests")
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        max_tokens = body.get("max_tokens") or 16
+        if owner.reply_tokens is not None:
+            max_tokens = min(max_tokens, owner.reply_tokens)
+        prompt_chars = sum(len(message.get("content") or "") for message in body.get("messages", []))
+        owner.count("prompt_chars", prompt_chars)
+        if owner.reply_tokenized is not None:
+            words = [owner.reply_tokenized[index % len(owner.reply_tokenized)] for index in range(max_tokens)]
+        else:
+            words = [f"w{index} " for index in range(max_tokens)]
+        if not body.get("stream"):
+            time.sleep(owner.ttft + owner.token_time * (max_tokens - 1))
+            owner.count("completed")
+            owner.count("generated_tokens", max_tokens)
+            self.__send_json({"id": "fake", "object": "chat.completion", "created": 0, "model": body.get("model", "fake"),
+                              "choices": [{"index": 0, "finish_reason": "length",
+                                           "message": {"role": "assistant", "content": "".join(words)}}]})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            self.__send_chunk({"role": "assistant", "content": ""})
+            time.sleep(owner.ttft)
+            for index, word in enumerate(words):
+                if index > 0:
+                    time.sleep(owner.token_time)
+                if index > 0 and owner.stalls():
+                    time.sleep(owner.stall_time)
+                self.__send_chunk({"content": word})
+                owner.count("generated_tokens")
+            self.__send_chunk({}, finish_reason="length")
+            self.__write_chunk(b"data: [DONE]\n\n")
+            self.__write_chunk(b"")
+            owner.count("completed")
+        except (BrokenPipeError, ConnectionResetError):
+            owner.count("aborted")
+            self.close_connection = True
+
+    def __send_chunk(self, delta: dict, finish_reason=None):
+        chunk = {"id": "fake", "object": "chat.completion.chunk", "created": 0, "model": "fake",
+                 "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+        self.__write_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+
+    def __write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def __send_json(self, payload: dict):
+        data = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    owner: "FakeOpenAIServer" = None
+
+
+class FakeOpenAIServer:
+    def __init__(self, host="127.0.0.1", port=0, ttft_ms=50, token_ms=10, connect_delay_ms=0, reply_tokens=None,
+                 reply_text: str = None, stall_share=0.0, stall_ms=0, seed=0) -> None:
+        self.reply_tokens = reply_tokens
+        self.reply_tokenized = re.findall(r" ?\w+(?:'\w+)?|[^\w\s]", reply_text) if reply_text else None
+        self.stall_share = stall_share
+        self.stall_time = stall_ms / 1000
+        self.rng = random.Random(seed)
+        self.ttft = ttft_ms / 1000
+        self.token_time = token_ms / 1000
+        self.connect_delay = connect_delay_ms / 1000
+        self.lock = threading.Lock()
+        self.stats = {"connections": 0, "requests": 0, "completed": 0, "aborted": 0, "generated_tokens": 0, "prompt_chars": 0}
+        self.server = _Server((host, port), _Handler)
+        self.server.owner = self
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "FakeOpenAIServer":
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stalls(self) -> bool:
+        with self.lock:
+            return self.stall_share > 0 and self.rng.random() < self.stall_share
+
+    def count(self, name: str, value=1):
+        with self.lock:
+            self.stats[name] += value
@@ -0,0 +1,129 @@
+"""
+Perceived latency of the response with and without filler clips.
+
+A KokoroTTS stand-in synthesizes tones (`--synth-ms` before the first chunk of a
+sentence, faster than real time after it), so this runs without Kokoro. Every turn starts
+like a ChatBot response does (handle_start), and the first sentence of the response
+reaches the TTS after a simulated LLM time to first token, drawn log-normally around
+`--ttft-ms`. Audio goes to a sink that plays it out in real time. Reported per setup: the
+response latency (turn start to the first response audio), the perceived latency (to the
+first audio of any kind), the clips played, cut and completed, and the silence heard
+between a cut clip and the response.
+
+Run from the src directory:
+    python -m benchmarks.filler --turns 20 --ttft-ms 700 --threshold 0.5
+"""
+import argparse
+import random
+import threading
+import time
+
+import numpy as np
+
+from synapse.pipeline.sinks import DataSink
+from synapse.tts.filler import FillerPlayer
+from synapse.tts.kokoro import KokoroTTS
+
+
+class ToneTTS(KokoroTTS):
+    def __init__(self, synth_ms: float, **kwargs):
+        self.synth_time = synth_ms / 1000
+        super(ToneTTS, self).__init__(**kwargs)
+
+    def load_pipeline(self):
+        return None
+
+    def synthesize_pcm(self, data: str, epoch: int):
+        time.sleep(self.synth_time)
+        # 300 ms a word, in 100 ms chunks
+        samples = int(self.sample_rate * 0.3 * max(1, len(data.split())))
+        t = np.arange(samples) / self.sample_rate
+        pcm = (8000 * np.sin(2 * np.pi * 220 * t)).astype(np.int16)
+        step = self.sample_rate // 10
+        for start in range(0, samples, step):
+            if self.epoch_clock.is_stale(epoch) or self.is_closed:
+                return
+            yield pcm[start:start + step].tobytes()
+
+
+class PlayoutSink(DataSink):
+    """
+    Plays out what it gets in real time and notes when each chunk starts and ends playing.
+    """
+    def __init__(self, sample_rate: int):
+        super(PlayoutSink, self).__init__()
+        self.bytes_per_second = 2 * sample_rate
+        self.lock = threading.Lock()
+        self.playout_end = 0.0
+        self.chunks = []
+
+    def __call__(self, pcm_bytes: bytes):
+        now = time.time()
+        with self.lock:
+            start = max(now, self.playout_end)
+            self.playout_end = start + len(pcm_bytes) / self.bytes_per_second
+            self.chunks.append((now, start, self.playout_end, len(pcm_bytes)))
+
+    def close(self):
+        pass
+
+
+def run(args, filler: FillerPlayer):
+    rng = random.Random(0)
+    tts = ToneTTS(args.synth_ms, sample_rate=args.sample_rate, lookahead=1, filler=filler)
+    sink = PlayoutSink(args.sample_rate)
+    tts.write_to(sink)
+    if filler is not None:
+        # Startup synthesis of the clips
+        while len(filler.clips) < len(filler.phrases):
+            time.sleep(0.01)
+    response_latencies, perceived_latencies, cut_silences = [], [], []
+    for turn in range(args.turns):
+        with sink.lock:
+            sink.chunks.clear()
+        turn_start = time.time()
+        tts.handle_start()
+        time.sleep(rng.lognormvariate(np.log(args.ttft_ms / 1000), 0.5))
+        tts("Sure, here is what I found about that.")
+        tts("It takes a couple of sentences to say.")
+        time.sleep(args.turn_gap_ms / 1000)
+        with sink.lock:
+            chunks = list(sink.chunks)
+        # Response chunks are the sentence-sized ones, clip chunks are chunk_ms or a fade
+        response = [chunk for chunk in chunks if chunk[3] == 2 * args.sample_rate // 10]
+        if len(chunks) == 0 or len(response) == 0:
+            continue
+        perceived_latencies.append(chunks[0][1] - turn_start)
+        response_latencies.append(response[0][1] - turn_start)
+        clip_chunks = [chunk for chunk in chunks if chunk[3] != 2 * args.sample_rate // 10 and chunk[0] < response[0][0]]
+        # The clip was cut if the response arrived while it was still playing
+        if len(clip_chunks) > 0 and response[0][0] < clip_chunks[-1][2]:
+            cut_silences.append(max(0.0, response[0][1] - clip_chunks[-1][2]))
+    stats = tts.get_filler_stats()
+    tts.close()
+    return np.array(response_latencies), np.array(perceived_latencies), np.array(cut_silences), stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--ttft-ms", type=float, default=700)
+    parser.add_argument("--synth-ms", type=float, default=150)
+    parser.add_argument("--threshold", type=float, default=0.5)
+    parser.add_argument("--sample-rate", type=int, default=24000)
+    parser.add_argument("--turn-gap-ms", type=float, default=3000)
+    args = parser.parse_args()
+
+    for name in ("no filler", "filler"):
+        filler = FillerPlayer(threshold=args.threshold) if name == "filler" else None
+        response, perceived, cut_silences, stats = run(args, filler)
+        print(f"{name:>10}: response {1000 * response.mean():6.1f} ms mean / {1000 * np.percentile(response, 95):6.1f} ms p95, "
+              f"perceived {1000 * perceived.mean():6.1f} ms mean / {1000 * np.percentile(perceived, 95):6.1f} ms p95")
+        if filler is not None:
+            silence = f"{1000 * cut_silences.mean():.1f} ms" if len(cut_silences) > 0 else "-"
+            print(f"{'':>10}  {stats['played']} clips played, {stats['cut']} cut, {stats['completed']} completed, "
+                  f"{stats['skipped']} skipped, silence after a clip {silence}, predicted {stats['predicted_latency_ms']:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
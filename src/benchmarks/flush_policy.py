@@ -0,0 +1,125 @@
+"""
+Time to first sentence of a reply under each flush policy of OpenAIInferenceRun.
+
+Runs stream `--reply-text` from the local FakeOpenAIServer (`--ttft-ms`, `--token-ms`,
+and a `--stall-share` of the tokens `--stall-ms` late, the same ones for every policy),
+and their text goes through the flush policy into Stream2Sentence, as in a ChatBot. Per
+turn, the time from the request to the first text forwarded and to the first sentence out
+of Stream2Sentence are measured, and the number of times the run forwarded text
+(callbacks and queue hops downstream). Compared are the word count batching runs always
+did, forwarding every delta, and the SentenceFlushPolicy with and without its time budget.
+
+Run from the src directory:
+    python -m benchmarks.flush_policy --turns 40 --stall-share 0.15 --stall-ms 120
+"""
+import argparse
+import contextlib
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+from synapse.chatbot.engines.clients import PooledLLMClient
+from synapse.chatbot.engines.flush import SentenceFlushPolicy, WordCountFlushPolicy
+from synapse.chatbot.engines.openai import OpenAIInferenceRun
+from synapse.pipeline.sinks import DataSink
+from synapse.processors.nlp import Stream2Sentence
+from synapse.utils import GLOBAL_THREAD_POOL, AI_SPEECH_END_TOKEN
+from benchmarks.fake_openai import FakeOpenAIServer
+
+REPLY = ("Sure, that's a good question. Let me think about it for a second. The short answer is yes, "
+         "but it depends on how the rest of the setup looks. ")
+
+POLICIES = {
+    "word count 3": lambda: WordCountFlushPolicy(words=3),
+    "every delta": lambda: WordCountFlushPolicy(words=0),
+    "sentence": lambda: SentenceFlushPolicy(time_budget=None),
+    "sentence+30ms": lambda: SentenceFlushPolicy(time_budget=0.03),
+}
+
+
+class ForwardCounter:
+    def __init__(self, s2s: Stream2Sentence):
+        self.s2s = s2s
+        self.first_forward_time = None
+
+    def __call__(self, text: str):
+        if self.first_forward_time is None:
+            self.first_forward_time = time.time()
+        self.s2s(text)
+
+
+class SentenceSink(DataSink):
+    def __init__(self):
+        super(SentenceSink, self).__init__()
+        self.first_sentence = threading.Event()
+        self.first_sentence_time = None
+
+    def __call__(self, sentence: str):
+        # The end of the previous reply can come in after the next turn started
+        if sentence == AI_SPEECH_END_TOKEN:
+            return
+        if not self.first_sentence.is_set():
+            self.first_sentence_time = time.time()
+            self.first_sentence.set()
+
+    def close(self):
+        pass
+
+
+def run(policy, args):
+    server = FakeOpenAIServer(ttft_ms=args.ttft_ms, token_ms=args.token_ms, reply_text=args.reply_text,
+                              stall_share=args.stall_share, stall_ms=args.stall_ms).start()
+    client = PooledLLMClient(base_url=server.base_url, api_key="fake")
+    client.warm_up()
+    messages = [{"role": "system", "content": "You are a voice assistant."}, {"role": "user", "content": "hello"}]
+    s2s = Stream2Sentence(tokenizer="incremental")
+    sink = SentenceSink()
+    s2s.write_to(sink)
+    first_forwards, latencies, forwards = [], [], []
+    for _ in range(args.turns):
+        sink.first_sentence.clear()
+        done = threading.Event()
+        start = time.time()
+        run = OpenAIInferenceRun("fake", lambda: messages, GLOBAL_THREAD_POOL, max_tokens=args.reply_tokens,
+                                 client=client, flush_policy=policy)
+        counter = ForwardCounter(s2s)
+        run.flush(on_word_callback=counter, on_end_callback=done.set)
+        sink.first_sentence.wait(10)
+        latencies.append(sink.first_sentence_time - start)
+        first_forwards.append(counter.first_forward_time - start)
+        done.wait(10)
+        forwards.append(run.flush_policy.forwards)
+        s2s(AI_SPEECH_END_TOKEN)
+        time.sleep(args.turn_gap_ms / 1000)
+    s2s.close()
+    client.close()
+    server.stop()
+    return np.array(first_forwards), np.array(latencies), np.array(forwards)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=40)
+    parser.add_argument("--ttft-ms", type=float, default=150)
+    parser.add_argument("--token-ms", type=float, default=20)
+    parser.add_argument("--stall-share", type=float, default=0.15)
+    parser.add_argument("--stall-ms", type=float, default=120)
+    parser.add_argument("--reply-text", default=REPLY)
+    parser.add_argument("--reply-tokens", type=int, default=40)
+    parser.add_argument("--turn-gap-ms", type=float, default=50)
+    args = parser.parse_args()
+
+    results = {}
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for name, policy in POLICIES.items():
+            results[name] = run(policy, args)
+    for name, (first_forwards, latencies, forwards) in results.items():
+        print(f"{name:>14}: first text {1000 * first_forwards.mean():6.1f} ms, first sentence {1000 * latencies.mean():6.1f} ms mean / {1000 * np.percentile(latencies, 95):6.1f} ms p95, "
+              f"{forwards.mean():5.1f} forwards per reply", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Time to first token and decode speed of the local Hugging Face engine per configuration.
+
+Every configuration (dtype, int8 dynamic quantization, torch.compile) gets a fresh copy of
+the model through prepare_hf_model, then generates `--new-tokens` tokens after a prompt of
+`--prompt-tokens` tokens with each decoding strategy, after a warmup run (that is when
+torch.compile compiles). Reported: time to first token (the prefill), decode tokens/s
+after the first token, and the load/prepare time.
+
+Without --model, a randomly initialized Llama of --hidden/--layers runs on random prompt
+ids, so it works offline; what is measured is the same compute, not the text.
+
+Run from the src directory:
+    python -m benchmarks.hf_engine --configs fp32 int8 --decoding greedy sampling
+    python -m benchmarks.hf_engine --model Qwen/Qwen2.5-0.5B-Instruct --device cpu --configs fp32 int8 fp32-compile
+"""
+import argparse
+import copy
+import time
+
+import numpy as np
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer, LlamaConfig, LlamaForCausalLM
+from transformers.generation.streamers import BaseStreamer
+
+from synapse.chatbot.engines.huggingface import DecodingStrategy, HFEngineConfig, prepare_hf_model
+
+CONFIGS = {
+    "fp32": dict(dtype="float32"),
+    "bf16": dict(dtype="bfloat16"),
+    "fp16": dict(dtype="float16"),
+    "int8": dict(quantize=True),
+    "fp32-compile": dict(dtype="float32", compile=True),
+    "int8-compile": dict(quantize=True, compile=True),
+}
+
+
+class TimingStreamer(BaseStreamer):
+    def __init__(self):
+        self.times = []
+        self.is_prompt = True
+
+    def put(self, value):
+        # generate() passes the prompt first
+        if self.is_prompt:
+            self.is_prompt = False
+            return
+        self.times.append(time.perf_counter())
+
+    def end(self):
+        pass
+
+
+def make_base_model(args):
+    if args.model is not None:
+        return AutoModelForCausalLM.from_pretrained(args.model, torch_dtype=torch.float32), AutoTokenizer.from_pretrained(args.model)
+    torch.manual_seed(0)
+    config = LlamaConfig(vocab_size=32000, hidden_size=args.hidden, intermediate_size=int(2.75 * args.hidden),
+                         num_hidden_layers=args.layers, num_attention_heads=max(1, args.hidden // 64),
+                         num_key_value_heads=max(1, args.hidden // 256), max_position_embeddings=8192)
+    return LlamaForCausalLM(config), None
+
+
+def make_prompt(tokenizer, prompt_tokens: int, vocab_size: int) -> torch.LongTensor:
+    if tokenizer is None:
+        return torch.randint(100, vocab_size, (1, prompt_tokens), generator=torch.Generator().manual_seed(0))
+    text = "The quick brown fox jumps over the lazy dog. " * prompt_tokens
+    ids = tokenizer.apply_chat_template([{"role": "user", "content": text}], add_generation_prompt=True, return_tensors="pt")
+    return ids[:, -prompt_tokens:]
+
+
+def time_generation(model, input_ids, engine_config: HFEngineConfig, new_tokens: int):
+    streamer = TimingStreamer()
+    start = time.perf_counter()
+    model.generate(input_ids=input_ids, attention_mask=torch.ones_like(input_ids), max_new_tokens=new_tokens,
+                   min_new_tokens=new_tokens, streamer=streamer, pad_token_id=0, **engine_config.generation_kwargs())
+    times = streamer.times
+    ttft = times[0] - start
+    tokens_per_second = (len(times) - 1) / (times[-1] - times[0]) if len(times) > 1 else float("nan")
+    return ttft, tokens_per_second
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=None, help="Model name or path, a random Llama if not given")
+    parser.add_argument("--hidden", type=int, default=512)
+    parser.add_argument("--layers", type=int, default=8)
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--configs", nargs="+", default=["fp32", "int8"], choices=list(CONFIGS))
+    parser.add_argument("--decoding", nargs="+", default=[DecodingStrategy.GREEDY, DecodingStrategy.SAMPLING], choices=DecodingStrategy.ALL)
+    parser.add_argument("--prompt-tokens", type=int, default=512)
+    parser.add_argument("--new-tokens", type=int, default=64)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+
+    base_model, tokenizer = make_base_model(args)
+    base_model.eval()
+    input_ids = make_prompt(tokenizer, args.prompt_tokens, base_model.config.vocab_size)
+    print(f"{sum(p.numel() for p in base_model.parameters()) / 1e6:.1f}M parameters, prompt {input_ids.shape[1]} tokens, "
+          f"{args.new_tokens} new tokens, {torch.get_num_threads()} threads")
+    for name in args.configs:
+        start = time.perf_counter()
+        try:
+            model = prepare_hf_model(copy.deepcopy(base_model), HFEngineConfig(device=args.device, **CONFIGS[name]))
+        except Exception as e:
+            print(f"{name:>14}: unavailable ({e})")
+            continue
+        prepare_time = time.perf_counter() - start
+        device_ids = input_ids.to(model.device)
+        for decoding in args.decoding:
+            engine_config = HFEngineConfig(device=args.device, decoding=decoding, **CONFIGS[name])
+            try:
+                warmup_start = time.perf_counter()
+                time_generation(model, device_ids, engine_config, args.new_tokens)
+                warmup_time = time.perf_counter() - warmup_start
+                results = np.array([time_generation(model, device_ids, engine_config, args.new_tokens) for _ in range(args.repeat)])
+            except Exception as e:
+                print(f"{name:>14} {decoding:>11}: unavailable ({str(e).splitlines()[0][:100]})")
+                continue
+            print(f"{name:>14} {decoding:>11}: TTFT {1000 * results[:, 0].mean():8.1f} ms, "
+                  f"{results[:, 1].mean():7.1f} tokens/s, prepare {prepare_time:5.1f} s, warmup {warmup_time:5.1f} s")
+        del model
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Connection reuse and time to first token of the OpenAI/vLLM client, against the local
+FakeOpenAIServer.
+
+Every turn starts a few speculative runs that get cancelled after reading a chunk or two,
+like the runs started on interim words, then the answer run, flushed to the end. With
+`--connect-delay-ms` standing in for the TCP + TLS setup of a remote server, compared are
+a client as before (no warm up, connections lost to cancelled streams) and the pooled
+client (warmed up, pool refilled after a cancel).
+
+Run from the src directory:
+    python -m benchmarks.llm_client --turns 10 --connect-delay-ms 80
+"""
+import argparse
+import random
+import time
+
+from synapse.chatbot.engines.clients import PooledLLMClient
+from synapse.chatbot.engines.openai import OpenAIInferenceRun
+from synapse.utils import GLOBAL_THREAD_POOL
+from benchmarks.fake_openai import FakeOpenAIServer
+
+
+def run_session(client: PooledLLMClient, args) -> dict:
+    rng = random.Random(0)
+    messages = [{"role": "system", "content": "You are a voice assistant."}, {"role": "user", "content": "hello"}]
+    for turn in range(args.turns):
+        for _ in range(args.speculative):
+            run = OpenAIInferenceRun("fake", lambda: messages, GLOBAL_THREAD_POOL, max_tokens=args.max_tokens, client=client)
+            run.run_future.result()
+            for _, _ in zip(range(rng.randint(0, 2)), run.response):
+                pass
+            run.cancel()
+            time.sleep(args.word_gap_ms / 1000)
+        answer = OpenAIInferenceRun("fake", lambda: messages, GLOBAL_THREAD_POOL, max_tokens=args.max_tokens, client=client)
+        answer.flush(on_word_callback=lambda word: None)
+        answer.flush_future.result()
+        time.sleep(args.turn_gap_ms / 1000)
+    return client.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--speculative", type=int, default=3, help="Cancelled runs per turn")
+    parser.add_argument("--max-tokens", type=int, default=40)
+    parser.add_argument("--ttft-ms", type=float, default=40)
+    parser.add_argument("--token-ms", type=float, default=5)
+    parser.add_argument("--connect-delay-ms", type=float, default=80)
+    parser.add_argument("--word-gap-ms", type=float, default=150)
+    parser.add_argument("--turn-gap-ms", type=float, default=500)
+    args = parser.parse_args()
+
+    for name in ("as before", "pooled"):
+        server = FakeOpenAIServer(ttft_ms=args.ttft_ms, token_ms=args.token_ms, connect_delay_ms=args.connect_delay_ms).start()
+        if name == "pooled":
+            client = PooledLLMClient(base_url=server.base_url, api_key="EMPTY")
+            client.warm_up("fake")
+        else:
+            client = PooledLLMClient(base_url=server.base_url, api_key="EMPTY", refill_on_cancel=False)
+        stats = run_session(client, args)
+        client.close()
+        server.stop()
+        print(f"{name:>10}: TTFT {stats['ttft_mean_ms']:6.1f} ms mean / {stats['ttft_p95_ms']:6.1f} ms p95, "
+              f"{stats['requests']} requests on {stats['connections_opened']} connections, "
+              f"{stats['streams_cancelled']} streams cancelled, {stats['refills']} refill requests, server aborted {server.stats['aborted']}")
+
+
+if __name__ == "__main__":
+    main()
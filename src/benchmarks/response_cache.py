@@ -0,0 +1,115 @@
+"""
+Time from speech end to the first word of the reply with and without a ResponseCache.
+
+A ChatBot talks to the local FakeOpenAIServer (`--ttft-ms`, `--token-ms`, `--reply-tokens`). The user says
+`--turns` utterances, a `--repeat-share` of them short phrases drawn from a handful
+("okay", "thanks", "stop", "can you repeat that"), the others unique sentences. Each one
+is committed as a word batch, then speech ends and the reply is read to its end (and
+counts as played out) before the next turn. The cache keys on the utterance alone here (`context_messages=0`), as the
+fake server's replies don't depend on the conversation. Reported: mean and p95 time to
+the first word, and the cache stats.
+
+Run from the src directory:
+    python -m benchmarks.response_cache --turns 40
+"""
+import argparse
+import contextlib
+import os
+import random
+import sys
+import threading
+import time
+
+import numpy as np
+
+from synapse.config import config
+from synapse.chatbot.cache import ResponseCache
+from synapse.pipeline.sinks import DataSink
+from synapse.utils import AI_SPEECH_END_TOKEN
+from benchmarks.fake_openai import FakeOpenAIServer
+from benchmarks.stream2sentence import WORDS
+
+SHORT_PHRASES = ["okay", "thanks", "stop", "can you repeat that", "Okay.", "thanks!"]
+
+
+def make_utterances(args):
+    rng = random.Random(0)
+    utterances = []
+    for _ in range(args.turns):
+        if rng.random() < args.repeat_share:
+            utterances.append(rng.choice(SHORT_PHRASES))
+        else:
+            utterances.append(" ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 14))))
+    return utterances
+
+
+class ReplySink(DataSink):
+    def __init__(self):
+        super(ReplySink, self).__init__()
+        self.first_word = threading.Event()
+        self.reply_end = threading.Event()
+
+    def __call__(self, word: str):
+        if word == AI_SPEECH_END_TOKEN:
+            self.reply_end.set()
+        elif word.strip() != "":
+            self.first_word.set()
+
+    def close(self):
+        pass
+
+
+def run_session(utterances, response_cache: ResponseCache, args):
+    # Imported here, the client registry reads config.VLLM_BASE_URL on first use
+    from synapse.chatbot.simple import ChatBot
+    sink = ReplySink()
+    latencies = []
+    with ChatBot("fake", infer_on_new_words=True, response_cache=response_cache) as chatbot:
+        chatbot.write_to(sink)
+        for utterance in utterances:
+            sink.first_word.clear()
+            sink.reply_end.clear()
+            chatbot((utterance.split(), "Ashish", time.time()))
+            time.sleep(args.speech_ms / 1000)
+            start = time.time()
+            chatbot.handle_speech_end()
+            sink.first_word.wait(10)
+            latencies.append(time.time() - start)
+            sink.reply_end.wait(10)
+            # No TTS here, the reply is heard as soon as it is read
+            chatbot.handle_playback_end(chatbot.epoch_clock.value)
+            time.sleep(args.gap_ms / 1000)
+    return np.array(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=40)
+    parser.add_argument("--repeat-share", type=float, default=0.4)
+    parser.add_argument("--ttft-ms", type=float, default=250)
+    parser.add_argument("--token-ms", type=float, default=10)
+    parser.add_argument("--reply-tokens", type=int, default=30)
+    parser.add_argument("--speech-ms", type=float, default=300)
+    parser.add_argument("--gap-ms", type=float, default=100)
+    args = parser.parse_args()
+
+    utterances = make_utterances(args)
+    server = FakeOpenAIServer(ttft_ms=args.ttft_ms, token_ms=args.token_ms, reply_tokens=args.reply_tokens).start()
+    config.VLLM_BASE_URL = server.base_url
+    results = {}
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for name in ("no cache", "response cache"):
+            response_cache = ResponseCache(context_messages=0) if name == "response cache" else None
+            results[name] = (run_session(utterances, response_cache, args), response_cache.stats() if response_cache is not None else None)
+    server.stop()
+    for name, (latencies, stats) in results.items():
+        print(f"{name:>15}: first word {1000 * latencies.mean():6.1f} ms mean / {1000 * np.percentile(latencies, 95):6.1f} ms p95",
+              file=sys.stderr)
+        if stats is not None:
+            print(f"{'':>15}  {stats['hits']} hits, {stats['misses']} misses, {stats['uncacheable']} uncacheable, "
+                  f"saved {1000 * stats['mean_latency_saved']:.1f} ms per hit, replay {1000 * stats['mean_replay_latency']:.2f} ms",
+                  file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Benchmark of the generate_sentences tokenizer backends on long LLM outputs.
+
+Two shapes of output are measured at growing lengths: regular prose, where the buffer
+is cut after every sentence, and run-on text (lists and clauses without full stops),
+where the buffer keeps growing and whole-buffer re-tokenization turns quadratic.
+
+Run from the src directory:
+    python -m benchmarks.sentence_segmenter --tokenizers nltk incremental
+"""
+import argparse
+import random
+import time
+
+import synapse.utils.stream2sentence as s2s
+from benchmarks.stream2sentence import WORDS, make_deltas, make_response
+
+
+def make_run_on(num_clauses: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    clauses = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 10))) for _ in range(num_clauses)]
+    return "Here is the list: " + ", ".join(clauses) + "."
+
+
+def run_once(deltas: list, tokenizer: str) -> dict:
+    start = time.perf_counter()
+    first_sentence_at = None
+    sentences = 0
+    for _ in s2s.generate_sentences(iter(deltas), tokenizer=tokenizer):
+        if first_sentence_at is None:
+            first_sentence_at = time.perf_counter() - start
+        sentences += 1
+    elapsed = time.perf_counter() - start
+    return {
+        "elapsed_ms": 1000 * elapsed,
+        "chars_per_sec": sum(len(d) for d in deltas) / elapsed,
+        "time_to_first_sentence_ms": 1000 * (first_sentence_at or elapsed),
+        "sentences": sentences,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokenizers", nargs="+", default=["nltk", "incremental"])
+    parser.add_argument("--sizes", nargs="+", type=int, default=[50, 200, 400])
+    args = parser.parse_args()
+
+    for tokenizer in args.tokenizers:
+        s2s.init_tokenizer(tokenizer)
+
+    shapes = {"prose": make_response, "run-on": make_run_on}
+    for shape, make_text in shapes.items():
+        for size in args.sizes:
+            deltas = make_deltas(make_text(size))
+            chars = sum(len(d) for d in deltas)
+            for tokenizer in args.tokenizers:
+                r = run_once(deltas, tokenizer)
+                print(f"{shape:>7} {chars:>7} chars {tokenizer:>12}: "
+                      f"{r['elapsed_ms']:10.1f} ms, {r['chars_per_sec']:>12,.0f} chars/s, "
+                      f"first sentence {r['time_to_first_sentence_ms']:8.2f} ms, {r['sentences']} sentences")
+
+
+if __name__ == "__main__":
+    main()
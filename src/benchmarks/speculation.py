@@ -0,0 +1,198 @@
+"""
+Simulation of the speculative LLM runs started while the user speaks.
+
+Utterances arrive as STT word batches at a speaking pace with jitter and pauses. They go
+either to the previous scheme, a run cancelled and restarted on every batch, or to
+SpeculativeRunScheduler. Runs hit a simulated server: prefill costs per prompt token, a
+token is decoded every `--decode-ms` after that, and a server slot stays taken until the
+run is cancelled or done. Reported: runs started and cancelled, the tokens spent on runs
+that were never spoken, the peak of concurrent runs, and the time from speech end to the
+first token of the answer.
+
+Run from the src directory:
+    python -m benchmarks.speculation --utterances 20
+    python -m benchmarks.speculation --max-in-flight 1 --reuse-max-words 1
+"""
+import argparse
+import random
+import threading
+import time
+
+import numpy as np
+
+from synapse.chatbot.engines.scheduler import SpeculativeRunScheduler, estimate_prompt_tokens
+from synapse.chatbot.engines.types import InferenceRun
+from synapse.utils import GLOBAL_THREAD_POOL
+from benchmarks.stream2sentence import WORDS
+
+
+class SimulatedServer:
+    def __init__(self, prefill_ms_per_token: float, decode_ms: float, max_tokens: int):
+        self.prefill = prefill_ms_per_token / 1000
+        self.decode = decode_ms / 1000
+        self.max_tokens = max_tokens
+        self.lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+
+    def enter(self):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+
+    def leave(self):
+        with self.lock:
+            self.active -= 1
+
+
+class SimulatedRun(InferenceRun):
+    def __init__(self, server: SimulatedServer, prior_fetcher):
+        super(SimulatedRun, self).__init__("simulated", prior_fetcher, GLOBAL_THREAD_POOL)
+        self.server = server
+        self.stopped = threading.Event()
+        self.first_token = threading.Event()
+        self.run_future = self.thread_pool.submit(self.__generate)
+        self.lock.release()
+
+    def __generate(self):
+        self.prompt = self.prior_fetcher()
+        self.server.enter()
+        try:
+            if self.stopped.wait(self.server.prefill * estimate_prompt_tokens(self.prompt)):
+                return
+            self.first_token.set()
+            while self.generated_tokens < self.server.max_tokens and not self.stopped.wait(self.server.decode):
+                self.generated_tokens += 1
+        finally:
+            self.server.leave()
+
+    def flush(self, on_start_callback=None, on_end_callback=None, on_word_callback=None):
+        self.flush_future = self.thread_pool.submit(self.first_token.wait)
+
+    def cancel(self):
+        self.cancelled = True
+        self.stopped.set()
+
+    def is_in_flight(self):
+        return not self.run_future.done()
+
+
+class SimulatedGenerator:
+    tokenizer = None
+
+    def __init__(self, server: SimulatedServer):
+        self.server = server
+        self.current_run = None
+        self.lock = threading.Lock()
+
+    def generate(self, prior_fetcher, on_run_start=None):
+        with self.lock:
+            if self.current_run is not None:
+                self.current_run.cancel()
+            self.current_run = SimulatedRun(self.server, prior_fetcher)
+            return self.current_run
+
+
+class RestartEveryBatch:
+    """
+    The previous scheme: cancel and start a run on every word batch.
+    """
+    def __init__(self, generator: SimulatedGenerator, prior_fetcher):
+        self.generator = generator
+        self.prior_fetcher = prior_fetcher
+        self.runs = []
+
+    def notify_words(self, arrived_time=None):
+        self.runs.append(self.generator.generate(self.prior_fetcher))
+
+    def take_run(self):
+        run = self.generator.current_run
+        if run is None or run.is_cancelled():
+            run = self.generator.generate(self.prior_fetcher)
+            self.runs.append(run)
+        return run
+
+    def stats(self):
+        wasted = [run for run in self.runs if run.is_cancelled() and run.flush_future is None]
+        return {"started": len(self.runs), "cancelled": len(wasted),
+                "wasted_prompt_tokens": sum(estimate_prompt_tokens(run.prompt) for run in wasted),
+                "wasted_generated_tokens": sum(run.generated_tokens for run in wasted)}
+
+    def close(self):
+        pass
+
+
+def make_utterances(count: int, seed=0):
+    rng = random.Random(seed)
+    return [[rng.choice(WORDS) for _ in range(rng.randint(3, 25))] for _ in range(count)]
+
+
+def run(make_scheduler, utterances, args) -> dict:
+    server = SimulatedServer(args.prefill_ms_per_token, args.decode_ms, args.max_tokens)
+    generator = SimulatedGenerator(server)
+    history = [{"role": "system", "content": "x" * 4 * args.system_tokens}]
+    transcript = {"role": "user", "content": ""}
+    context = lambda: history + [dict(transcript)]
+    scheduler = make_scheduler(generator, context)
+    rng = random.Random(1)
+    latencies = []
+    for words in utterances:
+        transcript["content"] = ""
+        index = 0
+        while index < len(words):
+            batch = words[index:index + rng.choice([1, 1, 1, 2, 3])]
+            index += len(batch)
+            transcript["content"] += " " + " ".join(batch)
+            scheduler.notify_words(time.time())
+            # A pause mid sentence now and then
+            pause = rng.uniform(0.3, 0.8) if rng.random() < 0.1 else 0.0
+            time.sleep(max(0.0, rng.gauss(args.word_ms / 1000, args.word_ms / 4000)) * len(batch) + pause)
+        # Speech end comes after the VAD's hangover
+        time.sleep(args.speech_end_ms / 1000)
+        speech_end = time.time()
+        answer = scheduler.take_run()
+        answer.flush()
+        answer.first_token.wait()
+        latencies.append(time.time() - speech_end)
+        history += [dict(transcript), {"role": "assistant", "content": "y" * 200}]
+        time.sleep(args.turn_gap_ms / 1000)
+        answer.cancel()
+    time.sleep(0.2)
+    stats = scheduler.stats()
+    scheduler.close()
+    latencies = 1000 * np.array(latencies)
+    return dict(stats, peak_in_flight=server.peak, latency_mean_ms=float(latencies.mean()),
+                latency_p95_ms=float(np.percentile(latencies, 95)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--utterances", type=int, default=10)
+    parser.add_argument("--word-ms", type=float, default=180, help="Mean time between words")
+    parser.add_argument("--speech-end-ms", type=float, default=300, help="Silence before speech end (VADGate hangover)")
+    parser.add_argument("--turn-gap-ms", type=float, default=300)
+    parser.add_argument("--system-tokens", type=int, default=600)
+    parser.add_argument("--prefill-ms-per-token", type=float, default=0.1)
+    parser.add_argument("--decode-ms", type=float, default=15)
+    parser.add_argument("--max-tokens", type=int, default=200)
+    parser.add_argument("--max-in-flight", type=int, default=2)
+    parser.add_argument("--reuse-max-words", type=int, default=0)
+    args = parser.parse_args()
+
+    utterances = make_utterances(args.utterances)
+    print(f"{args.utterances} utterances, {sum(len(words) for words in utterances)} words")
+    schemes = {
+        "restart every batch": RestartEveryBatch,
+        "scheduler": lambda generator, context: SpeculativeRunScheduler(
+            generator, context, max_in_flight=args.max_in_flight, reuse_max_words=args.reuse_max_words),
+    }
+    for name, make_scheduler in schemes.items():
+        r = run(make_scheduler, utterances, args)
+        print(f"{name:>20}: started {r['started']:4d}, cancelled {r['cancelled']:4d}, "
+              f"wasted {r['wasted_prompt_tokens']:6d} prompt + {r['wasted_generated_tokens']:5d} generated tokens, "
+              f"peak in flight {r['peak_in_flight']}, "
+              f"first token {r['latency_mean_ms']:6.1f} ms mean / {r['latency_p95_ms']:6.1f} ms p95")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Micro-benchmark for Stream2Sentence ingestion: one queue put per character (the old path)
+versus one queue put per LLM delta.
+
+Run from the src directory:
+    python -m benchmarks.stream2sentence --sentences 200 --repeat 5
+"""
+from queue import Queue
+import argparse
+import random
+import statistics
+import threading
+import time
+
+import synapse.utils.stream2sentence as s2s
+
+WORDS = (
+    "the voice assistant answers quickly and naturally while the user keeps talking about "
+    "machine learning models streaming audio latency budgets and other interesting topics"
+).split()
+
+
+def make_response(num_sentences: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    sentences = []
+    for _ in range(num_sentences):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(6, 18))]
+        sentences.append(" ".join(words).capitalize() + rng.choice([".", "!", "?", ",", "."]))
+    return " ".join(sentences)
+
+
+def make_deltas(text: str, seed: int = 0) -> list:
+    """
+    Split text the way an LLM stream does, a few characters per delta.
+    """
+    rng = random.Random(seed)
+    deltas, i = [], 0
+    while i < len(text):
+        n = rng.randint(2, 7)
+        deltas.append(text[i:i + n])
+        i += n
+    return deltas
+
+
+def run_once(deltas: list, per_char: bool, tokenizer: str) -> dict:
+    queue = Queue()
+
+    def producer():
+        for delta in deltas:
+            if per_char:
+                for char in delta:
+                    queue.put(char)
+            else:
+                queue.put(delta)
+        queue.put(None)
+
+    def chunks():
+        while True:
+            item = queue.get()
+            queue.task_done()
+            if item is None:
+                return
+            yield item
+
+    start = time.perf_counter()
+    first_sentence_at = None
+    sentences = []
+    thread = threading.Thread(target=producer)
+    thread.start()
+    for sentence in s2s.generate_sentences(chunks(), tokenizer=tokenizer):
+        if first_sentence_at is None:
+            first_sentence_at = time.perf_counter() - start
+        sentences.append(sentence)
+    elapsed = time.perf_counter() - start
+    thread.join()
+    chars = sum(len(d) for d in deltas)
+    return {
+        "chars_per_sec": chars / elapsed,
+        "time_to_first_sentence_ms": 1000 * (first_sentence_at or elapsed),
+        "sentences": sentences,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sentences", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--tokenizer", default="nltk")
+    args = parser.parse_args()
+
+    s2s.init_tokenizer(args.tokenizer)
+    deltas = make_deltas(make_response(args.sentences))
+    results = {}
+    for label, per_char in (("per-char (before)", True), ("chunked (after)", False)):
+        runs = [run_once(deltas, per_char, args.tokenizer) for _ in range(args.repeat)]
+        results[label] = runs
+        print(f"{label:>18}: "
+              f"{statistics.median(r['chars_per_sec'] for r in runs):>12,.0f} chars/s, "
+              f"first sentence {statistics.median(r['time_to_first_sentence_ms'] for r in runs):8.2f} ms")
+    before, after = (runs[0]["sentences"] for runs in results.values())
+    print(f"same sentence boundaries: {before == after} ({len(after)} sentences)")
+
+
+if __name__ == "__main__":
+    main()
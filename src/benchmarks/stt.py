@@ -0,0 +1,74 @@
+"""
+Offline benchmark of the local STT engine on recorded audio.
+
+Every WAV file (16 bit PCM) goes through the same conversion as the mic audio of the agents
+(mono 16 kHz) and is fed to VoskSTTStreamer in mic sized chunks, as fast as possible.
+Reported per file: the real time factor, the processing time of the chunk that produced
+each new word (the latency recognition adds on top of the audio itself), how long closing
+the utterance takes on a local speech end, and the transcript.
+
+Run from the src directory:
+    python -m benchmarks.stt recording.wav --model-path models/vosk-model-small-en-us-0.15
+"""
+import argparse
+import time
+
+import numpy as np
+
+from synapse.pipeline.audio import PCMConverter
+from synapse.stt.vosk import VoskSTTStreamer, get_vosk_model
+from benchmarks.vad import read_wav
+
+
+def run_file(path: str, model_path: str, lang: str, chunk_ms: int, sample_rate: int) -> dict:
+    pcm, rate, channels = read_wav(path)
+    pcm = PCMConverter(rate, channels, out_rate=sample_rate, out_channels=1).convert(pcm)
+    stt = VoskSTTStreamer(1, sample_rate, model_path=model_path, lang=lang)
+    words = []
+    word_latencies = []
+    chunk_cost = [0.0]
+    stt.on("new_words", lambda new_words, *_: (words.extend(new_words), word_latencies.append(chunk_cost[0])))
+    chunk_bytes = 2 * int(sample_rate * chunk_ms / 1000)
+    for offset in range(0, len(pcm), chunk_bytes):
+        start = time.perf_counter()
+        stt(pcm[offset:offset + chunk_bytes])
+        chunk_cost[0] = time.perf_counter() - start
+    start = time.perf_counter()
+    stt.handle_local_speech_end()
+    final_ms = 1000 * (time.perf_counter() - start)
+    stats = stt.get_recognition_stats()
+    stt.close()
+    latencies = 1000 * np.array(word_latencies or [0.0])
+    return {
+        "seconds": stats["audio_seconds"],
+        "real_time_factor": stats["real_time_factor"],
+        "word_latency_mean_ms": float(latencies.mean()),
+        "word_latency_p95_ms": float(np.percentile(latencies, 95)),
+        "final_ms": final_ms,
+        "transcript": " ".join(word for word in words if not word.startswith("<!")),
+        "revisions": sum(word.startswith("<!") for word in words),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("wavs", nargs="+")
+    parser.add_argument("--model-path", default=None)
+    parser.add_argument("--lang", default="en-us")
+    parser.add_argument("--chunk-ms", type=int, default=20)
+    parser.add_argument("--sample-rate", type=int, default=16000)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    get_vosk_model(args.model_path, args.lang)
+    print(f"model loaded in {time.perf_counter() - start:.2f} s")
+    for path in args.wavs:
+        r = run_file(path, args.model_path, args.lang, args.chunk_ms, args.sample_rate)
+        print(f"{path}: {r['seconds']:.1f} s of audio, RTF {r['real_time_factor']:.3f}, "
+              f"word latency {r['word_latency_mean_ms']:.1f} ms mean / {r['word_latency_p95_ms']:.1f} ms p95, "
+              f"final {r['final_ms']:.1f} ms, {r['revisions']} revisions")
+        print(f"  {r['transcript']}")
+
+
+if __name__ == "__main__":
+    main()
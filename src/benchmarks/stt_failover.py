@@ -0,0 +1,108 @@
+"""
+Failure scenarios of DeepgramConnectionManager against the local FakeDeepgramServer.
+
+Audio is streamed in real time, in 20 ms frames that carry their index, while the server
+drops the streaming socket, refuses reconnects, stalls or goes idle. The words that came
+back tell which audio got transcribed: reported are the words lost at the seams, the
+words committed twice by the transcript (the replayed audio overlaps what the lost socket
+had transcribed already), the reconnect latencies and the manager's counters, with and without replay and standby.
+
+Run from the src directory:
+    python -m benchmarks.stt_failover --seconds 12
+    python -m benchmarks.stt_failover --replay-ms 0 --no-standby
+"""
+import argparse
+import threading
+import time
+
+from synapse.stt.deepgram import DeepgramConnectionManager, DeepgramTranscriptManager, make_deepgram_client
+from benchmarks.fake_deepgram import FakeDeepgramServer, encode_frame
+
+SAMPLE_RATE = 16000
+FRAME_MS = 20
+
+
+class CommittedWords(DeepgramTranscriptManager):
+    """
+    The transcript of DeepgramSTTStreamer, keeping the committed words.
+    """
+    def __init__(self):
+        super(CommittedWords, self).__init__()
+        self.words = []
+        self.on_new_words(lambda *x: None)
+        self.on_sentence_end(lambda: None)
+        self.on_speech_final(lambda x: None)
+
+    def commit_text(self, text, speaker="Ashish", arrived_time: float=None):
+        self.words += [word for word in text if not word.startswith("<!")]
+
+    def handle_reconnect(self):
+        with self.transcript_response_lock:
+            self.finalize_sentence()
+
+
+def run(args) -> dict:
+    server = FakeDeepgramServer(sample_rate=SAMPLE_RATE, frame_ms=FRAME_MS, latency_ms=args.latency_ms).start()
+    server.connect_delay = args.connect_delay_ms / 1000
+    words = set()
+    lock = threading.Lock()
+    transcript = CommittedWords()
+    def on_message(result, arrived_time):
+        with lock:
+            words.update(int(word.word[1:]) for word in result.channel.alternatives[0].words)
+        transcript.handle_transcript_response(result, arrived_time)
+    manager = DeepgramConnectionManager(on_message, 1, SAMPLE_RATE, client=make_deepgram_client(server.url),
+                                        on_reconnect=transcript.handle_reconnect,
+                                        warm_standby=not args.no_standby, replay_ms=args.replay_ms,
+                                        keepalive_interval=1.0, response_timeout=args.response_timeout)
+    # (second, description, action)
+    scenario = [
+        (0.2 * args.seconds, "drop the streaming socket", server.drop_streaming),
+        (0.4 * args.seconds, "drop every socket, refuse 2 connects", lambda: (server.refuse_connections(2), server.drop_all())),
+        (0.6 * args.seconds, "stall for 2x the response timeout", lambda: server.stall(2 * args.response_timeout)),
+    ]
+    frame_bytes = 2 * SAMPLE_RATE * FRAME_MS // 1000
+    frames = int(args.seconds * 1000 / FRAME_MS)
+    start = time.time()
+    for index in range(frames):
+        while scenario and index * FRAME_MS / 1000 >= scenario[0][0]:
+            at, description, action = scenario.pop(0)
+            print(f"  {at:5.1f}s: {description}")
+            action()
+        manager.send(encode_frame(index, frame_bytes))
+        time.sleep(max(0.0, start + (index + 1) * FRAME_MS / 1000 - time.time()))
+    manager.finalize()
+    time.sleep(2 * args.latency_ms / 1000 + 0.5)
+    stats = manager.stats()
+    manager.finish()
+    server.stop()
+    expected = set(range(frames // 10))
+    missing = sorted(expected - words)
+    duplicated = len(transcript.words) - len(set(transcript.words))
+    return {"missing": missing, "duplicated": duplicated, "expected": len(expected), "stats": stats, "server": server.stats}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=12.0)
+    parser.add_argument("--replay-ms", type=int, default=300)
+    parser.add_argument("--no-standby", action="store_true")
+    parser.add_argument("--latency-ms", type=int, default=300, help="Delay of the server's results")
+    parser.add_argument("--connect-delay-ms", type=int, default=150, help="Handshake latency of the server")
+    parser.add_argument("--response-timeout", type=float, default=1.0)
+    args = parser.parse_args()
+
+    print(f"replay {args.replay_ms} ms, standby {'off' if args.no_standby else 'on'}")
+    r = run(args)
+    stats = r["stats"]
+    print(f"words lost: {len(r['missing'])} of {r['expected']} {r['missing']}")
+    print(f"words committed twice: {r['duplicated']}")
+    print(f"connect: {stats['connect']}")
+    print(f"reconnect: {stats['reconnect']}")
+    print(f"reconnects {stats['reconnects']}, standby swaps {stats['standby_swaps']}, errors {stats['errors']}, "
+          f"replayed {stats['bytes_replayed']} B, dropped {stats['bytes_dropped']} B")
+    print(f"server: {r['server']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Per word cost of committing to the GlobalTranscript over a long session.
+
+Alternates user turns of `--user-words` words and assistant turns of `--bot-words` LLM
+deltas for `--turns` turns, writing the transcript file to a temporary directory and the
+console output to /dev/null. After every `--read-every` commits the context is read the
+way the LLM runs read it (the current text and get_transcript). Reported: commit time per
+word (mean, p50, p99, max) for the first and the last tenth of the session, read time,
+and the time until everything is rendered.
+
+The transcript log is rotated every `--max-bytes` to exercise rotation and compression.
+
+`--transcript-class module:Class` benchmarks another implementation with the same
+interface, e.g. a copy of an older GlobalTranscript.
+
+Run from the src directory:
+    python -m benchmarks.transcript --turns 400
+"""
+import argparse
+import contextlib
+import importlib
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+
+def load_class(path: str):
+    module, name = path.split(":")
+    return getattr(importlib.import_module(module), name)
+
+
+def percentiles(values) -> str:
+    values = 1e6 * np.array(values)
+    return (f"mean {values.mean():6.2f} us, p50 {np.percentile(values, 50):6.2f} us, "
+            f"p99 {np.percentile(values, 99):7.2f} us, max {values.max():8.1f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=400)
+    parser.add_argument("--user-words", type=int, default=30)
+    parser.add_argument("--bot-words", type=int, default=120)
+    parser.add_argument("--read-every", type=int, default=5)
+    parser.add_argument("--max-bytes", type=int, default=1024 * 1024)
+    parser.add_argument("--transcript-class", default="synapse.chatbot.states.global_transcript:GlobalTranscript")
+    args = parser.parse_args()
+
+    transcript_class = load_class(args.transcript_class)
+    commit_times, read_times = [], []
+    with tempfile.TemporaryDirectory() as directory, open(os.devnull, "w") as devnull:
+        with contextlib.redirect_stdout(devnull):
+            path = os.path.join(directory, "transcript.jsonl")
+            if "log_options" in transcript_class.__init__.__code__.co_varnames:
+                transcript = transcript_class(path, log_options={"max_bytes": args.max_bytes})
+            else:
+                transcript = transcript_class(path)
+            for turn in range(args.turns):
+                for speaker, words, is_ai in (("Ashish", args.user_words, False), ("Ratchel", args.bot_words, True)):
+                    for index in range(words):
+                        start = time.perf_counter()
+                        transcript.commit_word(f" word{index}", speaker, time.time(), is_ai)
+                        commit_times.append(time.perf_counter() - start)
+                        if len(commit_times) % args.read_every == 0:
+                            start = time.perf_counter()
+                            transcript.current_text
+                            transcript.get_transcript()
+                            read_times.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            if hasattr(transcript, "render_thread"):
+                transcript.sync()
+            drain_time = time.perf_counter() - start
+            messages = len(transcript.get_transcript())
+            transcript.close()
+            log_stats = transcript.transcript_log.stats() if getattr(transcript, "transcript_log", None) is not None else None
+            files = sorted(os.listdir(directory))
+    tenth = max(1, len(commit_times) // 10)
+    print(f"{args.transcript_class.split(':')[0]}: {len(commit_times)} words in {messages} messages", file=sys.stderr)
+    print(f"  commit, first tenth: {percentiles(commit_times[:tenth])}", file=sys.stderr)
+    print(f"  commit, last tenth:  {percentiles(commit_times[-tenth:])}", file=sys.stderr)
+    print(f"  read:                {percentiles(read_times)}", file=sys.stderr)
+    print(f"  render backlog drained in {1000 * drain_time:.1f} ms", file=sys.stderr)
+    if log_stats is not None:
+        print(f"  log: {log_stats['records']} records in {log_stats['batches']} batches, {log_stats['bytes'] / 1e6:.1f} MB, "
+              f"{log_stats['rotations']} rotations, files {files}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
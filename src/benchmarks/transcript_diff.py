@@ -0,0 +1,130 @@
+"""
+Benchmark of the transcript diffing of TranscriptManager (used by DeepgramTranscriptManager)
+on streams of interim results.
+
+Streams are replayed from recordings made with DeepgramSTTStreamer(record_path=...), one
+JSON result per line, or synthesized: one long utterance with an interim result per word,
+the last word sometimes misheard and corrected by the next result, and an is_final every
+`--segment` words (0 for never, the worst case). Each stream goes through the current
+manager and through the previous word by word implementation, which must commit the same.
+
+Run from the src directory:
+    python -m benchmarks.transcript_diff --words 500 2000 --segment 0 40
+    python -m benchmarks.transcript_diff --recordings session.jsonl
+"""
+import argparse
+import json
+import random
+import time
+from types import SimpleNamespace
+
+from synapse.stt.common import TranscriptManager, TranscriptWord
+from benchmarks.stream2sentence import WORDS
+
+
+class ReplayManager(TranscriptManager):
+    def __init__(self):
+        super(ReplayManager, self).__init__()
+        self.committed = []
+        self.on_new_words(lambda *x: None)
+        self.on_sentence_end(lambda: None)
+        self.on_speech_final(lambda x: None)
+
+    def commit_text(self, text, speaker="Ashish", arrived_time=None):
+        self.committed.append(text)
+
+    def replay(self, results):
+        for words, is_final, speech_final in results:
+            self.handle_hypothesis(words, 0.0, is_final=is_final, speech_final=speech_final)
+
+
+class WordByWordManager(ReplayManager):
+    """
+    The diff as it was: word objects kept as they came, compared from index 0 every time.
+    """
+    def handle_hypothesis(self, words, arrived_time, is_final=False, speech_final=False, from_finalize=None):
+        with self.transcript_response_lock:
+            if len(words) == 0:
+                self.finalize_sentence()
+                return
+            identity_length = 0
+            for i in range(min(len(words), len(self.uncommitted_words))):
+                if words[i].word == self.uncommitted_words[i].word:
+                    identity_length += 1
+                else:
+                    break
+            new_words = words[identity_length:]
+            if len(new_words) > 0:
+                self.handle_new_words([i.punctuated_word for i in new_words], arrived_time=arrived_time)
+            mispredicted_words = self.uncommitted_words[identity_length:]
+            if len(mispredicted_words) > 0:
+                self.handle_new_words([f"<!{' '.join([i.punctuated_word for i in mispredicted_words])}, iter={identity_length}>"])
+            self.uncommitted_words = words
+            if is_final:
+                self.finalize_sentence()
+            if speech_final:
+                self.finalize_speech()
+
+
+def make_stream(num_words: int, segment: int, revise_rate=0.2, seed=0):
+    rng = random.Random(seed)
+    results = []
+    current = []
+    for index in range(num_words):
+        word = rng.choice(WORDS)
+        if rng.random() < revise_rate:
+            # Misheard first, corrected by the next result
+            results.append((current + [TranscriptWord(word + "s", word + "s")], False, False))
+        current = current + [TranscriptWord(word, word.capitalize() if index == 0 else word)]
+        is_final = segment > 0 and len(current) >= segment
+        results.append((current, is_final, False))
+        if is_final:
+            current = []
+    results.append((current, True, True))
+    return results
+
+
+def load_recording(path: str):
+    results = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            result = json.loads(line)
+            words = [SimpleNamespace(**word) for word in result["channel"]["alternatives"][0]["words"]]
+            results.append((words, result.get("is_final", False), result.get("speech_final", False)))
+    return results
+
+
+def time_replay(manager_class, results, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        manager = manager_class()
+        start = time.perf_counter()
+        manager.replay(results)
+        best = min(best, time.perf_counter() - start)
+    return best, manager.committed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recordings", nargs="*", default=[])
+    parser.add_argument("--words", nargs="+", type=int, default=[200, 1000, 4000])
+    parser.add_argument("--segment", nargs="+", type=int, default=[0, 40])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    streams = [(path, load_recording(path)) for path in args.recordings]
+    if not streams:
+        for segment in args.segment:
+            for num_words in args.words:
+                streams.append((f"{num_words} words, is_final every {segment or 'never'}", make_stream(num_words, segment)))
+
+    for name, results in streams:
+        old_time, old_committed = time_replay(WordByWordManager, results, args.repeat)
+        new_time, new_committed = time_replay(ReplayManager, results, args.repeat)
+        assert new_committed == old_committed, f"{name}: committed words differ"
+        print(f"{name:>40}: {len(results):>6} results, word by word {1000 * old_time:9.2f} ms, "
+              f"incremental {1000 * new_time:9.2f} ms ({old_time / new_time:5.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
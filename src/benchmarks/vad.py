@@ -0,0 +1,121 @@
+"""
+Offline benchmark of the VADGate in front of STT on recorded audio.
+
+Every WAV file (16 bit PCM) is fed to the gate in mic sized chunks as fast as possible.
+Reported per file: how much audio would have been streamed to STT, the detected speech
+segments, when speech end was detected relative to the server endpointing it replaces,
+and the CPU cost per chunk. Without files, a synthetic recording (noise with bursts of
+modulated tones at known times) is used.
+
+Run from the src directory:
+    python -m benchmarks.vad recording1.wav recording2.wav --onnx-model silero_vad.onnx
+"""
+import argparse
+import time
+import wave
+
+import numpy as np
+
+from synapse.pipeline.streamers import VADGate
+from synapse.pipeline.vad import EnergyVAD, OnnxVAD
+
+
+def read_wav(path: str):
+    with wave.open(path, "rb") as f:
+        if f.getsampwidth() != 2:
+            raise ValueError(f"{path}: only 16 bit PCM is supported")
+        return f.readframes(f.getnframes()), f.getframerate(), f.getnchannels()
+
+
+def make_recording(sample_rate=16000, seconds=20.0, seed=0):
+    """
+    Returns the PCM and the (start, end) seconds of its speech-like bursts.
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(sample_rate * seconds)) / sample_rate
+    signal = rng.normal(0, 0.003, len(t))
+    segments = []
+    start = 1.0
+    while start < seconds - 2.0:
+        end = start + rng.uniform(0.6, 2.5)
+        mask = (t >= start) & (t < end)
+        # Voiced sound: a few harmonics, amplitude modulated at a syllable rate
+        burst = sum(np.sin(2 * np.pi * f * t[mask]) for f in (180, 360, 540)) / 3
+        burst *= 0.2 * (0.6 + 0.4 * np.sin(2 * np.pi * 4 * t[mask]))
+        signal[mask] += burst
+        segments.append((start, end))
+        start = end + rng.uniform(0.8, 3.0)
+    pcm = (np.clip(signal, -1, 1) * 32767).astype(np.int16).tobytes()
+    return pcm, sample_rate, 1, segments
+
+
+def run_gate(gate: VADGate, pcm: bytes, sample_rate: int, channels: int, chunk_ms: int) -> dict:
+    chunk_bytes = 2 * channels * int(sample_rate * chunk_ms / 1000)
+    position = [0.0]
+    events = []
+    gate.on("speech_start", lambda: events.append(("start", position[0])))
+    gate.on("speech_end", lambda: events.append(("end", position[0])))
+    costs = []
+    for offset in range(0, len(pcm), chunk_bytes):
+        chunk = pcm[offset:offset + chunk_bytes]
+        position[0] = (offset + len(chunk)) / (2 * channels * sample_rate)
+        start = time.perf_counter()
+        gate(chunk)
+        costs.append(time.perf_counter() - start)
+    segments = []
+    for kind, at in events:
+        if kind == "start":
+            segments.append([at, None])
+        elif segments:
+            segments[-1][1] = at
+    costs = np.array(costs) * 1e6
+    return {"segments": segments, "stats": gate.get_vad_stats(),
+            "cost_mean_us": float(costs.mean()), "cost_p99_us": float(np.percentile(costs, 99))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("wavs", nargs="*")
+    parser.add_argument("--chunk-ms", type=int, default=20)
+    parser.add_argument("--hangover-ms", type=int, default=300)
+    parser.add_argument("--endpointing-ms", type=int, default=600, help="Server endpointing the gate is compared to")
+    parser.add_argument("--onnx-model", default=None, help="Also run OnnxVAD with this model")
+    args = parser.parse_args()
+
+    recordings = []
+    for path in args.wavs:
+        pcm, rate, channels = read_wav(path)
+        recordings.append((path, pcm, rate, channels, None))
+    if not recordings:
+        pcm, rate, channels, truth = make_recording()
+        recordings.append(("synthetic", pcm, rate, channels, truth))
+
+    detectors = {"energy": lambda: EnergyVAD()}
+    if args.onnx_model:
+        detectors["onnx"] = lambda: OnnxVAD(args.onnx_model)
+
+    for name, pcm, rate, channels, truth in recordings:
+        seconds = len(pcm) / (2 * channels * rate)
+        print(f"{name}: {seconds:.1f} s, {rate} Hz, {channels} ch")
+        for detector_name, make_detector in detectors.items():
+            gate = VADGate(rate, channels, detector=make_detector(), hangover_ms=args.hangover_ms)
+            r = run_gate(gate, pcm, rate, channels, args.chunk_ms)
+            stats = r["stats"]
+            print(f"  {detector_name:>6}: sent {stats['bytes_sent'] / len(pcm):6.1%} of the audio, "
+                  f"{stats['speech_segments']} segments, {stats['keepalives']} keepalives, "
+                  f"{r['cost_mean_us']:.1f} us/chunk mean, {r['cost_p99_us']:.1f} us p99")
+            for index, (start, end) in enumerate(r["segments"]):
+                line = f"    speech {start:7.2f}s -> {end if end is not None else float('nan'):7.2f}s"
+                if truth is not None and index < len(truth):
+                    true_start, true_end = truth[index]
+                    line += f"  (true {true_start:6.2f}s -> {true_end:6.2f}s"
+                    if end is not None:
+                        # Server endpointing needs endpointing_ms of silence after the last word
+                        line += f", end detected {1000 * (end - true_end):5.0f} ms after it, "
+                        line += f"{args.endpointing_ms - 1000 * (end - true_end):5.0f} ms before endpointing"
+                    line += ")"
+                print(line)
+
+
+if __name__ == "__main__":
+    main()
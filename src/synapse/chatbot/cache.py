@@ -0,0 +1,107 @@
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+import hashlib
+import string
+import threading
+import time
+import unicodedata
+
+
+class ResponseCache:
+    """
+    Replies to short user utterances that keep coming back ("okay", "thanks", "can you
+    repeat that"), so they are answered without an LLM run.
+
+    Keyed by the normalized utterance and the `context_messages` messages before it (the
+    conversational state it was said in, 0 for the utterance alone). Only complete replies
+    are stored. Entries are evicted least recently used beyond `max_entries`, and expire
+    `ttl` seconds after they were stored.
+
+    A reply is replayed as the words the LLM streamed, so its sentences reach the TTS as
+    they did the first time and are played from its SynthesisCache instead of synthesized.
+
+    :param max_words: Longer utterances are not cached.
+    """
+    def __init__(self, max_entries=256, ttl=600.0, max_words=4, context_messages=1) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_words = max_words
+        self.context_messages = context_messages
+        self.lock = threading.Lock()
+        self.entries: OrderedDict[str, Dict[str, Any]] = OrderedDict()
+        self.counters = {"hits": 0, "misses": 0, "uncacheable": 0, "stores": 0, "evictions": 0, "expirations": 0}
+        self.latency_saved = 0.0
+        self.replay_latency = 0.0
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        text = unicodedata.normalize("NFKC", text).lower()
+        text = text.translate(str.maketrans("", "", string.punctuation.replace("'", "")))
+        return " ".join(text.split())
+
+    def key(self, utterance: str, context: List[Dict[str, str]]) -> Optional[str]:
+        """
+        Key of `utterance` said after the messages of `context`, None if it is not cacheable.
+        """
+        utterance = self.normalize(utterance)
+        if utterance == "" or len(utterance.split()) > self.max_words:
+            with self.lock:
+                self.counters["uncacheable"] += 1
+            return None
+        state = context[max(0, len(context) - self.context_messages):] if self.context_messages > 0 else []
+        raw = "\x1f".join([utterance] + [f"{message['role']}:{self.normalize(message['content'])}" for message in state])
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        The cached reply, {"words", "first_word_latency", "response_time", "stored_at"}, or None on a miss.
+        """
+        with self.lock:
+            response = self.entries.get(key)
+            if response is not None and time.time() - response["stored_at"] > self.ttl:
+                del self.entries[key]
+                self.counters["expirations"] += 1
+                response = None
+            if response is None:
+                self.counters["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.counters["hits"] += 1
+            return response
+
+    def put(self, key: str, words: List[str], first_word_latency: float, response_time: float):
+        """
+        :param first_word_latency: Seconds from speech end to the first word of the reply.
+        :param response_time: Seconds from speech end to the end of the reply.
+        """
+        with self.lock:
+            self.entries[key] = {"words": list(words), "first_word_latency": first_word_latency,
+                                 "response_time": response_time, "stored_at": time.time()}
+            self.entries.move_to_end(key)
+            self.counters["stores"] += 1
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def record_replay(self, response: Dict[str, Any], replay_latency: float):
+        """
+        A cached reply reached its first word `replay_latency` seconds after speech end.
+        """
+        with self.lock:
+            self.replay_latency += replay_latency
+            self.latency_saved += max(0.0, response["first_word_latency"] - replay_latency)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            hits = self.counters["hits"]
+            return dict(self.counters,
+                        hit_rate=hits / lookups if lookups else 0.0,
+                        entries=len(self.entries),
+                        latency_saved=self.latency_saved,
+                        mean_latency_saved=self.latency_saved / hits if hits else 0.0,
+                        mean_replay_latency=self.replay_latency / hits if hits else 0.0)
@@ -0,0 +1,203 @@
+from typing import Any, Dict, List
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import socket
+import threading
+import time
+import httpx
+import numpy as np
+from openai import OpenAI
+
+from synapse.config import config
+from synapse.utils import logger
+
+class PooledLLMClient:
+    """
+    OpenAI client of one backend (OpenAI or a vLLM server) over a persistent keep-alive
+    connection pool, shared by every run of the session.
+
+    A cancelled stream has to close its connection: over HTTP/1.1 that is how the server
+    learns to stop generating, and the connection can't be reused with the rest of the
+    response unread. So the pool is topped up in the background after a cancel, and
+    warmed up at startup, for the next request to find an open connection. Refills run one
+    at a time, and only while fewer than `min_idle` connections are idle, so a burst of
+    cancels (a barge-in, speculative runs dropped word after word) doesn't send a request each.
+    Warm-ups and refills run on threads of the client's own, never on GLOBAL_THREAD_POOL,
+    whose tasks call warm_up and close_stream.
+
+    :param pool_size: Connections kept open (and opened by warm_up).
+    :param keepalive_expiry: Seconds an idle connection is kept.
+    :param refill_on_cancel: Open a connection in the background after a cancelled stream.
+    :param min_idle: Idle connections a refill tops the pool up to, one for the next run by default.
+    :param http2: Multiplex streams on one connection (needs the h2 package and a server
+                  that speaks HTTP/2), a cancelled stream is then reset without the connection.
+    """
+    def __init__(self, base_url: str = None, api_key: str = None, pool_size=4, keepalive_expiry=120.0,
+                 connect_timeout=5.0, read_timeout=60.0, refill_on_cancel=True, min_idle=1, http2=False) -> None:
+        self.pool_size = pool_size
+        self.refill_on_cancel = refill_on_cancel
+        self.min_idle = min(min_idle, pool_size)
+        self.lock = threading.Lock()
+        self.is_refilling = False
+        self.counters = {"requests": 0, "connections_opened": 0, "streams_cancelled": 0, "refills": 0,
+                         "refills_skipped": 0, "warmups": 0}
+        self.ttfts = deque(maxlen=1000)
+        # A request per connection, plus the refill loop waiting on its requests
+        self.executor = ThreadPoolExecutor(max_workers=pool_size + 1, thread_name_prefix="llm-client")
+        self.http_client = httpx.Client(
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=pool_size, keepalive_expiry=keepalive_expiry),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            http2=http2,
+            event_hooks={"request": [self.__trace_request]},
+        )
+        self.client = OpenAI(base_url=base_url, api_key=api_key, http_client=self.http_client)
+
+    @property
+    def chat(self):
+        return self.client.chat
+
+    def warm_up(self, model: str = None, connections: int = None):
+        """
+        Opens `connections` connections in parallel, then has the server generate a token
+        of `model` if given (a billed request), so the first run pays neither.
+        """
+        connections = connections or self.pool_size
+        start = time.time()
+        futures = [self.executor.submit(self.client.models.list) for _ in range(connections)]
+        try:
+            for future in futures:
+                future.result()
+            if model is not None:
+                self.client.chat.completions.create(model=model, messages=[{"role": "user", "content": "Hi"}], max_tokens=1)
+            with self.lock:
+                self.counters["warmups"] += 1
+            logger.info(f"LLM client {self.client.base_url} warmed up in {1000 * (time.time() - start):.0f} ms")
+        except Exception as e:
+            logger.warning(f"LLM client {self.client.base_url} warm up failed: {e}")
+
+    def close_stream(self, response):
+        """
+        Closes a stream that is no longer read (the server stops generating) and refills the pool.
+        """
+        try:
+            # A thread blocked reading the connection isn't woken by a close, and could go on
+            # reading whatever connection reuses the descriptor (the refill), a shutdown ends its read
+            if response.response.http_version == "HTTP/1.1":
+                response.response.extensions["network_stream"].get_extra_info("socket").shutdown(socket.SHUT_RDWR)
+        except Exception:
+            pass
+        try:
+            response.close()
+        except Exception:
+            pass
+        with self.lock:
+            self.counters["streams_cancelled"] += 1
+            # A running refill checks the pool again before it returns
+            if not self.refill_on_cancel or self.is_refilling:
+                return
+            self.is_refilling = True
+        try:
+            self.executor.submit(self.__refill)
+        except RuntimeError:
+            # The client is closed
+            with self.lock:
+                self.is_refilling = False
+
+    def record_ttft(self, seconds: float):
+        with self.lock:
+            self.ttfts.append(seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            counters = dict(self.counters)
+            ttfts = 1000 * np.array(self.ttfts) if len(self.ttfts) > 0 else None
+        counters["connections_reused"] = max(0, counters["requests"] - counters["connections_opened"])
+        if ttfts is not None:
+            counters.update(ttft_count=len(ttfts), ttft_mean_ms=float(ttfts.mean()),
+                            ttft_p50_ms=float(np.percentile(ttfts, 50)), ttft_p95_ms=float(np.percentile(ttfts, 95)))
+        return counters
+
+    def idle_connections(self) -> int:
+        """
+        Open connections no request is using, None if the transport doesn't tell.
+        """
+        pool = getattr(getattr(self.http_client, "_transport", None), "_pool", None)
+        connections = getattr(pool, "connections", None)
+        if connections is None:
+            return None
+        return sum(1 for connection in list(connections) if connection.is_idle())
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.http_client.close()
+
+    def __refill(self):
+        # Concurrent requests each take an idle connection or open one, min_idle of them leave
+        # min_idle connections open. Cancels meanwhile are covered by the check after the round.
+        requests = 0
+        while True:
+            idle = self.idle_connections()
+            if idle is not None and idle >= self.min_idle:
+                break
+            # Without a view of the pool, one connection per cancel as before
+            count = self.min_idle if idle is not None else 1
+            futures = [self.executor.submit(self.client.models.list) for _ in range(count)]
+            try:
+                for future in futures:
+                    future.result()
+            except Exception as e:
+                logger.warning(f"LLM client {self.client.base_url} refill failed: {e}")
+                break
+            requests += count
+            if idle is None or requests >= self.pool_size:
+                break
+        with self.lock:
+            self.is_refilling = False
+            self.counters["refills"] += requests
+            if requests == 0:
+                self.counters["refills_skipped"] += 1
+
+    def __trace_request(self, request: httpx.Request):
+        with self.lock:
+            self.counters["requests"] += 1
+        request.extensions["trace"] = self.__trace
+
+    def __trace(self, event_name: str, info: Dict[str, Any]):
+        if event_name == "connection.connect_tcp.complete":
+            with self.lock:
+                self.counters["connections_opened"] += 1
+
+_clients: Dict[str, PooledLLMClient] = {}
+_clients_lock = threading.Lock()
+
+def get_backend(model: str) -> str:
+    return "openai" if model.startswith("gpt") else "vllm"
+
+def get_llm_client(model: str) -> PooledLLMClient:
+    """
+    The shared client of the backend serving `model`: OpenAI for gpt models, else the vLLM
+    server at config.VLLM_BASE_URL. Created on first use.
+    """
+    backend = get_backend(model)
+    with _clients_lock:
+        if backend not in _clients:
+            if backend == "openai":
+                _clients[backend] = PooledLLMClient(base_url=config.OPENAI_BASE_URL, api_key=config.OPENAI_API_KEY)
+            else:
+                _clients[backend] = PooledLLMClient(base_url=config.VLLM_BASE_URL, api_key=config.VLLM_API_KEY)
+        return _clients[backend]
+
+def make_chat_summarizer(model: str, max_tokens=256):
+    """
+    Summarizer for ContextBuilder that asks `model` itself, through the shared client.
+    """
+    def summarize(summary: str, messages: List[Dict[str, str]]) -> str:
+        conversation = "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+        prompt = "Summarize this conversation in a few sentences, keeping names, facts and open questions."
+        if summary:
+            prompt += f" Extend this summary of what came before it:\n{summary}"
+        response = get_llm_client(model).chat.completions.create(
+            model=model, max_tokens=max_tokens,
+            messages=[{"role": "system", "content": prompt}, {"role": "user", "content": conversation}])
+        return response.choices[0].message.content
+    return summarize
@@ -0,0 +1,73 @@
+from typing import List, Optional
+
+
+class FlushPolicy:
+    """
+    When the text streamed by a run goes on to the word callback (and Stream2Sentence).
+
+    `push` takes every delta and returns the text to forward now, "" to keep it buffered.
+    Each delta is scanned once as it arrives, the buffer is never rescanned. With a
+    `time_budget`, buffered text is due `time_budget` seconds after the first of it was
+    buffered, so neither a stall of the server nor a slow trickle of deltas holds words
+    back longer than that. The run wakes up for it at `deadline`.
+
+    The base policy batches `min_words` words, 0 forwards every delta.
+    """
+    def __init__(self, min_words=3, time_budget: float = None) -> None:
+        self.min_words = min_words
+        self.time_budget = time_budget
+        self.chunks: List[str] = []
+        self.spaces = 0
+        self.deadline: Optional[float] = None
+        self.forwards = 0
+
+    def push(self, delta: str, now: float) -> str:
+        if delta == "":
+            return ""
+        if self.time_budget is not None and self.deadline is None:
+            self.deadline = now + self.time_budget
+        self.chunks.append(delta)
+        self.spaces += delta.count(" ")
+        if self.should_flush(delta, now):
+            return self.take()
+        return ""
+
+    def should_flush(self, delta: str, now: float) -> bool:
+        return self.spaces >= self.min_words or self.is_due(now)
+
+    def is_due(self, now: float) -> bool:
+        return self.deadline is not None and now >= self.deadline
+
+    def take(self) -> str:
+        """
+        Everything buffered, to forward now.
+        """
+        text = "".join(self.chunks)
+        self.chunks = []
+        self.spaces = 0
+        self.deadline = None
+        if text != "":
+            self.forwards += 1
+        return text
+
+class WordCountFlushPolicy(FlushPolicy):
+    """
+    Batches of `words` words and nothing else, what runs always did.
+    """
+    def __init__(self, words=3) -> None:
+        super(WordCountFlushPolicy, self).__init__(min_words=words)
+
+class SentenceFlushPolicy(FlushPolicy):
+    """
+    Forwards as soon as a sentence delimiter arrives, so Stream2Sentence can close the
+    sentence without waiting for the next words, and when the stream stalls for
+    `time_budget`. Batches `min_words` words otherwise.
+    """
+    DELIMITERS = ".!?;:\n"
+
+    def __init__(self, min_words=3, time_budget=0.03, delimiters=DELIMITERS) -> None:
+        super(SentenceFlushPolicy, self).__init__(min_words=min_words, time_budget=time_budget)
+        self.delimiters = frozenset(delimiters)
+
+    def should_flush(self, delta: str, now: float) -> bool:
+        return any(character in self.delimiters for character in delta) or super(SentenceFlushPolicy, self).should_flush(delta, now)
@@ -6,37 +6,60 @@ from concurrent.futures import ThreadPoolExecutor
 from typing import Callable
 
 from .openai import OpenAIInferenceRun
+from .clients import PooledLLMClient, get_llm_client
+from .flush import FlushPolicy
+from .huggingface import HFEngineConfig, LLMInferenceRun, PrefixKVCache, prepare_hf_model
 from .utils import InterruptibleStoppingCriteria
 from .types import InferenceRun
 
 from synapse.utils import GLOBAL_THREAD_POOL
 
 class LLMGenerator:
-    def __init__(self, model:PreTrainedModel | str, tokenizer:PreTrainedTokenizerFast = None, max_tokens=1000):
+    def __init__(self, model:PreTrainedModel | str, tokenizer:PreTrainedTokenizerFast = None, max_tokens=1000, engine_config:HFEngineConfig = None,
+                 llm_client:PooledLLMClient = None, warm_up=True, warm_up_model=False,
+                 flush_policy:Callable[[], FlushPolicy] = None):
+        """
+        :param engine_config: Device, dtype, quantization, compilation and decoding of a local HF model, its device and dtype are left alone unless set.
+        :param llm_client: Client of an OpenAI/vLLM model, the shared one of its backend by default.
+        :param warm_up: Open the client's connections at startup.
+        :param warm_up_model: Also have the server generate a token then, a billed request that loads the model.
+        :param flush_policy: Makes the FlushPolicy of each run, when its streamed text goes on (OpenAI/vLLM models only).
+        """
         self.lock = threading.Lock()
+        self.engine_config = engine_config or HFEngineConfig()
+        if not isinstance(model, str):
+            model = prepare_hf_model(model, self.engine_config)
         self.model = model
         self.tokenizer = tokenizer
         self.max_tokens = max_tokens
+        self.flush_policy = flush_policy
         self.thread_pool = GLOBAL_THREAD_POOL
         self.current_run: InferenceRun = None
         self.need_to_start_new_run = False
+        self.llm_client = (llm_client or get_llm_client(model)) if isinstance(model, str) else None
+        if self.llm_client is not None and warm_up:
+            GLOBAL_THREAD_POOL.submit(self.llm_client.warm_up, model if warm_up_model else None)
+        # Successive runs share the key values of the conversation so far
+        self.prefix_cache = PrefixKVCache() if not isinstance(model, str) and self.engine_config.reuses_cache else None
         
     def __start_new_run__(self, prior_fetcher: Callable):
         self.need_to_start_new_run = False
         if isinstance(self.model, str):
             # Use OpenAI API
-            self.current_run = OpenAIInferenceRun(model=self.model, prior_fetcher=prior_fetcher, thread_pool=self.thread_pool, max_tokens=self.max_tokens)
+            self.current_run = OpenAIInferenceRun(model=self.model, prior_fetcher=prior_fetcher, thread_pool=self.thread_pool, max_tokens=self.max_tokens, client=self.llm_client,
+                                                  flush_policy=self.flush_policy)
         else:
             # Use Huggingface model
             streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
             stopper = InterruptibleStoppingCriteria()
-            self.current_run = InferenceRun(model=self.model, tokenizer=self.tokenizer, 
-                                            streamer=streamer, stopper=stopper, 
-                                            prior_fetcher=prior_fetcher, thread_pool=self.thread_pool, 
-                                            max_tokens=self.max_tokens)
+            self.current_run = LLMInferenceRun(model=self.model, tokenizer=self.tokenizer, 
+                                               streamer=streamer, stopper=stopper, 
+                                               prior_fetcher=prior_fetcher, thread_pool=self.thread_pool, 
+                                               max_tokens=self.max_tokens, prefix_cache=self.prefix_cache,
+                                               generation_kwargs=self.engine_config.generation_kwargs())
         return self.current_run
         
-    def generate(self, prior_fetcher: Callable, on_run_start:Callable[[InferenceRun], None]=None):
+    def generate(self, prior_fetcher: Callable, on_run_start:Callable[[InferenceRun], None]=None) -> InferenceRun:
         with self.lock:
             if self.current_run is not None:
                 self.current_run.cancel()
@@ -64,6 +87,19 @@ class LLMGenerator:
             run = self.__start_new_run__(prior_fetcher)
             if on_run_start is not None:
                 on_run_start(run)
+            return run
+    
+    def get_prefix_cache_stats(self):
+        """
+        Prompt tokens prefilled and reused from the cache, overall and per turn (HF models only).
+        """
+        return self.prefix_cache.stats() if self.prefix_cache is not None else None
+    
+    def get_llm_client_stats(self):
+        """
+        Connections opened and reused, streams cancelled and time to first token (OpenAI/vLLM models only).
+        """
+        return self.llm_client.stats() if self.llm_client is not None else None
     
     def get_current_run(self) -> InferenceRun:
         return self.current_run
@@ -1,4 +1,5 @@
-from typing import Any, Callable, Dict
+from typing import Any, Callable, Dict, Tuple
+from dataclasses import dataclass
 from openai import Stream
 from openai.resources.chat.completions import ChatCompletionChunk
 from transformers import StoppingCriteria
@@ -9,10 +10,215 @@ import openai
 from concurrent.futures import ThreadPoolExecutor
 from transformers import PreTrainedModel, PreTrainedTokenizerFast
 from transformers import AutoTokenizer, TextStreamer, PreTrainedModel, PreTrainedTokenizerFast, TextIteratorStreamer, StoppingCriteria, StoppingCriteriaList
+from transformers import AutoModelForCausalLM, DynamicCache, GenerationMixin
 
 from .types import InferenceRun
 from .utils import InterruptibleStoppingCriteria
-from synapse.utils import AI_SPEECH_END_TOKEN
+from synapse.utils import AI_SPEECH_END_TOKEN, logger
+
+class DecodingStrategy:
+    """
+    How LLMInferenceRun picks the next token.
+    """
+    GREEDY = "greedy"               # Most likely token, deterministic and the cheapest
+    SAMPLING = "sampling"           # Sampled among top_k/top_p with temperature (default)
+    CONTRASTIVE = "contrastive"     # Contrastive search (penalty_alpha, top_k), top_k forward passes a token
+
+    ALL = (GREEDY, SAMPLING, CONTRASTIVE)
+
+@dataclass
+class HFEngineConfig:
+    """
+    Where and how a local Hugging Face model runs.
+
+    :param device: "cuda", "cpu", "mps" or "auto" (CUDA if available), None leaves the model where it is.
+    :param dtype: "float32", "float16", "bfloat16" or "auto" (half precision on GPU, float32 on CPU),
+                  None leaves the model's dtype alone.
+    :param quantize: Dynamic int8 quantization of the Linear layers, CPU only.
+    :param compile: torch.compile the forward pass, True or a torch.compile mode.
+    """
+    device: str = None
+    dtype: str = None
+    quantize: bool = False
+    compile: bool | str = False
+    decoding: str = DecodingStrategy.SAMPLING
+    temperature: float = 1.0
+    top_k: int = 5
+    top_p: float = None
+    penalty_alpha: float = 0.6
+
+    def resolve_device(self) -> torch.device:
+        if self.device is None:
+            return None
+        if self.device != "auto":
+            return torch.device(self.device)
+        return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+    def resolve_dtype(self, device: torch.device) -> torch.dtype:
+        if self.dtype is None:
+            return None
+        if self.dtype != "auto":
+            return getattr(torch, self.dtype)
+        if device.type == "cuda":
+            return torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+        return torch.float32
+
+    def generation_kwargs(self) -> Dict[str, Any]:
+        if self.decoding == DecodingStrategy.GREEDY:
+            return {"do_sample": False}
+        if self.decoding == DecodingStrategy.SAMPLING:
+            kwargs = {"do_sample": True, "temperature": self.temperature, "top_k": self.top_k}
+            if self.top_p is not None:
+                kwargs["top_p"] = self.top_p
+            return kwargs
+        if self.decoding == DecodingStrategy.CONTRASTIVE:
+            kwargs = {"do_sample": False, "penalty_alpha": self.penalty_alpha, "top_k": self.top_k}
+            if not hasattr(GenerationMixin, "_contrastive_search"):
+                # Newer transformers ship contrastive search as Hub code
+                kwargs.update(custom_generate="transformers-community/contrastive-search", trust_remote_code=True)
+            return kwargs
+        raise ValueError(f"Unknown decoding strategy: {self.decoding}")
+
+    @property
+    def reuses_cache(self) -> bool:
+        # Contrastive search reorders the cache itself, it starts from a clean one
+        return self.decoding != DecodingStrategy.CONTRASTIVE
+
+def prepare_hf_model(model: PreTrainedModel, config: HFEngineConfig) -> PreTrainedModel:
+    """
+    Moves the model to the configured device and dtype if any, then quantizes and compiles it if asked.
+    A model placed by its loader (device_map, bitsandbytes and other quantized weights) is never moved or cast.
+    """
+    is_placed = getattr(model, "hf_device_map", None) is not None or getattr(model, "is_quantized", False)
+    if is_placed and (config.device is not None or config.dtype is not None or config.quantize):
+        logger.warning("HF model placed by its loader, the engine's device, dtype and quantize are ignored")
+    elif config.quantize:
+        device = config.resolve_device() or model.device
+        if device.type != "cpu":
+            raise ValueError(f"Dynamic int8 quantization runs on CPU only, not {device}")
+        # Quantized weights are computed from float32 ones, activations stay float32
+        model = model.to(device=device, dtype=torch.float32)
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    elif config.device is not None or config.dtype is not None:
+        device = config.resolve_device() or model.device
+        model = model.to(device=device, dtype=config.resolve_dtype(device) or model.dtype)
+    model.eval()
+    if config.compile:
+        mode = config.compile if isinstance(config.compile, str) else None
+        # Prompt and cache lengths change every step, dynamic shapes avoid a recompilation per length
+        model.forward = torch.compile(model.forward, mode=mode, dynamic=True)
+    parameter = next(model.parameters())
+    logger.info(f"HF model on {parameter.device}, {parameter.dtype if not config.quantize or is_placed else 'int8 dynamic'}"
+                f"{', compiled' if config.compile else ''}, {config.decoding} decoding")
+    return model
+
+def load_hf_model(model_name_or_path: str, config: HFEngineConfig = None) -> Tuple[PreTrainedModel, PreTrainedTokenizerFast]:
+    """
+    Loads a model and its tokenizer, on the best device and dtype available unless `config` says otherwise.
+    """
+    config = config or HFEngineConfig(device="auto", dtype="auto")
+    device = config.resolve_device() or torch.device("cpu")
+    tokenizer = AutoTokenizer.from_pretrained(model_name_or_path)
+    dtype = torch.float32 if config.quantize else config.resolve_dtype(device) or "auto"
+    model = AutoModelForCausalLM.from_pretrained(model_name_or_path, torch_dtype=dtype)
+    return prepare_hf_model(model, config), tokenizer
+
+class PrefixKVCache:
+    """
+    Past key values of the last sequence the model went through, shared by the successive
+    runs of a conversation: a run whose prompt starts with the cached tokens only prefills
+    the rest. The cache is cropped back to the common prefix when the prompt diverges (a
+    revised word, a reply spoken differently than generated) and dropped if nothing is shared.
+
+    One run at a time checks it out; a run that can't get it within `checkout_timeout`
+    (the run it replaces is still stopping) prefills everything without it.
+    """
+    def __init__(self, checkout_timeout=0.5):
+        self.checkout_timeout = checkout_timeout
+        self.lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+        self.cache: DynamicCache = None
+        # Tokens the cached key values are for
+        self.token_ids: torch.LongTensor = None
+        self.counters = {"runs": 0, "hits": 0, "evictions": 0, "busy": 0,
+                         "prompt_tokens": 0, "prefilled_tokens": 0, "reused_tokens": 0}
+        self.turn = None
+        self.turns = []
+        self.turn_end_run_id = None
+
+    def checkout(self, input_ids: torch.LongTensor) -> Tuple[DynamicCache, int]:
+        """
+        :param input_ids: Prompt tokens of the run, 1D.
+        :return: The cache to generate with and how many prompt tokens it already covers,
+                 None if another run holds it. Give it back with checkin or discard.
+        """
+        if not self.lock.acquire(timeout=self.checkout_timeout):
+            with self.stats_lock:
+                self.counters["busy"] += 1
+            return None
+        if self.cache is None:
+            return DynamicCache(), 0
+        cached = self.token_ids.to(input_ids.device)
+        length = min(len(cached), len(input_ids))
+        mismatches = (cached[:length] != input_ids[:length]).nonzero()
+        # At least the last prompt token goes through the model, its logits start the reply
+        shared = min(mismatches[0].item() if len(mismatches) > 0 else length, len(input_ids) - 1)
+        if shared == 0:
+            with self.stats_lock:
+                self.counters["evictions"] += 1
+            self.cache, self.token_ids = None, None
+            return DynamicCache(), 0
+        self.cache.crop(shared)
+        return self.cache, shared
+
+    def checkin(self, cache: DynamicCache, sequence: torch.LongTensor):
+        """
+        :param sequence: Prompt and generated tokens of the run, 1D.
+        """
+        # The last token was sampled, not fed through the model
+        length = cache.get_seq_length()
+        self.cache, self.token_ids = (cache, sequence[:length]) if length > 0 else (None, None)
+        self.lock.release()
+
+    def discard(self):
+        self.cache, self.token_ids = None, None
+        self.lock.release()
+
+    def record(self, run_id: int, prompt_tokens: int, reused_tokens: int):
+        with self.stats_lock:
+            self.counters["runs"] += 1
+            self.counters["hits"] += reused_tokens > 0
+            self.counters["prompt_tokens"] += prompt_tokens
+            self.counters["prefilled_tokens"] += prompt_tokens - reused_tokens
+            self.counters["reused_tokens"] += reused_tokens
+            if self.turn is None:
+                self.turn = {"run_ids": [], "prompt_tokens": 0, "prefilled_tokens": 0, "reused_tokens": 0}
+            self.turn["run_ids"].append(run_id)
+            self.turn["prompt_tokens"] += prompt_tokens
+            self.turn["prefilled_tokens"] += prompt_tokens - reused_tokens
+            self.turn["reused_tokens"] += reused_tokens
+            if run_id == self.turn_end_run_id:
+                self.__end_turn()
+
+    def end_turn(self, run_id: int):
+        """
+        The run answers the user: the turn closes once its prefill is recorded.
+        """
+        with self.stats_lock:
+            if self.turn is not None and run_id in self.turn["run_ids"]:
+                self.__end_turn()
+            else:
+                self.turn_end_run_id = run_id
+
+    def stats(self) -> Dict[str, Any]:
+        with self.stats_lock:
+            return dict(self.counters, cached_tokens=len(self.token_ids) if self.token_ids is not None else 0,
+                        turns=list(self.turns))
+
+    def __end_turn(self):
+        self.turns.append(self.turn)
+        self.turn = None
+        self.turn_end_run_id = None
 
 class LLMInferenceRun(InferenceRun):
     global_run_id: int = 0
@@ -23,11 +229,15 @@ class LLMInferenceRun(InferenceRun):
                  stopper:InterruptibleStoppingCriteria,
                  prior_fetcher: Callable[[], str], 
                  thread_pool:ThreadPoolExecutor,
-                 max_tokens=1000):
+                 max_tokens=1000,
+                 prefix_cache:PrefixKVCache=None,
+                 generation_kwargs:Dict[str, Any]=None):
         super(LLMInferenceRun, self).__init__(model, prior_fetcher, thread_pool, max_tokens)
         self.streamer = streamer
         self.stopper = stopper
         self.tokenizer = tokenizer
+        self.prefix_cache = prefix_cache
+        self.generation_kwargs = generation_kwargs if generation_kwargs is not None else HFEngineConfig().generation_kwargs()
         self.__run__() 
         self.lock.release()
         
@@ -36,23 +246,44 @@ class LLMInferenceRun(InferenceRun):
             print(colored(f'<@@gen starting run:{self.run_id}>', "yellow"), end='')
             prior = self.prior_fetcher()
             messages = prior
+            self.prompt = prior
+            lease = None
             try:
                 text = self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-                model_inputs = self.tokenizer([text], return_tensors="pt").to("cuda")
-                if self.run_future.cancelled() or self.cancelled:
+                model_inputs = self.tokenizer([text], return_tensors="pt").to(self.model.device)
+                input_ids = model_inputs["input_ids"][0]
+                if self.prefix_cache is not None and not self.cancelled:
+                    lease = self.prefix_cache.checkout(input_ids)
+                if self.cancelled:
                     print(colored(f'<@@gen precancelled {self.run_id}>', "light_red"), end='')
+                    if lease is not None:
+                        self.prefix_cache.checkin(lease[0], input_ids)
+                    self.streamer.end()
                     return
-                print(colored(f'<@@gen started {self.run_id}>', "yellow"), end='')
-                _ = self.model.generate(**model_inputs, do_sample=True, penalty_alpha=0.6, top_k=5, max_new_tokens=self.max_tokens, streamer=self.streamer, tokenizer=self.tokenizer, stopping_criteria=StoppingCriteriaList([self.stopper]))
+                cache, reused_tokens = lease if lease is not None else (None, 0)
+                if self.prefix_cache is not None:
+                    self.prefix_cache.record(self.run_id, len(input_ids), reused_tokens)
+                print(colored(f'<@@gen started {self.run_id}, {len(input_ids) - reused_tokens}/{len(input_ids)} tokens to prefill>', "yellow"), end='')
+                # The generation goes on from the cached prefix, the cache grows with the prompt and the reply
+                outputs = self.model.generate(input_ids=model_inputs["input_ids"], attention_mask=model_inputs["attention_mask"], past_key_values=cache, **self.generation_kwargs, max_new_tokens=self.max_tokens, streamer=self.streamer, tokenizer=self.tokenizer, stopping_criteria=StoppingCriteriaList([self.stopper]))
+                if lease is not None:
+                    self.prefix_cache.checkin(cache, outputs[0])
+                    lease = None
                 print(colored(f'<@@gen done {self.run_id}>', "yellow"), end='')
             except Exception as e:
                 print(colored(f'<@@gen failed {self.run_id}, {e}>', "yellow"), end='')
+                if lease is not None:
+                    # Whatever the cache holds now may not match its tokens
+                    self.prefix_cache.discard()
+                self.streamer.end()
         self.run_future = self.thread_pool.submit(__generate_fn)
     
     def flush(self, on_start_callback=None, on_end_callback=None, on_word_callback=None):
         with self.lock:
             if on_start_callback is not None:
                 on_start_callback()
+            if self.prefix_cache is not None:
+                self.prefix_cache.end_turn(self.run_id)
             def __flush_fn():
                 print(colored(f'<@@flush started {self.run_id}>', "yellow"), end='')
                 for word in self.streamer:
@@ -61,6 +292,7 @@ class LLMInferenceRun(InferenceRun):
                         if on_end_callback is not None:
                             on_end_callback()
                         return
+                    self.generated_tokens += 1
                     if on_word_callback is not None:
                         on_word_callback(word)#' '.join(processed))
                 if on_word_callback is not None:
@@ -106,3 +338,7 @@ class LLMInferenceRun(InferenceRun):
         
     def is_cancelled(self):
         return self.cancelled
+    
+    def is_in_flight(self):
+        # The streamer buffers everything, generation doesn't wait for a flush
+        return self.run_future is None or not self.run_future.done()
@@ -1,27 +1,24 @@
-from typing import Any, Callable, Dict
+from typing import Any, Callable, Dict, Iterator, Optional
+from queue import Queue, Empty
+import time
 from openai import Stream
 from openai.resources.chat.completions import ChatCompletionChunk
 from transformers import StoppingCriteria
 import torch
 import threading
 from termcolor import colored
-import openai
-from openai import OpenAI
 from concurrent.futures import ThreadPoolExecutor
 from .types import InferenceRun
+from .clients import PooledLLMClient, get_llm_client
+from .flush import FlushPolicy, SentenceFlushPolicy
 import traceback
 
 from synapse.utils import AI_SPEECH_END_TOKEN
 
-openai_api_key = "EMPTY"
-openai_api_base = "http://localhost:8000/v1"
-vllm_client = OpenAI(
-    api_key=openai_api_key,
-    base_url=openai_api_base,
-)
-
 class OpenAIInferenceRun(InferenceRun):
     global_run_id: int = 0
+    # Ends the deltas read on another thread
+    STREAM_END = object()
     def __init__(
         self,
         model:str,
@@ -29,34 +26,52 @@ class OpenAIInferenceRun(InferenceRun):
         thread_pool:ThreadPoolExecutor,
         max_tokens=1000,
         flush_rate=3,
+        client: PooledLLMClient = None,
+        flush_policy: Callable[[], FlushPolicy] = None,
     ):
         """
         :param messages: A list of message dicts in the OpenAI chat format.
         :param on_token_callback: Called with each token (string) as it is streamed.
         :param on_complete_callback: Called when the generation is complete.
         :param on_error_callback: Called in case of an error.
+        :param client: Pooled client of the backend, the shared one of the model's backend by default.
+        :param flush_policy: Makes the FlushPolicy of the run's text, a SentenceFlushPolicy batching flush_rate words by default.
         """
         super(OpenAIInferenceRun, self).__init__(model, prior_fetcher, thread_pool, max_tokens)
         self.response: Stream[ChatCompletionChunk] = None
+        self.client = client or get_llm_client(model)
+        self.request_time = None
+        # Read to the end, the connection went back to the pool
+        self.stream_done = False
         print(colored(f'<@@gen run setup:{self.run_id}>', "yellow"), end='')
         self.flush_rate = flush_rate
+        self.flush_policy: FlushPolicy = flush_policy() if flush_policy is not None else SentenceFlushPolicy(min_words=flush_rate)
+        self.delta_queue: Queue = None
         self.__run__()
         self.lock.release()
 
     def __run__(self):
         def __generate_fn():
             print(colored(f'<@@gen starting run:{self.run_id}>', "yellow"), end='')
+            if self.cancelled:
+                print(colored(f'<@@gen precancelled {self.run_id}>', "light_red"), end='')
+                return
             prior = self.prior_fetcher()
             messages = prior
+            self.prompt = prior
             try:
-                client = openai if self.model.startswith("gpt") else vllm_client
-                response = client.chat.completions.create(
+                self.request_time = time.time()
+                response = self.client.chat.completions.create(
                     model=self.model,
                     messages=messages,
                     max_tokens=self.max_tokens,
                     stream=True,  # important for streaming
                 )
                 self.response = response
+                if self.cancelled:
+                    # Cancelled while the request was being sent, the server would generate max_tokens for nobody
+                    self.client.close_stream(response)
+                    return
                 print(colored(f'<@@gen started {self.run_id}>', "yellow"), end='')
             except Exception as e:
                 print(colored(f"[OpenAIInferenceRun Error]: {e}", "red"))
@@ -66,32 +81,47 @@ class OpenAIInferenceRun(InferenceRun):
         with self.lock:
             if on_start_callback is not None:
                 on_start_callback()
+            flush_time = time.time()
             def __flush_fn():
                 print(colored(f'<@@flush started {self.run_id}>', "yellow"), end='')
                 self.run_future.result()
                 if self.response is not None:
-                    buffer = ""
+                    policy = self.flush_policy
+                    # From the request, or from the flush if the run was started ahead
+                    ttft_start = max(self.request_time, flush_time)
                     try:
                         try:
-                            for message in self.response:
+                            for delta in self.__deltas():
                                 if self.cancelled:
-                                    print(colored(f'<@@flush cancelled {self.run_id}>', "yellow"), end='')
-                                    if on_end_callback is not None:
-                                        on_end_callback()
-                                    return
-                                delta = message.choices[0].delta.content or ""
-                                buffer += delta
-                                if buffer.count(" ") >= self.flush_rate:
-                                    # Flush buffer if it has more than flush_rate words
-                                    if on_word_callback is not None:
-                                        on_word_callback(buffer)
-                                    buffer = ""
+                                    break
+                                if delta is None:
+                                    # Nothing came before the policy's deadline
+                                    text = policy.take()
+                                else:
+                                    if delta != "":
+                                        if self.generated_tokens == 0:
+                                            self.client.record_ttft(time.time() - ttft_start)
+                                        self.generated_tokens += 1
+                                    text = policy.push(delta, time.time())
+                                if text != "" and on_word_callback is not None:
+                                    on_word_callback(text)
+                            else:
+                                self.stream_done = True
                         except Exception as e:
-                            print(colored(f"[OpenAIInferenceRun Error]: {e}", "red"))
+                            # Closing the stream on cancel interrupts the read, that's no error
+                            if not self.cancelled:
+                                print(colored(f"[OpenAIInferenceRun Error]: {e}", "red"))
+                        
+                        if self.cancelled:
+                            print(colored(f'<@@flush cancelled {self.run_id}>', "yellow"), end='')
+                            if on_end_callback is not None:
+                                on_end_callback()
+                            return
                         
                         if on_word_callback is not None:
-                            if buffer != "":
-                                on_word_callback(buffer)
+                            text = policy.take()
+                            if text != "":
+                                on_word_callback(text)
                             on_word_callback(AI_SPEECH_END_TOKEN)
                             
                         if on_end_callback is not None:
@@ -106,15 +136,50 @@ class OpenAIInferenceRun(InferenceRun):
                     print(colored(f'<@@flush no response {self.run_id}>', "yellow"), end='')
             self.flush_future = self.thread_pool.submit(__flush_fn)
     
+    def __deltas(self) -> Iterator[Optional[str]]:
+        """
+        Text deltas of the stream. With a time budget the stream is read on a thread of its own,
+        so the flush wakes up at the policy's deadline: None when it passed first. Not a pool
+        thread, the flush waiting on it holds one already and a busy pool would starve it.
+        """
+        if self.flush_policy.time_budget is None:
+            for message in self.response:
+                yield message.choices[0].delta.content or ""
+            return
+        deltas = self.delta_queue = Queue()
+        if self.cancelled:
+            return
+        def __read_fn():
+            try:
+                for message in self.response:
+                    deltas.put(message.choices[0].delta.content or "")
+            except Exception as e:
+                deltas.put(e)
+            finally:
+                deltas.put(self.STREAM_END)
+        threading.Thread(target=__read_fn, name=f"llm-stream-{self.run_id}", daemon=True).start()
+        while True:
+            deadline = self.flush_policy.deadline
+            try:
+                item = deltas.get(timeout=max(0.0, deadline - time.time()) if deadline is not None else None)
+            except Empty:
+                yield None
+                continue
+            if item is self.STREAM_END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    
     def cancel(self):
         if self.cancelled:
             return
         self.cancelled = True
-        try:
-            if self.response is not None:
-                self.response.close()
-        except Exception as e:
-            pass
+        if self.response is not None and not self.stream_done:
+            self.client.close_stream(self.response)
+        if self.delta_queue is not None:
+            # The flush may be waiting for a delta without a deadline
+            self.delta_queue.put(self.STREAM_END)
         if self.run_future is not None and not self.run_future.done():
             self.run_future.cancel()
         if self.flush_future is not None and not self.flush_future.done():
@@ -0,0 +1,204 @@
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List
+from termcolor import colored
+
+from .generator import LLMGenerator
+from .types import InferenceRun
+
+_WORD = re.compile(r"\w")
+
+def estimate_prompt_tokens(messages: List[Dict[str, str]], tokenizer=None) -> int:
+    """
+    Prompt tokens of a chat, with the tokenizer if there is one, else ~4 characters a token.
+    """
+    if messages is None:
+        return 0
+    if tokenizer is not None:
+        return sum(len(tokenizer.encode(message["content"], add_special_tokens=False)) for message in messages)
+    return sum(len(message["content"]) for message in messages) // 4
+
+def prompt_extension(prompt: List[Dict[str, str]], context: List[Dict[str, str]]) -> str:
+    """
+    Text `context` adds at the end of `prompt`, None if `prompt` isn't a prefix of it
+    (a message was revised, or another turn started).
+    """
+    if len(prompt) != len(context) or len(prompt) == 0 or prompt[:-1] != context[:-1]:
+        return None
+    last, current = prompt[-1], context[-1]
+    if last["role"] != current["role"] or not current["content"].startswith(last["content"]):
+        return None
+    return current["content"][len(last["content"]):]
+
+class SpeculativeRunScheduler:
+    """
+    Starts the speculative LLM runs of a ChatBot that infers while the user is speaking.
+
+    Instead of a run per STT word batch, a run starts once no words came for a debounce
+    delay that follows the pace of the speech (gap_factor times the mean gap between
+    batches, within min/max_debounce), at most `max_in_flight` runs hold the server at a
+    time, and a run whose prompt is still a prefix of the transcript (up to
+    `reuse_max_words` words behind) is kept instead of being restarted.
+
+    :param prior_fetcher: Builds the current prompt, as passed to LLMGenerator.generate.
+    :param max_debounce: Below the VAD hangover, so a run is underway by the time speech end comes.
+    :param max_gap: Gaps longer than this are pauses, they don't count towards the pace.
+    """
+    def __init__(self, llm_generator: LLMGenerator, prior_fetcher: Callable[[], List[Dict[str, str]]],
+                 min_debounce=0.05, max_debounce=0.25, gap_factor=1.2, max_gap=1.0, max_in_flight=2,
+                 reuse_max_words=0) -> None:
+        self.llm_generator = llm_generator
+        self.prior_fetcher = prior_fetcher
+        self.min_debounce = min_debounce
+        self.max_debounce = max_debounce
+        self.gap_factor = gap_factor
+        self.max_gap = max_gap
+        self.max_in_flight = max_in_flight
+        self.reuse_max_words = reuse_max_words
+        self.condition = threading.Condition()
+        self.current_run: InferenceRun = None
+        # Handed out by take_run, the reply being spoken
+        self.flushing_run: InferenceRun = None
+        # Started runs that may still hold the server
+        self.runs: List[InferenceRun] = []
+        self.mean_gap = None
+        self.last_words_time = None
+        self.debounce = min_debounce
+        # When the pending run is due, None if there is none
+        self.deadline = None
+        self.is_deferred = False
+        self.is_closed = False
+        self.counters = {"word_batches": 0, "started": 0, "cancelled": 0, "reused": 0, "debounced": 0,
+                         "deferred": 0, "forced": 0, "wasted_prompt_tokens": 0, "wasted_generated_tokens": 0}
+        self.worker = threading.Thread(target=self.__run, daemon=True)
+        self.worker.start()
+
+    def notify_words(self, arrived_time: float = None):
+        """
+        New words are in the transcript: stop the reply being spoken, drop the current run
+        if they make it stale and (re)arm the debounce for the next one.
+        """
+        now = time.time()
+        with self.condition:
+            self.counters["word_batches"] += 1
+            if self.last_words_time is not None and now - self.last_words_time < self.max_gap:
+                gap = now - self.last_words_time
+                self.mean_gap = gap if self.mean_gap is None else 0.3 * gap + 0.7 * self.mean_gap
+                self.debounce = min(self.max_debounce, max(self.min_debounce, self.gap_factor * self.mean_gap))
+            self.last_words_time = now
+            if self.flushing_run is not None:
+                # The user talks over the reply, as when every word batch cancelled the run
+                self.flushing_run.cancel()
+                self.flushing_run = None
+            if self.current_run is not None and not self.__is_reusable(self.current_run):
+                self.__cancel_current()
+            if self.current_run is None:
+                if self.deadline is not None:
+                    self.counters["debounced"] += 1
+                self.deadline = now + self.debounce
+            self.condition.notify()
+
+    def take_run(self) -> InferenceRun:
+        """
+        The run to answer with now that speech ended: the current one if the transcript
+        didn't move past its prompt, else one started right away, debounce and cap aside.
+        """
+        with self.condition:
+            self.deadline = None
+            self.is_deferred = False
+            run = self.current_run
+            if run is not None and run.flush_future is None and self.__is_reusable(run):
+                self.counters["reused"] += 1
+                print(colored(f'<@@gen reused {run.run_id}>', "yellow"), end='')
+                self.current_run = None
+                self.flushing_run = run
+                return run
+            if run is not None:
+                self.__cancel_current()
+            self.__prune()
+            if len(self.runs) >= self.max_in_flight:
+                self.counters["forced"] += 1
+            run = self.__start()
+            self.current_run = None
+            self.flushing_run = run
+            return run
+
+    def cancel(self):
+        with self.condition:
+            self.deadline = None
+            self.is_deferred = False
+            if self.current_run is not None:
+                self.__cancel_current()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.condition:
+            self.__prune()
+            return dict(self.counters, in_flight=len(self.runs), debounce_ms=1000 * self.debounce,
+                        mean_gap_ms=1000 * self.mean_gap if self.mean_gap is not None else None)
+
+    def close(self):
+        with self.condition:
+            self.is_closed = True
+            self.deadline = None
+            if self.current_run is not None:
+                self.__cancel_current()
+            if self.flushing_run is not None:
+                self.flushing_run.cancel()
+                self.flushing_run = None
+            self.condition.notify()
+
+    def __is_reusable(self, run: InferenceRun) -> bool:
+        if run.is_cancelled():
+            return False
+        # Not started yet, it will fetch the current transcript itself
+        if run.prompt is None:
+            return True
+        extension = prompt_extension(run.prompt, self.prior_fetcher())
+        if extension is None:
+            return False
+        return sum(1 for word in extension.split() if _WORD.search(word)) <= self.reuse_max_words
+
+    def __start(self) -> InferenceRun:
+        run = self.llm_generator.generate(self.prior_fetcher)
+        self.runs.append(run)
+        self.counters["started"] += 1
+        return run
+
+    def __cancel_current(self):
+        run, self.current_run = self.current_run, None
+        run.cancel()
+        self.counters["cancelled"] += 1
+
+    def __prune(self):
+        in_flight = []
+        for run in self.runs:
+            if run.is_in_flight():
+                in_flight.append(run)
+            elif run.is_cancelled() and run.flush_future is None:
+                # Never spoken: the prefill and whatever it streamed were for nothing
+                self.counters["wasted_prompt_tokens"] += estimate_prompt_tokens(run.prompt, self.llm_generator.tokenizer)
+                self.counters["wasted_generated_tokens"] += run.generated_tokens
+        self.runs = in_flight
+
+    def __run(self):
+        with self.condition:
+            while not self.is_closed:
+                if self.deadline is None:
+                    self.condition.wait()
+                    continue
+                now = time.time()
+                if now < self.deadline:
+                    self.condition.wait(self.deadline - now)
+                    continue
+                self.__prune()
+                if len(self.runs) >= self.max_in_flight:
+                    if not self.is_deferred:
+                        self.is_deferred = True
+                        self.counters["deferred"] += 1
+                    # Cancelled runs wind down on their own, check again shortly
+                    self.condition.wait(0.05)
+                    continue
+                self.deadline = None
+                self.is_deferred = False
+                self.current_run = self.__start()
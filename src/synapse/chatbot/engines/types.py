@@ -22,7 +22,11 @@ class InferenceRun(ABC):
         self.model = model
         self.prior_fetcher = prior_fetcher
         self.cancelled = False
+        self.run_future = None
         self.flush_future = None
+        # Messages the run was started with, once fetched, and tokens streamed out so far
+        self.prompt = None
+        self.generated_tokens = 0
         
     @abstractmethod
     def flush(self, on_start_callback=None, on_end_callback=None, on_word_callback=None):
@@ -40,4 +44,14 @@ class InferenceRun(ABC):
                 raise Exception("No flush future to wait for")
         
     def is_cancelled(self):
-        return self.cancelled
\ No newline at end of file
+        return self.cancelled
+    
+    def is_in_flight(self):
+        """
+        Whether the run still holds the server: starting, or streaming until cancelled or flushed out.
+        """
+        if self.run_future is None or not self.run_future.done():
+            return True
+        if self.cancelled:
+            return False
+        return self.flush_future is None or not self.flush_future.done()
\ No newline at end of file
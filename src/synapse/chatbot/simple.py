@@ -3,10 +3,14 @@ from typing import Any, Callable, Dict
 from termcolor import colored
 from transformers import PreTrainedModel, PreTrainedTokenizerFast
 
-from .states import GlobalTranscript
+from .states import GlobalTranscript, ContextBuilder, make_token_counter
 from .engines.generator import LLMGenerator
+from .engines.scheduler import SpeculativeRunScheduler
+from .engines.huggingface import HFEngineConfig
+from .engines.flush import FlushPolicy
+from .cache import ResponseCache
 
-from synapse.utils import DataFrame, AI_SPEECH_END_TOKEN
+from synapse.utils import DataFrame, AI_SPEECH_END_TOKEN, GLOBAL_THREAD_POOL
 from synapse.pipeline.streamers.common import InterruptCascadeStreamer, SpeechToTextStreamer
 
 class ChatBot(InterruptCascadeStreamer):
@@ -17,10 +21,29 @@ class ChatBot(InterruptCascadeStreamer):
         infer_on_new_words=True, 
         bot_name="Ratchel", 
         human_names=["Ashish"],
-        transcript_log_path=None
+        transcript_log_path=None,
+        transcript_log_options: Dict[str, Any] = None,
+        scheduler_options: Dict[str, Any] = None,
+        engine_config: HFEngineConfig = None,
+        max_prompt_tokens: int = None,
+        context_summarizer: Callable = None,
+        response_cache: ResponseCache = None,
+        flush_policy: Callable[[], FlushPolicy] = None
     ) -> None:
+        """
+        :param infer_on_new_words: Start LLM runs while the user speaks, so a response is underway at speech end.
+        :param transcript_log_path: JSONL log of the conversation, word by word.
+        :param transcript_log_options: Batching, rotation and compression of that log, see TranscriptWriter.
+        :param scheduler_options: Keyword arguments of the SpeculativeRunScheduler of those runs.
+        :param engine_config: Device, dtype, quantization, compilation and decoding of a local HF model.
+        :param max_prompt_tokens: Token budget of the prompt, older messages are dropped beyond it.
+        :param context_summarizer: Summarizes the dropped messages instead, see ContextBuilder (e.g. make_chat_summarizer(model)).
+        :param response_cache: Replays the replies to short repeated utterances instead of running the LLM, can be shared.
+                               A reply is stored once it has been heard to the end, see handle_playback_end.
+        :param flush_policy: Makes the FlushPolicy of each run, e.g. lambda: SentenceFlushPolicy(time_budget=0.05) (OpenAI/vLLM models only).
+        """
         super(ChatBot, self).__init__()
-        self.llm_generator = LLMGenerator(model, tokenizer)
+        self.llm_generator = LLMGenerator(model, tokenizer, engine_config=engine_config, flush_policy=flush_policy)
         
         self.initial_prompt = self.get_default_prompt()
         
@@ -32,26 +55,61 @@ class ChatBot(InterruptCascadeStreamer):
         self.human_names = human_names
         
         self.infer_on_new_words = infer_on_new_words
+        self.response_cache = response_cache
+        # (epoch, cache key, words, first word latency, response time) of the reply being played
+        self.unheard_response = None
+        # Debounces the runs started on new words, caps those in flight and keeps the ones still valid
+        self.run_scheduler = SpeculativeRunScheduler(self.llm_generator, self.get_full_context, **(scheduler_options or {})) \
+            if infer_on_new_words else None
         
-        self.global_transcript = GlobalTranscript(transcript_log_path)
+        self.global_transcript = GlobalTranscript(transcript_log_path, log_options=transcript_log_options)
+        self.context_builder = ContextBuilder(self.global_transcript, self.initial_prompt, make_token_counter(model, tokenizer),
+                                              max_prompt_tokens=max_prompt_tokens, summarizer=context_summarizer)
         def speaker_change_handler(old_speaker, old_speaker_type, new_speaker, new_speaker_type, time):
             print(colored(f'<@@gen speaker change {old_speaker}->{new_speaker} at {time}>', "yellow"), end='')
+            if new_speaker == self.bot_name:
+                self.context_builder.end_turn()
             # If Old speaker was a bot, call self.cancel()
             if old_speaker == self.bot_name:
                 self.handle_interrupt()
             
         self.global_transcript.on("speaker_change", speaker_change_handler)
         
-    def commit(self, data: DataFrame):
+    def commit(self, data: DataFrame, epoch: int = None):
         self.global_transcript((data, self.bot_name, time.time(), True))
-        super().commit(data)
+        super().commit(data, epoch)
+        
+    def control_handlers(self) -> Dict[str, Callable]:
+        handlers = super().control_handlers()
+        handlers["speech_end"] = self.handle_speech_end
+        return handlers
+    
+    def handle_speech_end(self):
+        print(colored(f'<@@user-speech end>', "red"), end='')
+        cache_key = self.__response_cache_key()
+        if cache_key is not None and self.__replay_cached_response(cache_key):
+            return
+        if not self.infer_on_new_words:
+            self.__generate_response__()
+        self.__start_flushing__(cache_key)
+        
+    def process_batch(self, frames: list):
+        """
+        Words still queued when speech end overtook them: merge consecutive batches of the
+        same speaker so the backlog costs one transcript update and one run, not one per batch.
+        """
+        merged = []
+        for data, epoch in frames:
+            if len(merged) > 0 and isinstance(data, tuple) and isinstance(merged[-1][0], tuple) and data[1] == merged[-1][0][1]:
+                words, speaker, _ = merged[-1][0]
+                merged[-1] = ((list(words) + list(data[0]), speaker, data[2]), epoch)
+            else:
+                merged.append((data, epoch))
+        super().process_batch(merged)
         
     def __call__(self, data) -> Any:
         if data == SpeechToTextStreamer.SPEECH_END_TOKEN:
-            print(colored(f'<@@user-speech end>', "red"), end='')
-            if not self.infer_on_new_words:
-                self.__generate_response__()
-            self.__start_flushing__()
+            self.handle_speech_end()
             return
         words, speaker, arrival_time = data
         if len(words) == 0:
@@ -62,36 +120,143 @@ class ChatBot(InterruptCascadeStreamer):
         if text.strip() == "":
             return
         
-        self.llm_generator.cancel_current_run()
-        
         self.global_transcript((text, speaker, arrival_time, False))
         if self.infer_on_new_words:
-            self.__generate_response__(text)
-        pass
+            print(colored(f'<@@gen queuing {text}>', "yellow"), end='')
+            self.run_scheduler.notify_words(arrival_time)
+        else:
+            self.llm_generator.cancel_current_run()
         
     def __generate_response__(self, words=[]):
         print(colored(f'<@@gen queuing {words}>', "yellow"), end='')
         self.llm_generator.generate(self.get_full_context)
         
-    def __start_flushing__(self):
+    def __start_flushing__(self, cache_key: str = None):
+        # Words of this response belong to the current turn, they go stale if the user barges in
+        epoch = self.epoch_clock.value
+        on_word_callback = lambda word: self.commit(word, epoch)
+        if cache_key is not None:
+            on_word_callback = self.__recording_callback(cache_key, epoch, on_word_callback)
+        if self.run_scheduler is not None:
+            self.run_scheduler.take_run().flush(on_start_callback=self._on_ai_speech_start_cb, 
+                                                on_end_callback=self._on_ai_speech_end_cb, 
+                                                on_word_callback=on_word_callback)
+            return
         current_run = self.llm_generator.get_current_run()
         if current_run is not None and not current_run.is_cancelled() and current_run.flush_future is None:
             current_run.flush(on_start_callback=self._on_ai_speech_start_cb, 
                               on_end_callback=self._on_ai_speech_end_cb, 
-                              on_word_callback=self._on_ai_words_cb)
+                              on_word_callback=on_word_callback)
         else:
             # start a new run
             print(colored(f'<@@re-gen>', "red"), end='')
             self.llm_generator.generate(self.get_full_context, 
                                         on_run_start=lambda run: run.flush(on_start_callback=self._on_ai_speech_start_cb, 
                                                                            on_end_callback=self._on_ai_speech_end_cb, 
-                                                                           on_word_callback=self._on_ai_words_cb))
+                                                                           on_word_callback=on_word_callback))
         
+    def __response_cache_key(self):
+        """
+        Response cache key of what the user just said, None without a cache or if it is not cacheable.
+        """
+        if self.response_cache is None:
+            return None
+        with self.global_transcript.lock:
+            if self.global_transcript.current_speaker in (None, self.bot_name):
+                return None
+            return self.response_cache.key(self.global_transcript.current_text, self.global_transcript.past_transcripts)
+    
+    def handle_playback_end(self, epoch: int):
+        """
+        The reply of `epoch` has played out (the TTS "playback_end" event): it goes into the
+        response cache unless the user interrupted it.
+        """
+        response = self.unheard_response
+        if response is None or response[0] != epoch:
+            return
+        self.unheard_response = None
+        if not self.epoch_clock.is_stale(epoch):
+            self.response_cache.put(*response[1:])
+    
+    def __recording_callback(self, cache_key: str, epoch: int, on_word_callback: Callable[[str], None]):
+        # Keeps the words of the reply, stored once it was heard to the end
+        flush_time = time.time()
+        words = []
+        first_word_time = []
+        def __on_word(word):
+            if word == AI_SPEECH_END_TOKEN:
+                if len(words) > 0 and not self.epoch_clock.is_stale(epoch):
+                    self.unheard_response = (epoch, cache_key, words, first_word_time[0] - flush_time, time.time() - flush_time)
+            else:
+                if len(first_word_time) == 0:
+                    first_word_time.append(time.time())
+                words.append(word)
+            on_word_callback(word)
+        return __on_word
+    
+    def __replay_cached_response(self, cache_key: str) -> bool:
+        response = self.response_cache.get(cache_key)
+        if response is None:
+            return False
+        print(colored(f'<@@replaying cached response>', "yellow"), end='')
+        if self.run_scheduler is not None:
+            self.run_scheduler.cancel()
+        else:
+            self.llm_generator.cancel_current_run()
+        epoch = self.epoch_clock.value
+        speech_end_time = time.time()
+        def __replay():
+            self._on_ai_speech_start_cb()
+            for i, word in enumerate(response["words"]):
+                if self.epoch_clock.is_stale(epoch):
+                    break
+                self.commit(word, epoch)
+                if i == 0:
+                    self.response_cache.record_replay(response, time.time() - speech_end_time)
+            self.commit(AI_SPEECH_END_TOKEN, epoch)
+            self._on_ai_speech_end_cb()
+        GLOBAL_THREAD_POOL.submit(__replay)
+        return True
+    
     def wait_for_flush(self):
         self.llm_generator.wait_for_flush()
+        
+    def get_speculation_stats(self):
+        """
+        Runs started, cancelled, reused and the tokens spent on runs that were never spoken.
+        """
+        return self.run_scheduler.stats() if self.run_scheduler is not None else None
+        
+    def get_prefix_cache_stats(self):
+        return self.llm_generator.get_prefix_cache_stats()
+        
+    def get_llm_client_stats(self):
+        return self.llm_generator.get_llm_client_stats()
+        
+    def get_context_stats(self):
+        """
+        Prompt tokens per turn, messages kept, dropped and summarized.
+        """
+        return self.context_builder.stats()
+    
+    def get_response_cache_stats(self):
+        """
+        Hits, misses, evictions and the time to first word saved by replayed replies, or None without a cache.
+        """
+        return self.response_cache.stats() if self.response_cache is not None else None
+    
+    def get_transcript_log_stats(self):
+        """
+        Records, batches and bytes written to the transcript log, rotations, or None without a log.
+        """
+        transcript_log = self.global_transcript.transcript_log
+        return transcript_log.stats() if transcript_log is not None else None
     
     def close(self):
+        if self.run_scheduler is not None:
+            self.run_scheduler.close()
         self.llm_generator.exit()
+        self.global_transcript.close()
         return super().close()
     
     def __enter__(self):
@@ -145,13 +310,5 @@ class ChatBot(InterruptCascadeStreamer):
     """
     
     def get_full_context(self) -> str:
-        # First fetch the global transcript
-        # self.global_transcript.sync() # sync the transcript
-        transcript = self.global_transcript.get_transcript()
-        initial_prompt = {
-            "role": "system",
-            "content": self.initial_prompt
-        }
-        # initial_prompt = self.initial_prompt
-        context = [initial_prompt] + transcript
-        return context
\ No newline at end of file
+        # Maintained incrementally from the global transcript, within the token budget
+        return self.context_builder.build()
\ No newline at end of file
@@ -1 +1,3 @@
-from .global_transcript import *
\ No newline at end of file
+from .global_transcript import *
+from .context import *
+from .transcript_log import *
@@ -0,0 +1,151 @@
+from typing import Any, Callable, Dict, List
+from bisect import bisect_left
+import threading
+
+from synapse.utils import GLOBAL_THREAD_POOL, logger
+from .global_transcript import GlobalTranscript, SPEAKER_TYPES_MAP
+
+class TokenCounter:
+    """
+    Token count of a message with the model's tokenizer (~4 characters a token without one),
+    plus the few tokens the chat template adds around every message.
+    """
+    def __init__(self, tokenizer=None, message_overhead=4) -> None:
+        self.tokenizer = tokenizer
+        self.message_overhead = message_overhead
+
+    def __call__(self, text: str) -> int:
+        if self.tokenizer is None:
+            return len(text) // 4 + self.message_overhead
+        if hasattr(self.tokenizer, "encode_ordinary"):
+            # tiktoken
+            return len(self.tokenizer.encode_ordinary(text)) + self.message_overhead
+        return len(self.tokenizer.encode(text, add_special_tokens=False)) + self.message_overhead
+
+def make_token_counter(model, tokenizer=None) -> TokenCounter:
+    """
+    Counter with `tokenizer`, or the tokenizer of a served model if it is available locally:
+    the Hugging Face one of a vLLM model, tiktoken's for OpenAI models.
+    """
+    if tokenizer is None and isinstance(model, str):
+        try:
+            if model.startswith("gpt"):
+                import tiktoken
+                tokenizer = tiktoken.encoding_for_model(model)
+            else:
+                from transformers import AutoTokenizer
+                tokenizer = AutoTokenizer.from_pretrained(model, local_files_only=True)
+        except Exception as e:
+            logger.info(f"No local tokenizer for {model} ({e}), estimating token counts")
+    return TokenCounter(tokenizer)
+
+class ContextBuilder:
+    """
+    Prompt of the conversation, kept up to date as the transcript grows instead of rebuilt
+    every run: finished messages are appended once with their token count, only the
+    message being spoken is counted again.
+
+    With `max_prompt_tokens`, the oldest messages are dropped once the prompt goes over it,
+    down to `low_water` of it so the kept prefix (and the server's prefix cache) stays the
+    same for several turns. With a `summarizer`, dropped messages are summarized in the
+    background and the summary stands in for them after the system prompt.
+
+    :param summarizer: (previous summary, messages) -> new summary, e.g. make_chat_summarizer(model).
+    """
+    def __init__(self, transcript: GlobalTranscript, system_prompt: str, count_tokens: Callable[[str], int] = None,
+                 max_prompt_tokens: int = None, low_water=0.75, summarizer: Callable[[str, List[Dict[str, str]]], str] = None) -> None:
+        self.transcript = transcript
+        self.count_tokens = count_tokens or TokenCounter()
+        self.max_prompt_tokens = max_prompt_tokens
+        self.low_water = low_water
+        self.summarizer = summarizer
+        self.lock = threading.Lock()
+        self.system_message = {"role": "system", "content": system_prompt}
+        self.system_tokens = self.count_tokens(system_prompt)
+        # Finished messages, and cumulative[i] the tokens of messages[:i]
+        self.messages: List[Dict[str, str]] = []
+        self.cumulative = [0]
+        # Messages before `cut` are left out of the prompt
+        self.cut = 0
+        self.summary = ""
+        self.summary_message = None
+        self.summary_tokens = 0
+        self.summarized_upto = 0
+        self.is_summarizing = False
+        self.current_count = ("", 0)
+        self.builds = 0
+        self.last_prompt_tokens = 0
+        self.turns = []
+
+    def build(self) -> List[Dict[str, str]]:
+        with self.transcript.lock:
+            past = self.transcript.past_transcripts
+            new_messages = past[len(self.messages):]
+            current_speaker, current_text = self.transcript.current_speaker, self.transcript.current_text
+        with self.lock:
+            for message in new_messages:
+                self.messages.append(message)
+                self.cumulative.append(self.cumulative[-1] + self.count_tokens(message["content"]))
+            current = None
+            current_tokens = 0
+            if current_speaker is not None:
+                current = {"role": SPEAKER_TYPES_MAP.get(current_speaker, "assistant"), "content": current_text}
+                if self.current_count[0] != current_text:
+                    self.current_count = (current_text, self.count_tokens(current_text))
+                current_tokens = self.current_count[1]
+            if self.max_prompt_tokens is not None and self.__prompt_tokens(current_tokens) > self.max_prompt_tokens:
+                self.__drop_oldest(current_tokens)
+            context = [self.system_message]
+            if self.summary_message is not None:
+                context.append(self.summary_message)
+            context += self.messages[self.cut:]
+            if current is not None:
+                context.append(current)
+            self.builds += 1
+            self.last_prompt_tokens = self.__prompt_tokens(current_tokens)
+            return context
+
+    def end_turn(self):
+        """
+        The assistant started answering: records the prompt size of the turn.
+        """
+        with self.lock:
+            self.turns.append({"prompt_tokens": self.last_prompt_tokens, "builds": self.builds,
+                               "messages": len(self.messages) - self.cut, "dropped_messages": self.cut,
+                               "summary_tokens": self.summary_tokens})
+            self.builds = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {"messages": len(self.messages), "dropped_messages": self.cut, "summarized_messages": self.summarized_upto,
+                    "summary_tokens": self.summary_tokens, "last_prompt_tokens": self.last_prompt_tokens,
+                    "turns": list(self.turns)}
+
+    def __prompt_tokens(self, current_tokens: int) -> int:
+        return self.system_tokens + self.summary_tokens + self.cumulative[-1] - self.cumulative[self.cut] + current_tokens
+
+    def __drop_oldest(self, current_tokens: int):
+        # Smallest cut that brings the prompt down to the low water mark, the current message always stays
+        target = self.cumulative[-1] - (self.low_water * self.max_prompt_tokens - self.system_tokens - self.summary_tokens - current_tokens)
+        self.cut = max(self.cut, min(len(self.messages), bisect_left(self.cumulative, target)))
+        if self.summarizer is not None and not self.is_summarizing and self.cut > self.summarized_upto:
+            self.is_summarizing = True
+            GLOBAL_THREAD_POOL.submit(self.__summarize, self.summary, self.messages[self.summarized_upto:self.cut], self.cut)
+
+    def __summarize(self, summary: str, messages: List[Dict[str, str]], upto: int):
+        try:
+            summary = self.summarizer(summary, messages)
+        except Exception as e:
+            logger.warning(f"Summarizing {len(messages)} messages failed: {e}")
+            summary = None
+        with self.lock:
+            self.is_summarizing = False
+            if summary is not None:
+                self.summary = summary
+                self.summary_message = {"role": "system", "content": f"Summary of the earlier conversation: {summary}"}
+                self.summary_tokens = self.count_tokens(self.summary_message["content"])
+                self.summarized_upto = upto
+            # Messages dropped meanwhile get summarized next
+            if summary is not None and self.cut > self.summarized_upto:
+                self.is_summarizing = True
+                GLOBAL_THREAD_POOL.submit(self.__summarize, self.summary, self.messages[self.summarized_upto:self.cut], self.cut)
@@ -1,10 +1,12 @@
-from typing import Callable, Dict, Any
-from queue import Queue
+from typing import Callable, Dict, Any, List, Sequence
+from collections import deque
 import threading
 import time
 from termcolor import colored
 from synapse.utils import DataFrame
 from synapse.pipeline.streamers.common import DataStreamer, EventDrivenDataStreamer
+from synapse.pipeline.queues import OverflowPolicy
+from .transcript_log import TranscriptWriter
 import traceback
 from synapse.utils import AI_SPEECH_END_TOKEN
 
@@ -16,20 +18,119 @@ SPEAKER_COLOR_MAP = {
 SPEAKER_TYPES_MAP = {
 }
 
+class TranscriptMessage:
+    """
+    Text of the message being spoken, appended as a list of chunks and joined only when read.
+    Not thread safe, GlobalTranscript reads and appends under its lock.
+    """
+    def __init__(self, speaker) -> None:
+        self.speaker = speaker
+        self.chunks: List[str] = []
+        self.length = 0
+        self._text = ""
+
+    def append(self, text: str):
+        self.chunks.append(text)
+        self.length += len(text)
+
+    @property
+    def text(self) -> str:
+        if len(self.chunks) > 0:
+            # Joined once per read, the text becomes the first chunk of the next join
+            self._text = "".join([self._text] + self.chunks)
+            self.chunks = []
+        return self._text
+
+class TranscriptSnapshot(Sequence):
+    """
+    Read only view of the transcript at one point: the first `past_count` finished messages,
+    which never change, and the message being spoken as it was then. Costs no copy.
+    A Sequence rather than a list: it concatenates with lists on either side, compares equal
+    to a list of the same messages, and copy() returns a list, but what needs a real list
+    (json.dumps, in-place edits) takes copy().
+    """
+    def __init__(self, past_transcripts: List[Dict[str, str]], past_count: int, current: Dict[str, str] = None) -> None:
+        self.past_transcripts = past_transcripts
+        self.past_count = past_count
+        self.current = current
+
+    def __len__(self) -> int:
+        return self.past_count + (1 if self.current is not None else 0)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError(index)
+        return self.past_transcripts[index] if index < self.past_count else self.current
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+    def __eq__(self, other):
+        if not isinstance(other, Sequence) or isinstance(other, str):
+            return NotImplemented
+        return list(self) == list(other)
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+    def copy(self) -> List[Dict[str, str]]:
+        return list(self)
+
 class GlobalTranscript(EventDrivenDataStreamer):
-    def __init__(self, transcript_file=None) -> None:
+    """
+    Transcript of the whole conversation, committed to word by word from the STT and the LLM.
+
+    Committing only appends to the current message, printing happens on a render thread
+    every `render_interval` seconds, batched. Finished messages are kept once as dicts in
+    `past_transcripts`, which only grows.
+
+    :param transcript_file: Path of the JSONL log of every word and speaker change, see TranscriptWriter.
+    :param log_options: Keyword arguments of the TranscriptWriter (batching, rotation, compression).
+    """
+    # Committed words go downstream only once a stage reads them, and then the last few only
+    queue_maxsize = 256
+    overflow_policy = OverflowPolicy.DROP_OLDEST
+
+    def __init__(self, transcript_file=None, render_interval=0.05, log_options: Dict[str, Any] = None) -> None:
         super(GlobalTranscript, self).__init__()
-        # self.transcript = []
+        self.has_readers = False
         self.past_transcripts = []
-        self.current_text = ""
-        self.current_speaker = None
-        word_queue = Queue()
-        self.word_queue = word_queue
-        self.lock = threading.Lock()
+        self.current_message: TranscriptMessage = None
+        self.version = 0
+        self.snapshot: TranscriptSnapshot = None
+        self.snapshot_version = -1
+        # Reentrant, ContextBuilder snapshots the transcript under it
+        self.lock = threading.RLock()
         self.speaker_change_timings = []
         self.last_commit_at = time.time()
-        self.transcript_file = open(transcript_file, "w") if transcript_file is not None else None
-        
+        self.transcript_log = TranscriptWriter(transcript_file, **(log_options or {})) if transcript_file is not None else None
+        # (speaker, speaker type, text or None for a new line), appended by commits and taken by the render thread
+        self.render_buffer = deque()
+        self.render_interval = render_interval
+        self.render_requested = threading.Event()
+        self.rendered = threading.Condition()
+        self.render_count = 0
+        self.rendered_count = 0
+        self.render_thread = threading.Thread(target=self.__render, daemon=True)
+        self.render_thread.start()
+
+    @property
+    def current_speaker(self):
+        return self.current_message.speaker if self.current_message is not None else None
+
+    @property
+    def current_text(self) -> str:
+        # Reading joins the chunks, not to race with a commit
+        with self.lock:
+            return self.current_message.text if self.current_message is not None else ""
+
     def event_handlers(self) -> Dict[str, Callable[..., Any]]:
         """
         Simply forward the events to the triggers
@@ -39,83 +140,158 @@ class GlobalTranscript(EventDrivenDataStreamer):
             "sentence_end": lambda *args, **kwargs: self.trigger("sentence_end", *args, **kwargs),
             "speech_end": lambda *args, **kwargs: self.trigger("speech_end", *args, **kwargs)
         }
-        
+
     def commit_word(self, word, speaker, arrived_time=None, is_ai=False):
         with self.lock:
             self.__commit_word(word, speaker, arrived_time, is_ai)
-    
+
     def __commit_word(self, word, speaker, arrived_time=None, is_ai=False):
         if speaker not in SPEAKER_TYPES_MAP:
             SPEAKER_TYPES_MAP[speaker] = "user" if not is_ai else "assistant"
         self.commit((word, speaker))
         self.last_commit_at = time.time()
-        
+        if self.transcript_log is not None:
+            self.transcript_log.write({
+                "event": "word" if word != AI_SPEECH_END_TOKEN else "speech_end",
+                "at": self.last_commit_at,
+                "arrived_at": arrived_time,
+                "speaker": speaker,
+                "role": SPEAKER_TYPES_MAP[speaker],
+                "is_ai": is_ai,
+                "message": len(self.past_transcripts),
+                "text": word if word != AI_SPEECH_END_TOKEN else "",
+            })
+
     def commit(self, data: DataFrame):
         try:
             text, speaker = data
             speaker_type = SPEAKER_TYPES_MAP.get(speaker, "assistant")
-            color = SPEAKER_COLOR_MAP.get(speaker_type, "green")
-            text_to_render = ''
             if speaker != self.current_speaker:
                 # Speaker changed, commit a new line and add current text to past transcripts
                 speaker_change_time = time.time() - self.last_commit_at
+                old_speaker = self.current_speaker
                 self.speaker_change_timings.append({
-                    "last_speaker": self.current_speaker,
+                    "last_speaker": old_speaker,
                     "new_speaker": speaker,
                     "time": speaker_change_time,
                 })
-                if self.current_speaker is not None:
-                    self.past_transcripts.append({ "role": speaker_type, "content": self.current_text })
-                        
+                if self.transcript_log is not None:
+                    self.transcript_log.write({"event": "speaker_change", "at": time.time(), "old_speaker": old_speaker,
+                                               "new_speaker": speaker, "gap": speaker_change_time})
+                if self.current_message is not None:
+                    # The finished message is the previous speaker's
+                    self.past_transcripts.append({ "role": SPEAKER_TYPES_MAP.get(old_speaker, "assistant"), "content": self.current_message.text })
+
                 self.trigger(
                     "speaker_change",
-                    old_speaker=self.current_speaker, 
-                    old_speaker_type=SPEAKER_TYPES_MAP.get(self.current_speaker, "assistant"), 
-                    new_speaker=speaker, 
-                    new_speaker_type=speaker_type, 
+                    old_speaker=old_speaker,
+                    old_speaker_type=SPEAKER_TYPES_MAP.get(old_speaker, "assistant"),
+                    new_speaker=speaker,
+                    new_speaker_type=speaker_type,
                     time=speaker_change_time
                 )
-                self.current_speaker = speaker
-                self.current_text = ""
-                text_to_render = colored(f'\n{speaker}:', color)
-                
+                self.current_message = TranscriptMessage(speaker)
+                self.version += 1
+                self.render_buffer.append((speaker, speaker_type, None))
+                self.render_count += 1
+
             if text != AI_SPEECH_END_TOKEN:
-                text_to_render += colored(text, color)
-                print(text_to_render, end="")
-                if self.transcript_file is not None:
-                    self.transcript_file.write(text_to_render)
-                    self.transcript_file.flush()
-                self.current_text += text
-            return super().commit(data)
+                self.current_message.append(text)
+                self.version += 1
+                self.render_buffer.append((speaker, speaker_type, text))
+                self.render_count += 1
+            if self.has_readers:
+                super().commit(data)
         except Exception as e:
             print(f"Error while committing {data}: {e}", traceback.format_exc())
-        
+
     def __call__(self, data: DataFrame):
         self.commit_word(*data)
-    
+
     def commit_punctuation(self, punctuation):
         self.commit_word(punctuation, self.current_speaker)
-        
-    def sync(self):
-        self.word_queue.join()
-        
-    def get_transcript(self):
-        past_transcripts = list(self.past_transcripts)
-        # print("transcripts", past_transcripts)
-        return past_transcripts + [{ "role": SPEAKER_TYPES_MAP[self.current_speaker], "content": self.current_text }]
-    
+
+    def next_frame(self) -> tuple:
+        self.has_readers = True
+        return super(GlobalTranscript, self).next_frame()
+
+    def sync(self, timeout=None):
+        """
+        Waits for everything committed so far to be printed and written to the log.
+        """
+        target = self.render_count
+        with self.rendered:
+            self.render_requested.set()
+            self.rendered.wait_for(lambda: self.rendered_count >= target or not self.render_thread.is_alive(), timeout)
+        if self.transcript_log is not None:
+            self.transcript_log.flush(timeout)
+
+    def get_transcript(self) -> TranscriptSnapshot:
+        """
+        The transcript with the message being spoken, the same snapshot until the next commit.
+        A TranscriptSnapshot, not a list: use copy() where a list is needed.
+        """
+        with self.lock:
+            if self.snapshot_version != self.version:
+                current = None
+                if self.current_message is not None:
+                    current = { "role": SPEAKER_TYPES_MAP.get(self.current_speaker, "assistant"), "content": self.current_text }
+                self.snapshot = TranscriptSnapshot(self.past_transcripts, len(self.past_transcripts), current)
+                self.snapshot_version = self.version
+            return self.snapshot
+
     def get_speaker_change_timings(self):
         return self.speaker_change_timings
-    
+
     def close(self):
         super(GlobalTranscript, self).close()
-        self.word_queue.put(None)
-        self.word_queue.join(timeout=1)
-        self.sync()
-        
+        self.render_requested.set()
+        self.render_thread.join(timeout=1)
+        if self.transcript_log is not None:
+            self.transcript_log.close()
+
+    def __render(self):
+        # Prints and writes whatever piled up since the last round in one go
+        while True:
+            self.render_requested.wait(self.render_interval)
+            self.render_requested.clear()
+            is_closed = self.is_closed
+            items = []
+            while len(self.render_buffer) > 0:
+                items.append(self.render_buffer.popleft())
+            try:
+                self.__render_items(items)
+            except Exception as e:
+                print(f"Error while rendering the transcript: {e}", traceback.format_exc())
+            with self.rendered:
+                self.rendered_count += len(items)
+                self.rendered.notify_all()
+            if is_closed:
+                return
+
+    def __render_items(self, items: list):
+        if len(items) == 0:
+            return
+        text_to_render = ''
+        run, run_color = [], None
+        for speaker, speaker_type, text in items:
+            color = SPEAKER_COLOR_MAP.get(speaker_type, "green")
+            if text is not None and color == run_color:
+                run.append(text)
+                continue
+            if len(run) > 0:
+                text_to_render += colored(''.join(run), run_color)
+            if text is None:
+                text_to_render += colored(f'\n{speaker}:', color)
+                run, run_color = [], color
+            else:
+                run, run_color = [text], color
+        if len(run) > 0:
+            text_to_render += colored(''.join(run), run_color)
+        print(text_to_render, end="", flush=True)
+
     def __enter__(self):
         return self
-    
+
     def __exit__(self, exc_type, exc_value, traceback):
         self.close()
-        
\ No newline at end of file
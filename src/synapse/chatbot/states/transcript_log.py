@@ -0,0 +1,151 @@
+from typing import Any, Dict
+from collections import deque
+import gzip
+import json
+import os
+import re
+import shutil
+import threading
+import time
+
+from synapse.utils import GLOBAL_THREAD_POOL, logger
+
+class TranscriptWriter:
+    """
+    JSONL log of the transcript, one record per line, written by a background thread.
+
+    `write` only appends the record to a buffer. The thread serializes and writes the
+    pending records every `flush_interval` seconds, or as soon as `max_batch_records` are
+    pending, in batches of at most `max_batch_records` with one flush each. Once the file
+    reaches `max_bytes` it is renamed with a timestamp, gzipped in the background if
+    `compress`, and only the last `backup_count` of those are kept. A non-empty file left
+    at `path` by an earlier writer is rotated the same way at startup.
+    """
+    def __init__(self, path: str, flush_interval=1.0, max_batch_records=512, max_bytes=16 * 1024 * 1024,
+                 backup_count=10, compress=True) -> None:
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_batch_records = max_batch_records
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.compress = compress
+        self.records = deque()
+        self.flush_requested = threading.Event()
+        self.flushed = threading.Condition()
+        self.is_closed = False
+        self.compressions = []
+        self.written = 0
+        self.counters = {"records": 0, "batches": 0, "bytes": 0, "rotations": 0, "errors": 0}
+        # <root>.<YYYYmmdd-HHMMSS>.<counter><extension>, gzipped or not, the names __rotate gives
+        root, extension = os.path.splitext(os.path.basename(path))
+        self.rotated_pattern = re.compile(rf"{re.escape(root)}\.(\d{{8}}-\d{{6}})\.(\d+){re.escape(extension)}(\.gz)?")
+        self.file = open(path, "a", encoding="utf-8")
+        self.file_size = self.file.tell()
+        if self.file_size > 0:
+            # Each writer starts on an empty file, the previous one's log is kept as a rotated file
+            self.__rotate()
+        self.thread = threading.Thread(target=self.__write_batches, daemon=True)
+        self.thread.start()
+
+    def write(self, record: Dict[str, Any]):
+        self.records.append(record)
+        if len(self.records) >= self.max_batch_records and not self.flush_requested.is_set():
+            self.flush_requested.set()
+
+    def flush(self, timeout=None):
+        """
+        Waits for the records written so far to reach the file.
+        """
+        target = self.counters["records"] + len(self.records)
+        with self.flushed:
+            self.flush_requested.set()
+            self.flushed.wait_for(lambda: self.written >= target or not self.thread.is_alive(), timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = dict(self.counters)
+        stats["pending"] = len(self.records)
+        return stats
+
+    def close(self):
+        self.is_closed = True
+        self.flush_requested.set()
+        self.thread.join(timeout=5)
+        self.file.close()
+        for future in self.compressions:
+            future.result()
+
+    def __write_batches(self):
+        while True:
+            self.flush_requested.wait(self.flush_interval)
+            self.flush_requested.clear()
+            is_closed = self.is_closed
+            while len(self.records) > 0:
+                records = []
+                while len(self.records) > 0 and len(records) < self.max_batch_records:
+                    records.append(self.records.popleft())
+                try:
+                    self.__write(records)
+                except Exception as e:
+                    self.counters["errors"] += 1
+                    logger.error(f"Writing {len(records)} transcript records to {self.path} failed: {e}")
+                with self.flushed:
+                    self.written += len(records)
+                    self.flushed.notify_all()
+            if is_closed:
+                return
+
+    def __write(self, records: list):
+        data = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+        # Sizes in bytes, non ASCII text takes more than a byte a character
+        size = len(data.encode("utf-8"))
+        if self.file_size > 0 and self.file_size + size > self.max_bytes:
+            self.__rotate()
+        self.file.write(data)
+        self.file.flush()
+        self.file_size += size
+        self.counters["records"] += len(records)
+        self.counters["batches"] += 1
+        self.counters["bytes"] += size
+
+    def __rotate(self):
+        self.file.close()
+        root, extension = os.path.splitext(self.path)
+        timestamp, counter = time.strftime('%Y%m%d-%H%M%S'), self.counters["rotations"]
+        rotated = f"{root}.{timestamp}.{counter}{extension}"
+        # Another writer of this path may have rotated within the same second
+        while os.path.exists(rotated) or os.path.exists(rotated + ".gz"):
+            counter += 1
+            rotated = f"{root}.{timestamp}.{counter}{extension}"
+        os.replace(self.path, rotated)
+        self.file = open(self.path, "a", encoding="utf-8")
+        self.file_size = 0
+        self.counters["rotations"] += 1
+        if self.compress:
+            self.compressions = [future for future in self.compressions if not future.done()]
+            self.compressions.append(GLOBAL_THREAD_POOL.submit(self.__compress, rotated))
+        else:
+            self.__prune()
+
+    def __compress(self, rotated: str):
+        try:
+            with open(rotated, "rb") as source, gzip.open(rotated + ".gz", "wb") as target:
+                shutil.copyfileobj(source, target)
+            os.remove(rotated)
+        except Exception as e:
+            logger.error(f"Compressing {rotated} failed: {e}")
+        self.__prune()
+
+    def __prune(self):
+        directory = os.path.dirname(self.path) or "."
+        rotated = []
+        for name in os.listdir(directory):
+            match = self.rotated_pattern.fullmatch(name)
+            if match is not None:
+                # Rotated names sort by time, the counter breaks ties within a second
+                rotated.append(((match.group(1), int(match.group(2))), os.path.join(directory, name)))
+        rotated.sort()
+        for _, path in rotated[:max(0, len(rotated) - self.backup_count)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -8,6 +8,12 @@ class Config:
     ELEVENLABS_API_KEY: str
     ELEVENLABS_VOICE_ID: str
     OPENAI_API_KEY: str
+    # Overrides the Deepgram endpoint, e.g. a local stand-in (benchmarks/fake_deepgram.py)
+    DEEPGRAM_URL: str = None
+    # LLM backends: OpenAI (gpt models, None for the default endpoint) and a vLLM server (any other model)
+    OPENAI_BASE_URL: str = None
+    VLLM_BASE_URL: str = "http://localhost:8000/v1"
+    VLLM_API_KEY: str = "EMPTY"
     
 def load_config():
     load_dotenv()
@@ -15,7 +21,11 @@ def load_config():
         DEEPGRAM_API_KEY=os.getenv("DEEPGRAM_API_KEY"),
         ELEVENLABS_API_KEY=os.getenv("ELEVENLABS_API_KEY"),
         ELEVENLABS_VOICE_ID=os.getenv("ELEVENLABS_VOICE_ID"),
-        OPENAI_API_KEY=os.getenv("OPENAI_API_KEY")
+        OPENAI_API_KEY=os.getenv("OPENAI_API_KEY"),
+        DEEPGRAM_URL=os.getenv("DEEPGRAM_URL"),
+        OPENAI_BASE_URL=os.getenv("OPENAI_BASE_URL"),
+        VLLM_BASE_URL=os.getenv("VLLM_BASE_URL", "http://localhost:8000/v1"),
+        VLLM_API_KEY=os.getenv("VLLM_API_KEY", "EMPTY"),
     )
     
 config = load_config()
\ No newline at end of file
@@ -0,0 +1,151 @@
+from typing import Union
+import numpy as np
+
+
+class PCMConverter:
+    """
+    Converts interleaved PCM between sample formats, channel layouts and sample rates.
+
+    All work happens in buffers owned by the converter and reused across chunks (grown
+    only when a larger chunk shows up), clipping and scaling are done in place.
+    The resampler is linear and stateful, so chunk boundaries don't click; call reset()
+    between unrelated streams (e.g. sentences).
+
+    With `copy=False`, convert() returns a memoryview of an output buffer instead of bytes.
+    Output buffers are cycled through `ring_size` of them, so a view stays valid until
+    `ring_size - 1` further conversions.
+
+    :param in_dtype/out_dtype: "int16" or "float32".
+    """
+    DTYPES = {"int16": np.int16, "float32": np.float32}
+
+    def __init__(self, in_rate: int, in_channels: int = 1, in_dtype: str = "int16",
+                 out_rate: int = None, out_channels: int = None, out_dtype: str = "int16", ring_size: int = 1) -> None:
+        if in_dtype not in self.DTYPES or out_dtype not in self.DTYPES:
+            raise ValueError(f"Unsupported sample format: {in_dtype} -> {out_dtype}")
+        self.in_rate = in_rate
+        self.in_channels = in_channels
+        self.in_dtype = np.dtype(self.DTYPES[in_dtype])
+        self.out_rate = out_rate or in_rate
+        self.out_channels = out_channels or in_channels
+        self.out_dtype = np.dtype(self.DTYPES[out_dtype])
+        self.ring_size = max(1, ring_size)
+        self.ring_index = 0
+        self.buffers = {}
+        self.is_passthrough = (self.in_rate == self.out_rate and self.in_channels == self.out_channels
+                               and self.in_dtype == self.out_dtype)
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the resampler state, the next chunk starts a new stream.
+        """
+        self.prev = None
+        self.phase = 0.0
+
+    def convert(self, data: Union[bytes, bytearray, memoryview, np.ndarray], copy: bool = True) -> Union[bytes, memoryview]:
+        samples = self.__as_samples(data)
+        if self.is_passthrough:
+            if not copy:
+                return memoryview(samples).cast("B")
+            return data if isinstance(data, bytes) else samples.tobytes()
+        frames = samples.reshape(-1, self.in_channels)
+
+        work = self.__buffer("work", frames.shape, np.float32)
+        if self.in_dtype == np.int16:
+            np.multiply(frames, 1.0 / 32767.0, out=work, casting="unsafe")
+        else:
+            np.copyto(work, frames)
+
+        # Mix down before resampling so the resampler handles as few channels as possible
+        if self.in_channels != self.out_channels and self.in_channels > 1:
+            mono = self.__buffer("mono", (len(work), 1), np.float32)
+            np.mean(work, axis=1, keepdims=True, out=mono)
+            work = mono
+
+        if self.in_rate != self.out_rate:
+            work = self.__resample(work)
+
+        out = self.__output_buffer((len(work), self.out_channels))
+        if self.out_dtype == np.int16:
+            np.clip(work, -1.0, 1.0, out=work)
+            np.multiply(work, 32767.0, out=work)
+        # Broadcasts a mono work buffer to every output channel
+        np.copyto(out, work, casting="unsafe")
+        if not copy:
+            return memoryview(out.reshape(-1)).cast("B")
+        return out.tobytes()
+
+    def __as_samples(self, data) -> np.ndarray:
+        if isinstance(data, np.ndarray):
+            if data.ndim == 2:
+                # (channels, samples) -> interleaved
+                data = data.T
+            return np.ascontiguousarray(data, dtype=self.in_dtype).reshape(-1)
+        return np.frombuffer(data, dtype=self.in_dtype)
+
+    def __resample(self, work: np.ndarray) -> np.ndarray:
+        channels = work.shape[1]
+        if self.prev is None:
+            src = work
+        else:
+            src = self.__buffer("src", (len(work) + 1, channels), np.float32)
+            src[0] = self.prev
+            src[1:] = work
+        last = len(src) - 1
+        if last < 1:
+            self.__keep_last(src)
+            return src[:0]
+        step = self.in_rate / self.out_rate
+        count = int((last - self.phase) // step) + 1 if last >= self.phase else 0
+
+        positions = self.__buffer("positions", (count,), np.float64)
+        np.multiply(self.__ramp(count), step, out=positions)
+        positions += self.phase
+        # Positions are never negative, truncation is floor
+        index = self.__buffer("index", (count,), np.intp)
+        np.copyto(index, positions, casting="unsafe")
+        np.minimum(index, last - 1, out=index)
+        frac = self.__buffer("frac", (count, 1), np.float32)
+        np.subtract(positions, index, out=frac[:, 0], casting="unsafe")
+
+        left = self.__buffer("left", (count, channels), np.float32)
+        right = self.__buffer("right", (count, channels), np.float32)
+        np.take(src, index, axis=0, out=left)
+        np.add(index, 1, out=index)
+        np.take(src, index, axis=0, out=right)
+        # left + (right - left) * frac
+        np.subtract(right, left, out=right)
+        np.multiply(right, frac, out=right)
+        np.add(left, right, out=left)
+
+        if count > 0:
+            self.phase = positions[-1] + step - last
+        else:
+            self.phase -= last
+        self.__keep_last(src)
+        return left
+
+    def __keep_last(self, src: np.ndarray):
+        # The last input frame is the left neighbour of the next chunk's first output samples
+        if self.prev is None:
+            self.prev = np.empty(src.shape[1], dtype=np.float32)
+        self.prev[:] = src[-1]
+
+    def __ramp(self, count: int) -> np.ndarray:
+        ramp = self.buffers.get("ramp")
+        if ramp is None or len(ramp) < count:
+            ramp = self.buffers["ramp"] = np.arange(max(count, 2 * len(ramp) if ramp is not None else count), dtype=np.float64)
+        return ramp[:count]
+
+    def __buffer(self, name: str, shape: tuple, dtype) -> np.ndarray:
+        size = int(np.prod(shape))
+        buffer = self.buffers.get(name)
+        if buffer is None or buffer.size < size:
+            buffer = self.buffers[name] = np.empty(max(size, 2 * buffer.size if buffer is not None else size), dtype=dtype)
+        return buffer[:size].reshape(shape)
+
+    def __output_buffer(self, shape: tuple) -> np.ndarray:
+        name = f"out{self.ring_index}"
+        self.ring_index = (self.ring_index + 1) % self.ring_size
+        return self.__buffer(name, shape, self.out_dtype)
@@ -0,0 +1,67 @@
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict
+import threading
+import time
+
+# Origin time of the control signal being dispatched on this thread, so cascaded
+# signals are measured from the original barge-in/speech end rather than from the last hop
+_dispatch = threading.local()
+
+
+@dataclass
+class ControlFrame:
+    """
+    Out-of-band signal carried on the priority lane of a stage queue, ahead of any data.
+    :param drain: The receiver first processes whatever data is still pending in its source
+                  as one batch (used by speech end, which must not overtake its own words).
+    """
+    event: str
+    args: tuple = ()
+    issued_at: float = field(default_factory=time.time)
+    drain: bool = False
+
+
+def new_control_frame(event: str, args: tuple = (), drain: bool = False) -> ControlFrame:
+    issued_at = getattr(_dispatch, "issued_at", None)
+    return ControlFrame(event, args, issued_at if issued_at is not None else time.time(), drain)
+
+
+class ControlReceiver:
+    """
+    Mixin for sinks and stages that receive ControlFrames from their source's control lane.
+    Records how long every signal took to reach this stage.
+    """
+    def control_handlers(self) -> Dict[str, Callable]:
+        return {}
+
+    def handle_control(self, frame: ControlFrame):
+        self.record_control_latency(frame)
+        handler = self.control_handlers().get(frame.event)
+        if handler is None:
+            return
+        previous = getattr(_dispatch, "issued_at", None)
+        _dispatch.issued_at = frame.issued_at
+        try:
+            handler(*frame.args)
+        finally:
+            _dispatch.issued_at = previous
+
+    def record_control_latency(self, frame: ControlFrame):
+        latency = time.time() - frame.issued_at
+        stats = self.__dict__.setdefault("control_latencies", {})
+        entry = stats.setdefault(frame.event, {"count": 0, "total": 0.0, "max": 0.0, "last": 0.0})
+        entry["count"] += 1
+        entry["total"] += latency
+        entry["max"] = max(entry["max"], latency)
+        entry["last"] = latency
+
+    def get_control_latency_stats(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            event: {
+                "count": entry["count"],
+                "mean_ms": 1000 * entry["total"] / entry["count"],
+                "max_ms": 1000 * entry["max"],
+                "last_ms": 1000 * entry["last"],
+            }
+            for event, entry in self.__dict__.get("control_latencies", {}).items()
+        }
@@ -0,0 +1,20 @@
+import threading
+
+
+class EpochClock:
+    """
+    Turn counter shared by the stages of an interruptible chain (ChatBot -> Stream2Sentence -> TTS).
+    Every frame is tagged with the epoch it was produced in; bumping the clock on barge-in makes
+    every queued or in-flight frame of the old turn stale, and stages drop those at dequeue time.
+    """
+    def __init__(self) -> None:
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def bump(self) -> int:
+        with self._lock:
+            self.value += 1
+            return self.value
+
+    def is_stale(self, epoch: int) -> bool:
+        return epoch < self.value
@@ -0,0 +1,315 @@
+import asyncio
+from collections import deque
+from queue import Queue
+from typing import Any, Callable, Dict, List, Optional
+
+
+class OverflowPolicy:
+    """
+    What a bounded BackpressureQueue does with a new item once `maxsize` items are pending.
+    """
+    BLOCK = "block"                 # Producer waits for room (lossless, default)
+    DROP_OLDEST = "drop_oldest"     # Evict the oldest pending item (real-time audio)
+    DROP_NEWEST = "drop_newest"     # Discard the incoming item
+    COALESCE = "coalesce"           # Merge the incoming item into the newest pending one
+
+    ALL = (BLOCK, DROP_OLDEST, DROP_NEWEST, COALESCE)
+
+
+class BackpressureQueue(Queue):
+    """
+    A Queue bounded by `maxsize` that applies an OverflowPolicy when it is full,
+    and counts every dropped or coalesced item.
+
+    `coalesce_fn(pending, incoming)` returns the merged item, or None if the two can't be
+    merged, in which case the queue falls back to dropping the oldest item.
+    Items put with `force=True` (end of stream markers) ignore the bound.
+
+    Items put with `put_control` go on a separate priority lane: they are never dropped,
+    are not subject to the policy, and are handed out before any pending data.
+    """
+    def __init__(self, maxsize: int = 0, policy: str = OverflowPolicy.BLOCK, coalesce_fn: Callable[[Any, Any], Any] = None) -> None:
+        if policy not in OverflowPolicy.ALL:
+            raise ValueError(f"Unknown overflow policy: {policy}")
+        if policy == OverflowPolicy.COALESCE and coalesce_fn is None:
+            raise ValueError("coalesce policy requires a coalesce_fn")
+        super(BackpressureQueue, self).__init__(maxsize)
+        self.policy = policy
+        self.coalesce_fn = coalesce_fn
+        self.dropped = 0
+        self.coalesced = 0
+        self.high_watermark = 0
+
+    def put(self, item: Any, block: bool = True, timeout: Optional[float] = None, force: bool = False) -> bool:
+        """
+        Returns False if the item was discarded by the drop_newest policy.
+        """
+        if self.policy == OverflowPolicy.BLOCK and not force:
+            super(BackpressureQueue, self).put(item, block, timeout)
+            return True
+        with self.not_full:
+            if not force and 0 < self.maxsize <= len(self.queue):
+                if self.policy == OverflowPolicy.DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+                if self.policy == OverflowPolicy.COALESCE:
+                    merged = self.coalesce_fn(self.queue[-1], item)
+                    if merged is not None:
+                        self.queue[-1] = merged
+                        self.coalesced += 1
+                        return True
+                self._drop_oldest()
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+            return True
+
+    def put_control(self, item: Any):
+        with self.mutex:
+            self.control.append(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+    def take_pending(self) -> List[Any]:
+        """
+        Remove and return every pending data item up to an end of stream marker.
+        """
+        with self.mutex:
+            items = []
+            while self.queue and not self.queue[0][1]:
+                items.append(self.queue.popleft())
+            self.unfinished_tasks = max(0, self.unfinished_tasks - len(items))
+            if self.unfinished_tasks == 0:
+                self.all_tasks_done.notify_all()
+            self.not_full.notify_all()
+            return items
+
+    # Queue internals, the caller holds the mutex.
+    # Control items count towards _qsize so that get() wakes up for them, which means
+    # a pending control item can briefly hold a blocking producer back by one slot.
+    def _init(self, maxsize):
+        super(BackpressureQueue, self)._init(maxsize)
+        self.control = deque()
+
+    def _qsize(self):
+        return len(self.queue) + len(self.control)
+
+    def _get(self):
+        if self.control:
+            return self.control.popleft()
+        return self.queue.popleft()
+
+    def _put(self, item):
+        super(BackpressureQueue, self)._put(item)
+        if len(self.queue) > self.high_watermark:
+            self.high_watermark = len(self.queue)
+
+    def _drop_oldest(self):
+        self.queue.popleft()
+        self.dropped += 1
+        self.unfinished_tasks -= 1
+        if self.unfinished_tasks <= 0:
+            self.unfinished_tasks = 0
+            self.all_tasks_done.notify_all()
+
+    def clear(self) -> int:
+        """
+        Drop all pending data and wake up any blocked producers and joiners.
+        Pending control items are kept. Returns the number of items removed.
+        """
+        with self.mutex:
+            count = len(self.queue)
+            self.queue.clear()
+            # Reset the unfinished tasks count so that join() doesn’t block forever
+            self.unfinished_tasks = len(self.control)
+            self.all_tasks_done.notify_all()
+            self.not_full.notify_all()
+            return count
+
+    def stats(self) -> Dict[str, Any]:
+        with self.mutex:
+            return {
+                "policy": self.policy,
+                "maxsize": self.maxsize,
+                "pending": len(self.queue),
+                "control_pending": len(self.control),
+                "high_watermark": self.high_watermark,
+                "dropped": self.dropped,
+                "coalesced": self.coalesced,
+            }
+
+
+def coalesce_frames(pending: tuple, incoming: tuple):
+    """
+    Coalesce function for DataStreamer queue items of the form (data, is_final, epoch).
+    Concatenates bytes/str payloads of the same epoch, refuses to merge anything else.
+    """
+    pending_data, pending_final, pending_epoch = pending
+    incoming_data, incoming_final, incoming_epoch = incoming
+    if pending_final or incoming_final or pending_epoch != incoming_epoch:
+        return None
+    if isinstance(pending_data, (bytes, bytearray)) and isinstance(incoming_data, (bytes, bytearray)):
+        return (bytes(pending_data) + bytes(incoming_data), False, incoming_epoch)
+    if isinstance(pending_data, str) and isinstance(incoming_data, str):
+        return (pending_data + incoming_data, False, incoming_epoch)
+    return None
+
+
+class AsyncBackpressureQueue:
+    """
+    asyncio counterpart of BackpressureQueue, used by the AsyncDataStreamer family.
+    Must only be touched from the event loop thread. Control items are not counted by qsize().
+
+    Same interface as asyncio.Queue (get/put, *_nowait, task_done, join), on a buffer of its
+    own: the coroutines waiting for an item or for room are futures it keeps itself.
+    """
+    def __init__(self, maxsize: int = 0, policy: str = OverflowPolicy.BLOCK, coalesce_fn: Callable[[Any, Any], Any] = None) -> None:
+        if policy not in OverflowPolicy.ALL:
+            raise ValueError(f"Unknown overflow policy: {policy}")
+        if policy == OverflowPolicy.COALESCE and coalesce_fn is None:
+            raise ValueError("coalesce policy requires a coalesce_fn")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.coalesce_fn = coalesce_fn
+        self.queue = deque()
+        self.control = deque()
+        # Futures of the coroutines waiting in get() and put()
+        self.getters = deque()
+        self.putters = deque()
+        self.unfinished_tasks = 0
+        self.finished = asyncio.Event()
+        self.finished.set()
+        self.dropped = 0
+        self.coalesced = 0
+        self.high_watermark = 0
+
+    def qsize(self) -> int:
+        return len(self.queue)
+
+    def empty(self) -> bool:
+        return not self.queue and not self.control
+
+    def full(self) -> bool:
+        return 0 < self.maxsize <= len(self.queue)
+
+    async def put(self, item: Any, force: bool = False) -> bool:
+        if self.policy == OverflowPolicy.BLOCK and not force:
+            while self.full():
+                await self.__wait(self.putters)
+        return self.put_nowait(item, force)
+
+    def put_nowait(self, item: Any, force: bool = False) -> bool:
+        """
+        Raises asyncio.QueueFull only for the block policy, returns False if the
+        item was discarded by the drop_newest policy.
+        """
+        if not force and self.full():
+            if self.policy == OverflowPolicy.BLOCK:
+                raise asyncio.QueueFull
+            if self.policy == OverflowPolicy.DROP_NEWEST:
+                self.dropped += 1
+                return False
+            if self.policy == OverflowPolicy.COALESCE:
+                merged = self.coalesce_fn(self.queue[-1], item)
+                if merged is not None:
+                    self.queue[-1] = merged
+                    self.coalesced += 1
+                    return True
+            self.__drop_oldest()
+        self.queue.append(item)
+        if len(self.queue) > self.high_watermark:
+            self.high_watermark = len(self.queue)
+        self.__add_task()
+        return True
+
+    def put_control(self, item: Any):
+        self.control.append(item)
+        self.__add_task()
+
+    async def get(self) -> Any:
+        while self.empty():
+            await self.__wait(self.getters)
+        return self.get_nowait()
+
+    def get_nowait(self) -> Any:
+        if self.empty():
+            raise asyncio.QueueEmpty
+        item = self.control.popleft() if self.control else self.queue.popleft()
+        self.__wake_up(self.putters)
+        return item
+
+    def task_done(self):
+        if self.unfinished_tasks <= 0:
+            raise ValueError("task_done() called too many times")
+        self.__finish_tasks(1)
+
+    async def join(self):
+        await self.finished.wait()
+
+    def take_pending(self) -> List[Any]:
+        """
+        Remove and return every pending data item up to an end of stream marker.
+        """
+        items = []
+        while self.queue and not self.queue[0][1]:
+            items.append(self.queue.popleft())
+        self.__finish_tasks(len(items))
+        for _ in range(len(items)):
+            self.__wake_up(self.putters)
+        return items
+
+    def clear(self) -> int:
+        count = len(self.queue)
+        self.queue.clear()
+        # Reset the unfinished tasks count so that join() doesn't block forever
+        self.__finish_tasks(self.unfinished_tasks - len(self.control))
+        while self.putters:
+            self.__wake_up(self.putters)
+        return count
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "policy": self.policy,
+            "maxsize": self.maxsize,
+            "pending": len(self.queue),
+            "control_pending": len(self.control),
+            "high_watermark": self.high_watermark,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+        }
+
+    def __add_task(self):
+        self.unfinished_tasks += 1
+        self.finished.clear()
+        self.__wake_up(self.getters)
+
+    def __finish_tasks(self, count: int):
+        self.unfinished_tasks = max(0, self.unfinished_tasks - count)
+        if self.unfinished_tasks == 0:
+            self.finished.set()
+
+    def __drop_oldest(self):
+        self.queue.popleft()
+        self.dropped += 1
+        self.__finish_tasks(1)
+
+    async def __wait(self, waiters: deque):
+        waiter = asyncio.get_running_loop().create_future()
+        waiters.append(waiter)
+        try:
+            await waiter
+        except BaseException:
+            waiter.cancel()
+            try:
+                waiters.remove(waiter)
+            except ValueError:
+                # Woken up and cancelled at once, pass the wake up on
+                self.__wake_up(waiters)
+            raise
+
+    def __wake_up(self, waiters: deque):
+        while waiters:
+            waiter = waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
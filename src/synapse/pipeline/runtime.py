@@ -0,0 +1,76 @@
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Any, Callable, Coroutine
+import asyncio
+import functools
+import threading
+
+from synapse.utils import logger
+
+
+async def offload(fn: Callable, *args, **kwargs) -> Any:
+    """
+    Run a blocking call on the executor of the running loop (the runtime's blocking pool)
+    instead of stalling every session that shares the loop.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(fn, *args, **kwargs))
+
+
+class PipelineRuntime:
+    """
+    Owns one event loop on one thread, shared by any number of async pipelines/sessions.
+    Blocking stages are offloaded to a bounded thread pool, so the thread count stays
+    fixed no matter how many sessions are hosted.
+    """
+    def __init__(self, max_blocking_workers=8, name="synapse-runtime") -> None:
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=max_blocking_workers, thread_name_prefix=f"{name}-blocking")
+        self.loop.set_default_executor(self.executor)
+        self.is_closed = False
+        self.thread = threading.Thread(target=self.__run, name=name, daemon=True)
+        self.thread.start()
+
+    def __run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+
+    def submit(self, coro: Coroutine) -> Future:
+        """
+        Schedule a coroutine on the runtime loop from any thread.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Coroutine, timeout: float = None) -> Any:
+        """
+        Schedule a coroutine on the runtime loop and wait for its result.
+        """
+        return self.submit(coro).result(timeout)
+
+    def call_soon(self, fn: Callable, *args):
+        self.loop.call_soon_threadsafe(fn, *args)
+
+    def close(self):
+        if self.is_closed:
+            return
+        self.is_closed = True
+        async def __shutdown():
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        try:
+            self.run(__shutdown(), timeout=5)
+        except Exception as e:
+            logger.error(f"Error while shutting down runtime: {e}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=5)
+        self.executor.shutdown(wait=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -1,8 +1,9 @@
 from typing import Any, Callable, Iterator, AsyncGenerator, Dict, List
 from abc import ABC, abstractmethod
 from synapse.utils import DataFrame
+from synapse.pipeline.control import ControlReceiver
 
-class DataSink(ABC):    
+class DataSink(ControlReceiver, ABC):    
     def __init__(self) -> None:
         super(DataSink, self).__init__()
         pass
@@ -23,4 +24,31 @@ class DataSink(ABC):
         return self
     
     def __exit__(self, exc_type, exc_value, traceback):
-        self.close()
\ No newline at end of file
+        self.close()
+
+class AsyncDataSink(ControlReceiver, ABC):
+    """
+    Event loop counterpart of DataSink. __call__ is awaited on the pipeline loop,
+    so implementations must not block; offload blocking work explicitly.
+    """
+    def __init__(self) -> None:
+        super(AsyncDataSink, self).__init__()
+        pass
+    
+    def event_handlers(self) -> Dict[str, Callable]:
+        return {}
+    
+    @abstractmethod
+    async def __call__(self, data: DataFrame):
+        """ To be awaited on new data """
+        pass
+
+    @abstractmethod
+    def close(self):
+        pass
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -1,7 +1,7 @@
-from typing import Any, Callable, Iterator, AsyncGenerator, Dict, List
+from typing import Any, Callable, Iterator, AsyncIterator, AsyncGenerator, Dict, List
 from abc import ABC, abstractmethod
 from synapse.utils import DataFrame, EventEmitter
-from synapse.pipeline.sinks import DataSink
+from synapse.pipeline.sinks import DataSink, AsyncDataSink
 
 class DataSource(Iterator[DataFrame]):
     def __init__(self) -> None:
@@ -35,5 +35,46 @@ class EventDrivenDataSource(DataSource, EventEmitter):
         # Link the event handlers of the sink to the events of the source
         # print(f"Driving {sink} from {self}")
         handlers = sink.event_handlers()
+        # Signals the sink takes from the control lane would be handled twice
+        control_events = sink.control_handlers()
         for event, handler in handlers.items():
-            self.on(event, handler)
\ No newline at end of file
+            if event not in control_events:
+                self.on(event, handler)
+
+class AsyncDataSource(AsyncIterator[DataFrame]):
+    """
+    Event loop counterpart of DataSource.
+    """
+    def __init__(self) -> None:
+        super(AsyncDataSource, self).__init__()
+        pass
+    
+    @abstractmethod
+    async def __anext__(self) -> DataFrame:
+        """ To be awaited to fetch next data """
+        pass
+    
+    def __aiter__(self) -> AsyncIterator[DataFrame]:
+        return self
+    
+    @abstractmethod
+    def close(self):
+        pass
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+class AsyncEventDrivenDataSource(AsyncDataSource, EventEmitter):
+    def __init__(self) -> None:
+        super(AsyncEventDrivenDataSource, self).__init__()
+        pass
+    
+    def drive(self, sink: DataSink | AsyncDataSink):
+        handlers = sink.event_handlers()
+        control_events = sink.control_handlers()
+        for event, handler in handlers.items():
+            if event not in control_events:
+                self.on(event, handler)
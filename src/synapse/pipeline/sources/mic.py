@@ -1,15 +1,21 @@
-from queue import Queue
 from typing import Any
+import asyncio
 import pyaudio
 
-from synapse.pipeline.sources import DataSource
+from synapse.pipeline.sources import DataSource, AsyncDataSource
+from synapse.pipeline.queues import BackpressureQueue, AsyncBackpressureQueue, OverflowPolicy
 
 class LocalMicrophone(DataSource):
-    def __init__(self, format=pyaudio.paInt16, channels=1, sample_rate=16000, frames_per_buffer=1024) -> None:
+    def __init__(self, format=pyaudio.paInt16, channels=1, sample_rate=16000, frames_per_buffer=1024, max_buffered_frames=0) -> None:
+        """
+        :param max_buffered_frames: Bound on captured frames waiting for the consumer, 0 for unbounded.
+                                    When the consumer stalls the oldest frames are dropped, the
+                                    PortAudio callback must never block.
+        """
         super(LocalMicrophone, self).__init__()
         self.p = pyaudio.PyAudio()
         # Callback function to send audio data to Deepgram
-        self.queue = Queue()
+        self.queue = BackpressureQueue(max_buffered_frames, OverflowPolicy.DROP_OLDEST)
         def callback(in_data, frame_count, time_info, status):
             self.queue.put((in_data, False))
             return (in_data, pyaudio.paContinue)
@@ -22,9 +28,12 @@ class LocalMicrophone(DataSource):
             raise StopIteration
         return data
     
+    def get_backpressure_stats(self):
+        return self.queue.stats()
+    
     def close(self):
         super(LocalMicrophone, self).close()
-        self.queue.put((None, True))
+        self.queue.put((None, True), force=True)
         self.stream.stop_stream()
         self.stream.close()
         self.p.terminate()
@@ -34,4 +43,35 @@ class LocalMicrophone(DataSource):
     
     def __exit__(self, exc_type, exc_value, traceback):
         self.close()
-     
\ No newline at end of file
+     
+class AsyncLocalMicrophone(AsyncDataSource):
+    """
+    Microphone source for async pipelines: the PortAudio callback hands frames straight
+    to the event loop, no reader thread is involved. Must be constructed on the loop.
+    """
+    def __init__(self, format=pyaudio.paInt16, channels=1, sample_rate=16000, frames_per_buffer=1024, max_buffered_frames=0) -> None:
+        super(AsyncLocalMicrophone, self).__init__()
+        self.loop = asyncio.get_running_loop()
+        self.p = pyaudio.PyAudio()
+        self.queue = AsyncBackpressureQueue(max_buffered_frames, OverflowPolicy.DROP_OLDEST)
+        def callback(in_data, frame_count, time_info, status):
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, (in_data, False))
+            return (in_data, pyaudio.paContinue)
+        self.stream = self.p.open(format=format, channels=channels, rate=sample_rate, input=True, frames_per_buffer=frames_per_buffer, stream_callback=callback)
+
+    async def __anext__(self) -> Any:
+        data, is_final = await self.queue.get()
+        self.queue.task_done()
+        if is_final:
+            raise StopAsyncIteration
+        return data
+    
+    def get_backpressure_stats(self):
+        return self.queue.stats()
+    
+    def close(self):
+        super(AsyncLocalMicrophone, self).close()
+        self.stream.stop_stream()
+        self.stream.close()
+        self.p.terminate()
+        self.loop.call_soon_threadsafe(lambda: self.queue.put_nowait((None, True), force=True))
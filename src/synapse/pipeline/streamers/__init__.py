@@ -1,2 +1,4 @@
 from .common import *
-from .types import *
\ No newline at end of file
+from .types import *
+from .async_types import *
+from .audio import *
\ No newline at end of file
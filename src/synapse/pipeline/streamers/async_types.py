@@ -0,0 +1,419 @@
+from typing import Any, Callable, Dict
+from contextvars import ContextVar
+import asyncio
+import traceback
+
+from synapse.utils import DataFrame, EventEmitter
+from synapse.pipeline.sources import DataSource, AsyncDataSource, AsyncEventDrivenDataSource
+from synapse.pipeline.sinks import DataSink, AsyncDataSink
+from synapse.pipeline.queues import AsyncBackpressureQueue, OverflowPolicy, coalesce_frames
+from synapse.pipeline.runtime import offload
+from synapse.pipeline.epochs import EpochClock
+from synapse.pipeline.control import ControlFrame, ControlReceiver, new_control_frame
+from synapse.utils import logger
+from .types import DataStreamer
+from .common import InterruptibleStreamer
+
+# Epoch of the frame the current task is processing
+_frame_epoch: ContextVar[int] = ContextVar("frame_epoch", default=None)
+
+
+class AsyncDataStreamer(AsyncDataSource, AsyncDataSink):
+    """
+    Event loop counterpart of DataStreamer. read_from/write_to spawn tasks on the running
+    loop instead of OS threads. commit() is safe to call from any thread.
+    """
+    queue_maxsize: int = 0
+    overflow_policy: str = OverflowPolicy.BLOCK
+
+    def __init__(self) -> None:
+        super(AsyncDataStreamer, self).__init__()
+        self.msg_queue = AsyncBackpressureQueue(self.queue_maxsize, self.overflow_policy, coalesce_frames)
+        self.is_closed = False
+        self.loop: asyncio.AbstractEventLoop = None
+        try:
+            # Stages built on the loop are bound right away
+            self.loop = asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        self.tasks = []
+        self.epoch_clock = EpochClock()
+        self.stale_dropped = 0
+
+    def configure_backpressure(self, maxsize: int, overflow_policy: str = OverflowPolicy.BLOCK):
+        """
+        Bound the output queue of this stage, must be called before it is wired.
+        """
+        self.msg_queue = AsyncBackpressureQueue(maxsize, overflow_policy, coalesce_frames)
+        return self
+
+    def get_backpressure_stats(self):
+        stats = self.msg_queue.stats()
+        stats["stale_dropped"] = self.stale_dropped
+        return stats
+
+    def share_epoch_clock(self, other):
+        self.epoch_clock = other.epoch_clock
+
+    def current_epoch(self) -> int:
+        epoch = _frame_epoch.get()
+        return self.epoch_clock.value if epoch is None else epoch
+
+    def __bind_loop(self):
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+        return self.loop
+
+    def __in_loop(self) -> bool:
+        if self.loop is None:
+            try:
+                self.__bind_loop()
+            except RuntimeError:
+                raise RuntimeError(f"{type(self).__name__} is not bound to an event loop yet, wire it from inside the loop")
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    async def acommit(self, data: DataFrame, epoch: int = None):
+        """
+        Commit from a coroutine, waits for room under the block policy.
+        """
+        await self.msg_queue.put((data, False, self.current_epoch() if epoch is None else epoch))
+
+    def commit(self, data: DataFrame, epoch: int = None):
+        """
+        Commit from any thread. From a foreign thread this blocks under the block policy
+        (backpressure), on the loop thread it never blocks.
+        """
+        item = (data, False, self.current_epoch() if epoch is None else epoch)
+        if self.__in_loop():
+            try:
+                self.msg_queue.put_nowait(item)
+            except asyncio.QueueFull:
+                # Can't wait on the loop thread, overshoot the bound rather than deadlock
+                self.msg_queue.put_nowait(item, force=True)
+        elif self.msg_queue.policy == OverflowPolicy.BLOCK and self.msg_queue.maxsize > 0:
+            asyncio.run_coroutine_threadsafe(self.msg_queue.put(item), self.loop).result()
+        else:
+            self.loop.call_soon_threadsafe(self.msg_queue.put_nowait, item)
+
+    def commit_control(self, event: str, *args, drain: bool = False):
+        self.put_control(new_control_frame(event, args, drain))
+
+    def put_control(self, frame: ControlFrame):
+        if self.__in_loop():
+            self.msg_queue.put_control(frame)
+        else:
+            self.loop.call_soon_threadsafe(self.msg_queue.put_control, frame)
+
+    def take_pending(self) -> list:
+        frames = []
+        for data, is_final, epoch in self.msg_queue.take_pending():
+            if self.epoch_clock.is_stale(epoch):
+                self.stale_dropped += 1
+                continue
+            frames.append((data, epoch))
+        return frames
+
+    def clear(self):
+        if self.__in_loop():
+            self.msg_queue.clear()
+        else:
+            self.loop.call_soon_threadsafe(self.msg_queue.clear)
+
+    async def next_frame(self) -> tuple:
+        """
+        Returns the next (data, epoch) pair, skipping frames from old epochs.
+        Control frames come out as (ControlFrame, None).
+        """
+        while True:
+            item = await self.msg_queue.get()
+            self.msg_queue.task_done()
+            if isinstance(item, ControlFrame):
+                return item, None
+            data, is_final, epoch = item
+            if is_final:
+                raise StopAsyncIteration
+            if self.epoch_clock.is_stale(epoch):
+                self.stale_dropped += 1
+                continue
+            return data, epoch
+
+    async def frames(self):
+        while True:
+            try:
+                yield await self.next_frame()
+            except StopAsyncIteration:
+                return
+
+    async def __anext__(self) -> DataFrame:
+        while True:
+            data, epoch = await self.next_frame()
+            if not isinstance(data, ControlFrame):
+                return data
+
+    async def process_frame(self, data: DataFrame, epoch: int = None):
+        """
+        Process a frame, tagging whatever this task commits meanwhile with the frame's epoch.
+        """
+        token = _frame_epoch.set(self.epoch_clock.value if epoch is None else epoch)
+        try:
+            return await self(data)
+        finally:
+            _frame_epoch.reset(token)
+
+    async def process_batch(self, frames: list):
+        for data, epoch in frames:
+            await self.process_frame(data, epoch)
+
+    async def receive_control(self, frame: ControlFrame, data_source: AsyncDataSource):
+        if frame.drain and isinstance(data_source, AsyncDataStreamer):
+            frames = data_source.take_pending()
+            if data_source.epoch_clock is not self.epoch_clock:
+                frames = [(data, None) for data, epoch in frames]
+            if len(frames) > 0:
+                await self.process_batch(frames)
+        await self.dispatch_control(frame)
+
+    async def dispatch_control(self, frame: ControlFrame):
+        self.handle_control(frame)
+
+    def spawn(self, coro) -> asyncio.Task:
+        task = self.__bind_loop().create_task(coro)
+        self.tasks.append(task)
+        return task
+
+    def read_from(self, data_source: AsyncDataSource):
+        async def __read_from():
+            if isinstance(data_source, AsyncDataStreamer):
+                frames = data_source.frames()
+            else:
+                frames = self.__untagged(data_source)
+            async for frame, epoch in frames:
+                if self.is_closed:
+                    break
+                if isinstance(frame, ControlFrame):
+                    try:
+                        await self.receive_control(frame, data_source)
+                    except Exception as e:
+                        logger.error(f"Error while handling control {frame.event}: {e}", traceback.format_exc())
+                    continue
+                if epoch is not None and data_source.epoch_clock is not self.epoch_clock:
+                    epoch = None
+                try:
+                    await self.process_frame(frame, epoch)
+                except Exception as e:
+                    logger.error(f"Error while processing frame: {e}", traceback.format_exc())
+        self.read_from_task = self.spawn(__read_from())
+        if isinstance(data_source, AsyncEventDrivenDataSource):
+            data_source.drive(self)
+
+    def write_to(self, data_sink: AsyncDataSink):
+        async def __write_to():
+            while True:
+                try:
+                    async for data, epoch in self.frames():
+                        if self.is_closed:
+                            return
+                        if isinstance(data, ControlFrame):
+                            if isinstance(data_sink, ControlReceiver):
+                                data_sink.handle_control(data)
+                            continue
+                        if data is not None and not self.epoch_clock.is_stale(epoch):
+                            await data_sink(data)
+                    return
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Error while writing to sink: {e}", traceback.format_exc())
+        self.write_to_task = self.spawn(__write_to())
+
+    @staticmethod
+    async def __untagged(data_source: AsyncDataSource):
+        async for frame in data_source:
+            yield frame, None
+
+    def close(self):
+        super(AsyncDataStreamer, self).close()
+        self.is_closed = True
+        if self.loop is None:
+            return
+        final = lambda: self.msg_queue.put_nowait((None, True, self.epoch_clock.value), force=True)
+        if self.__in_loop():
+            final()
+        else:
+            self.loop.call_soon_threadsafe(final)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class AsyncEventDrivenDataStreamer(AsyncDataStreamer, AsyncEventDrivenDataSource):
+    def __init__(self) -> None:
+        super(AsyncEventDrivenDataStreamer, self).__init__()
+        pass
+
+    def write_to(self, data_sink: AsyncDataSink):
+        super().write_to(data_sink)
+        self.drive(data_sink)
+
+
+class AsyncSourceAdapter(AsyncDataSource):
+    """
+    Lets a threaded DataSource feed an async pipeline. Every __next__ is offloaded
+    to the runtime's blocking pool, prefer a native AsyncDataSource for long lived sources.
+    """
+    __END = object()
+
+    def __init__(self, source: DataSource) -> None:
+        super(AsyncSourceAdapter, self).__init__()
+        self.source = source
+
+    def __next_or_end(self):
+        try:
+            return next(self.source)
+        except StopIteration:
+            return AsyncSourceAdapter.__END
+
+    async def __anext__(self) -> DataFrame:
+        data = await offload(self.__next_or_end)
+        if data is AsyncSourceAdapter.__END:
+            raise StopAsyncIteration
+        return data
+
+    def close(self):
+        self.source.close()
+
+
+class AsyncSinkAdapter(AsyncDataSink):
+    """
+    Lets a threaded DataSink terminate an async pipeline.
+    :param blocking: Offload every call to the runtime's blocking pool (e.g. audio device writes).
+    """
+    def __init__(self, sink: DataSink, blocking=True) -> None:
+        super(AsyncSinkAdapter, self).__init__()
+        self.sink = sink
+        self.blocking = blocking
+
+    def event_handlers(self) -> Dict[str, Callable]:
+        return self.sink.event_handlers()
+
+    def control_handlers(self) -> Dict[str, Callable]:
+        return self.sink.control_handlers()
+
+    def handle_control(self, frame: ControlFrame):
+        self.sink.handle_control(frame)
+
+    async def __call__(self, data: DataFrame):
+        if self.blocking:
+            await offload(self.sink, data)
+        else:
+            self.sink(data)
+
+    def close(self):
+        self.sink.close()
+
+
+class _LoopBridgeQueue:
+    """
+    Stands in for the msg_queue of a wrapped DataStreamer, forwarding whatever it
+    commits (from any thread) into the adapter's loop queue.
+    """
+    def __init__(self, adapter: "AsyncStreamerAdapter") -> None:
+        self.adapter = adapter
+
+    def put(self, item, block=True, timeout=None, force=False):
+        data, is_final, epoch = item
+        if not is_final:
+            self.adapter.commit(data, epoch)
+        return True
+
+    def put_control(self, item):
+        self.adapter.put_control(item)
+
+    def take_pending(self):
+        return []
+
+    def clear(self):
+        self.adapter.clear()
+        return 0
+
+    def stats(self):
+        return self.adapter.get_backpressure_stats()
+
+
+class AsyncStreamerAdapter(AsyncEventDrivenDataStreamer):
+    """
+    Runs an existing threaded DataStreamer (ChatBot, Stream2Sentence, KokoroTTS, ...) as
+    a stage of an async pipeline without its per-edge read_from/write_to threads.
+    Frames are handed to the wrapped streamer on the loop, or on the blocking pool if
+    `blocking` is set; whatever it commits is bridged back onto the loop.
+    """
+    def __init__(self, streamer: DataStreamer, blocking=False) -> None:
+        super(AsyncStreamerAdapter, self).__init__()
+        self.streamer = streamer
+        self.blocking = blocking
+        streamer.msg_queue = _LoopBridgeQueue(self)
+        self.epoch_clock = streamer.epoch_clock
+
+    def share_epoch_clock(self, other):
+        self.streamer.share_epoch_clock(other)
+        self.epoch_clock = self.streamer.epoch_clock
+
+    def read_from(self, data_source: AsyncDataSource):
+        # Same clock sharing rule as InterruptibleStreamer.read_from
+        if isinstance(data_source, AsyncStreamerAdapter) \
+            and isinstance(data_source.streamer, InterruptibleStreamer) \
+            and isinstance(self.streamer, InterruptibleStreamer):
+            self.share_epoch_clock(data_source)
+        super(AsyncStreamerAdapter, self).read_from(data_source)
+
+    def event_handlers(self) -> Dict[str, Callable]:
+        return self.streamer.event_handlers()
+
+    def control_handlers(self) -> Dict[str, Callable]:
+        return self.streamer.control_handlers()
+
+    def handle_control(self, frame: ControlFrame):
+        self.streamer.handle_control(frame)
+
+    async def dispatch_control(self, frame: ControlFrame):
+        # Handlers of a blocking streamer can block too (ChatBot starts a run on speech end)
+        if self.blocking:
+            await offload(self.streamer.handle_control, frame)
+        else:
+            self.streamer.handle_control(frame)
+
+    def get_control_latency_stats(self):
+        return self.streamer.get_control_latency_stats()
+
+    def on(self, event: str, handler: Callable):
+        # Events are raised by the wrapped streamer, register there
+        if isinstance(self.streamer, EventEmitter):
+            self.streamer.on(event, handler)
+        else:
+            super().on(event, handler)
+
+    async def __call__(self, data: DataFrame):
+        await self.process_frame(data)
+
+    async def process_frame(self, data: DataFrame, epoch: int = None):
+        # The wrapped streamer tags what it commits on its own (thread local) frame context
+        if self.blocking:
+            await offload(self.streamer.process_frame, data, epoch)
+        else:
+            self.streamer.process_frame(data, epoch)
+
+    async def process_batch(self, frames: list):
+        if self.blocking:
+            await offload(self.streamer.process_batch, frames)
+        else:
+            self.streamer.process_batch(frames)
+
+    def close(self):
+        self.streamer.close()
+        super(AsyncStreamerAdapter, self).close()
@@ -0,0 +1,183 @@
+from collections import deque
+import time
+
+import numpy as np
+
+from synapse.utils import DataFrame
+from synapse.pipeline.audio import PCMConverter
+from synapse.pipeline.control import ControlFrame
+from synapse.pipeline.queues import OverflowPolicy
+from synapse.pipeline.vad import EnergyVAD
+from .types import DataStreamer, EventDrivenDataStreamer
+
+class AudioConverter(DataStreamer):
+    """
+    Stage that converts PCM audio between sample formats, channel layouts and rates
+    (see PCMConverter), e.g. between the microphone and STT or between TTS and the speaker.
+    It is transparent to the rest of the pipeline: it follows the turn epochs of its source
+    and passes control signals on untouched.
+
+    :param zero_copy_depth: If > 0, commits memoryviews of the converter's output buffers
+                            instead of bytes. The stage queue is then bounded to this depth
+                            (block policy) and the buffer ring sized so that no view is
+                            overwritten before its consumer is done with it.
+    """
+    def __init__(self, in_rate: int, in_channels: int = 1, in_dtype: str = "int16",
+                 out_rate: int = None, out_channels: int = None, out_dtype: str = "int16", zero_copy_depth: int = 0) -> None:
+        super(AudioConverter, self).__init__()
+        self.zero_copy = zero_copy_depth > 0
+        if self.zero_copy:
+            super(AudioConverter, self).configure_backpressure(zero_copy_depth, OverflowPolicy.BLOCK)
+        # Queued views, the one held by the consumer and the one being written
+        ring_size = zero_copy_depth + 2 if self.zero_copy else 1
+        self.converter = PCMConverter(in_rate, in_channels, in_dtype, out_rate, out_channels, out_dtype, ring_size)
+        self.out_rate = self.converter.out_rate
+        self.out_channels = self.converter.out_channels
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    @property
+    def is_passthrough(self) -> bool:
+        return self.converter.is_passthrough
+
+    def configure_backpressure(self, maxsize: int, overflow_policy: str = OverflowPolicy.BLOCK):
+        if self.zero_copy:
+            raise ValueError("A zero copy AudioConverter is bounded by its zero_copy_depth")
+        return super(AudioConverter, self).configure_backpressure(maxsize, overflow_policy)
+
+    def read_from(self, data_source):
+        # Keep the source's epochs so that audio of an interrupted turn is still dropped downstream
+        if isinstance(data_source, DataStreamer):
+            self.share_epoch_clock(data_source)
+        super(AudioConverter, self).read_from(data_source)
+
+    def handle_control(self, frame: ControlFrame):
+        self.record_control_latency(frame)
+        self.msg_queue.put_control(frame)
+
+    def __call__(self, data: DataFrame):
+        if data is None:
+            return
+        converted = self.converter.convert(data, copy=not self.zero_copy)
+        self.bytes_in += len(data)
+        self.bytes_out += len(converted)
+        self.commit(converted)
+
+    def get_conversion_stats(self):
+        return {
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "reduction": self.bytes_in / self.bytes_out if self.bytes_out else 0.0,
+        }
+
+    def reset(self):
+        self.converter.reset()
+
+
+class VADGate(EventDrivenDataStreamer):
+    """
+    Stage in front of STT that only lets speech through. Silent frames are dropped instead
+    of being streamed (and billed); while silent, a "keepalive" control signal goes out every
+    `keepalive_interval` seconds so that the STT connection stays open.
+
+    Speech starts after `min_speech_ms` of voiced audio and ends after `hangover_ms` of
+    silence. Both are raised as events and sent downstream as "speech_start"/"speech_end"
+    control signals; speech end drains the trailing audio first, so STT can finalize as soon
+    as it arrives instead of waiting for server side endpointing.
+
+    :param detector: Callable scoring mono float32 chunks in [0, 1] (EnergyVAD, OnnxVAD), with
+                     a `sample_rate` attribute (None for any rate) and reset().
+    :param pre_roll_ms: Audio kept from before speech start and sent with it, so the first
+                        syllable isn't clipped.
+    """
+    def __init__(self, sample_rate: int, channels: int = 1, detector=None, threshold=0.5,
+                 min_speech_ms=60, hangover_ms=300, pre_roll_ms=300, keepalive_interval=5.0) -> None:
+        super(VADGate, self).__init__()
+        self.detector = detector or EnergyVAD()
+        self.threshold = threshold
+        self.min_speech_ms = min_speech_ms
+        self.hangover_ms = hangover_ms
+        self.keepalive_interval = keepalive_interval
+        self.bytes_per_ms = 2 * channels * sample_rate / 1000
+        self.pre_roll_bytes = int(pre_roll_ms * self.bytes_per_ms)
+        self.converter = PCMConverter(sample_rate, channels, "int16", self.detector.sample_rate or sample_rate, 1, "float32")
+        self.pre_roll = deque()
+        self.pre_roll_size = 0
+        self.is_speaking = False
+        self.voiced_ms = 0.0
+        self.silence_ms = 0.0
+        self.last_sent_time = time.time()
+        self.stats_counters = {"bytes_in": 0, "bytes_sent": 0, "keepalives": 0, "speech_segments": 0}
+
+    def read_from(self, data_source):
+        if isinstance(data_source, DataStreamer):
+            self.share_epoch_clock(data_source)
+        super(VADGate, self).read_from(data_source)
+
+    def handle_control(self, frame: ControlFrame):
+        self.record_control_latency(frame)
+        self.msg_queue.put_control(frame)
+
+    def __call__(self, data: DataFrame):
+        if data is None:
+            return
+        self.stats_counters["bytes_in"] += len(data)
+        duration_ms = len(data) / self.bytes_per_ms
+        samples = np.frombuffer(self.converter.convert(data, copy=False), dtype=np.float32)
+        is_voiced = self.detector(samples) >= self.threshold
+        if self.is_speaking:
+            self.__send(data)
+            self.silence_ms = 0.0 if is_voiced else self.silence_ms + duration_ms
+            if self.silence_ms >= self.hangover_ms:
+                self.__end_speech()
+            return
+        self.voiced_ms = self.voiced_ms + duration_ms if is_voiced else 0.0
+        self.pre_roll.append(data)
+        self.pre_roll_size += len(data)
+        if self.voiced_ms >= self.min_speech_ms:
+            self.__start_speech()
+            return
+        while self.pre_roll_size > self.pre_roll_bytes and len(self.pre_roll) > 1:
+            self.pre_roll_size -= len(self.pre_roll.popleft())
+        if time.time() - self.last_sent_time >= self.keepalive_interval:
+            self.stats_counters["keepalives"] += 1
+            self.last_sent_time = time.time()
+            self.commit_control("keepalive")
+
+    def __send(self, data: DataFrame):
+        self.stats_counters["bytes_sent"] += len(data)
+        self.last_sent_time = time.time()
+        self.commit(data)
+
+    def __start_speech(self):
+        self.is_speaking = True
+        self.silence_ms = 0.0
+        self.stats_counters["speech_segments"] += 1
+        self.trigger("speech_start")
+        self.commit_control("speech_start")
+        while self.pre_roll:
+            self.__send(self.pre_roll.popleft())
+        self.pre_roll_size = 0
+
+    def __end_speech(self):
+        self.is_speaking = False
+        self.voiced_ms = 0.0
+        self.trigger("speech_end")
+        # Behind the trailing audio, STT finalizes once it has sent all of it
+        self.commit_control("speech_end", drain=True)
+
+    def get_vad_stats(self):
+        stats = dict(self.stats_counters)
+        stats["bytes_suppressed"] = stats["bytes_in"] - stats["bytes_sent"]
+        stats["suppressed_ratio"] = stats["bytes_suppressed"] / stats["bytes_in"] if stats["bytes_in"] else 0.0
+        stats["is_speaking"] = self.is_speaking
+        return stats
+
+    def reset(self):
+        self.detector.reset()
+        self.converter.reset()
+        self.pre_roll.clear()
+        self.pre_roll_size = 0
+        self.is_speaking = False
+        self.voiced_ms = 0.0
+        self.silence_ms = 0.0
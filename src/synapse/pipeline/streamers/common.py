@@ -82,27 +82,42 @@ class InterruptibleStreamer(EventDrivenDataStreamer):
             "end": self.handle_end,
         }
     
+    def control_handlers(self):
+        return self.event_handlers()
+    
+    def read_from(self, data_source):
+        # Interruptible stages downstream of each other share one epoch clock,
+        # so a barge-in is a single bump for the whole chain
+        if isinstance(data_source, InterruptibleStreamer):
+            self.share_epoch_clock(data_source)
+        super(InterruptibleStreamer, self).read_from(data_source)
+    
+    # Turn signals travel to downstream stages on the control lane, ahead of queued data,
+    # and are still triggered as events for the listeners registered with on()
     def start(self):
+        self.commit_control("start")
         self.trigger("start")
         
     def interrupt(self):
+        self.commit_control("interrupt", self.epoch_clock)
         self.trigger("interrupt")
         
     def end(self):
+        self.commit_control("end")
         self.trigger("end")
                 
     def handle_start(self):
         with self.interrupt_lock:
             self.interrupted = False
-            # Clear all pending stuff from the buffer
-            # self.clear()
             self.start_time = time.time()
 
-    def handle_interrupt(self):
+    def handle_interrupt(self, epoch_clock=None):
         with self.interrupt_lock:
             self.interrupted = True
-            # Clear all pending stuff from the buffer
-            self.clear()
+            # Everything pending or in flight from the current turn becomes stale.
+            # Skip the bump if the upstream stage already bumped our shared clock.
+            if epoch_clock is not self.epoch_clock:
+                self.epoch_clock.bump()
     
     def handle_end(self):
         pass
@@ -117,16 +132,14 @@ class InterruptCascadeStreamer(InterruptibleStreamer):
     def handle_start(self):
         with self.interrupt_lock:
             self.interrupted = False
-            # Clear all pending stuff from the buffer
-            # self.clear()
             self.start_time = time.time()
             self.start()
         
-    def handle_interrupt(self):
+    def handle_interrupt(self, epoch_clock=None):
         with self.interrupt_lock:
             self.interrupted = True
-            # Clear all pending stuff from the buffer
-            self.clear()
+            if epoch_clock is not self.epoch_clock:
+                self.epoch_clock.bump()
             self.interrupt()
         
     def handle_end(self):
@@ -140,7 +153,8 @@ class SpeechToTextStreamer(EventDrivenDataStreamer):
         self._on_message_cb = lambda: None
         
     def speech_end(self):
-        self.commit(SpeechToTextStreamer.SPEECH_END_TOKEN)
+        # Overtakes queued data, the consumer drains the words that preceded it as one batch
+        self.commit_control("speech_end", drain=True)
 
 class TextToSpeechStreamer(EventDrivenDataStreamer):
     def __init__(self):
@@ -154,9 +168,9 @@ class CancellableText2SpeechStreamer(TextToSpeechStreamer, InterruptCascadeStrea
     def __call__(self, text_iterator: Iterator[str]):
         pass
     
-    def handle_interrupt(self):
+    def handle_interrupt(self, epoch_clock=None):
         print(colored("((Interrupting TTS))", "light_cyan"), end="")
-        super(CancellableText2SpeechStreamer, self).handle_interrupt()
+        super(CancellableText2SpeechStreamer, self).handle_interrupt(epoch_clock)
         print(colored("((Interrupted TTS))", "light_cyan"), end="")
         
     def handle_start(self):
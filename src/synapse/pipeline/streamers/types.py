@@ -1,4 +1,3 @@
-from queue import Queue
 import threading
 
 from synapse.utils import DataFrame
@@ -6,45 +5,160 @@ from synapse.pipeline.sources import DataSource, EventDrivenDataSource
 from synapse.pipeline.sinks import DataSink
 from synapse.utils import logger
 import traceback
+from synapse.pipeline.queues import BackpressureQueue, OverflowPolicy, coalesce_frames
+from synapse.pipeline.epochs import EpochClock
+from synapse.pipeline.control import ControlFrame, ControlReceiver, new_control_frame
 
 class DataStreamer(DataSource, DataSink):
+    # Default backpressure settings, subclasses may override these per stage
+    queue_maxsize: int = 0
+    overflow_policy: str = OverflowPolicy.BLOCK
+    
     def __init__(self) -> None:
         super(DataStreamer, self).__init__()
-        self.msg_queue = Queue()
+        self.msg_queue = BackpressureQueue(self.queue_maxsize, self.overflow_policy, coalesce_frames)
         self.is_closed = False
+        self.epoch_clock = EpochClock()
+        self.frame_context = threading.local()
+        self.stale_dropped = 0
         pass
     
-    def commit(self, data: DataFrame):
-        self.msg_queue.put((data, False))
+    def configure_backpressure(self, maxsize: int, overflow_policy: str = OverflowPolicy.BLOCK):
+        """
+        Bound the output queue of this stage and choose what happens when it is full.
+        Must be called before the stage is wired with read_from/write_to.
+        """
+        self.msg_queue = BackpressureQueue(maxsize, overflow_policy, coalesce_frames)
+        return self
+    
+    def get_backpressure_stats(self):
+        stats = self.msg_queue.stats()
+        stats["stale_dropped"] = self.stale_dropped
+        return stats
+    
+    def share_epoch_clock(self, other: "DataStreamer"):
+        """
+        Make this stage follow the turn epochs of `other`, so one bump invalidates both.
+        """
+        self.epoch_clock = other.epoch_clock
+    
+    def current_epoch(self) -> int:
+        """
+        Epoch of the frame being processed on this thread, or the live epoch elsewhere.
+        """
+        epoch = getattr(self.frame_context, "epoch", None)
+        return self.epoch_clock.value if epoch is None else epoch
+    
+    def commit(self, data: DataFrame, epoch: int = None):
+        self.msg_queue.put((data, False, self.current_epoch() if epoch is None else epoch))
+        
+    def commit_control(self, event: str, *args, drain: bool = False):
+        """
+        Send a control signal to the consumers of this stage on the priority lane,
+        ahead of any data they haven't dequeued yet.
+        """
+        self.msg_queue.put_control(new_control_frame(event, args, drain))
+        
+    def take_pending(self) -> list:
+        """
+        Remove and return the (data, epoch) pairs still waiting in the queue, minus stale ones.
+        """
+        frames = []
+        for data, is_final, epoch in self.msg_queue.take_pending():
+            if self.epoch_clock.is_stale(epoch):
+                self.stale_dropped += 1
+                continue
+            frames.append((data, epoch))
+        return frames
         
     def clear(self):
         """
         Clear any pending data in the message queue.
-        This is done by repeatedly removing items from the queue until it is empty.
+        Interrupts don't need this, bumping the epoch clock already makes pending frames stale.
         """
-        with self.msg_queue.mutex:
-            self.msg_queue.queue.clear()
-            # Reset the unfinished tasks count to zero so that join() doesn’t block forever
-            self.msg_queue.unfinished_tasks = 0
-            self.msg_queue.all_tasks_done.notify_all()
+        self.msg_queue.clear()
+        
+    def next_frame(self) -> tuple:
+        """
+        Returns the next (data, epoch) pair, skipping frames from old epochs.
+        Control frames come out as (ControlFrame, None).
+        """
+        while True:
+            item = self.msg_queue.get()
+            self.msg_queue.task_done()
+            if isinstance(item, ControlFrame):
+                return item, None
+            data, is_final, epoch = item
+            if is_final:
+                raise StopIteration
+            if self.epoch_clock.is_stale(epoch):
+                self.stale_dropped += 1
+                continue
+            return data, epoch
+        
+    def frames(self):
+        while True:
+            try:
+                yield self.next_frame()
+            except StopIteration:
+                return
         
     def __next__(self) -> DataFrame:
-        data, is_final = self.msg_queue.get()
-        self.msg_queue.task_done()
-        if is_final:
-            raise StopIteration
-        return data
+        while True:
+            data, epoch = self.next_frame()
+            # Control frames only mean something to wired consumers
+            if not isinstance(data, ControlFrame):
+                return data
     
     def __iter__(self) -> DataFrame:
         return self
     
+    def process_frame(self, data: DataFrame, epoch: int = None):
+        """
+        Process a frame, tagging whatever this thread commits meanwhile with the frame's epoch.
+        """
+        self.frame_context.epoch = self.epoch_clock.value if epoch is None else epoch
+        try:
+            return self(data)
+        finally:
+            self.frame_context.epoch = None
+    
+    def process_batch(self, frames: list):
+        """
+        Process several pending (data, epoch) frames at once, stages may merge them.
+        """
+        for data, epoch in frames:
+            self.process_frame(data, epoch)
+    
+    def receive_control(self, frame: ControlFrame, data_source: DataSource):
+        if frame.drain and isinstance(data_source, DataStreamer):
+            frames = data_source.take_pending()
+            if data_source.epoch_clock is not self.epoch_clock:
+                frames = [(data, None) for data, epoch in frames]
+            if len(frames) > 0:
+                self.process_batch(frames)
+        self.handle_control(frame)
+    
     def read_from(self, data_source: DataSource):
         def __read_from():
-            for frame in data_source:
+            if isinstance(data_source, DataStreamer):
+                frames = data_source.frames()
+            else:
+                frames = ((frame, None) for frame in data_source)
+            for frame, epoch in frames:
                 if self.is_closed:
                     break
+                if isinstance(frame, ControlFrame):
+                    try:
+                        self.receive_control(frame, data_source)
+                    except Exception as e:
+                        logger.error(f"Error while handling control {frame.event}: {e}", traceback.format_exc())
+                    continue
+                if epoch is not None and data_source.epoch_clock is not self.epoch_clock:
+                    # Epochs of an unrelated clock mean nothing to this stage
+                    epoch = None
                 try:
-                    self(frame)
+                    self.process_frame(frame, epoch)
                 except Exception as e:
                     logger.error(f"Error while processing frame: {e}", traceback.format_exc())
         self.read_from_thread = threading.Thread(target=__read_from)
@@ -57,15 +171,17 @@ class DataStreamer(DataSource, DataSink):
         def __write_to():
             while True:
                 try:
-                    for data in self:
+                    for data, epoch in self.frames():
                         if self.is_closed:
                             return
-                        # data, is_final = self.msg_queue.get()
-                        # self.msg_queue.task_done()
-                        # if is_final:
-                        #     break
-                        if data is not None:
+                        if isinstance(data, ControlFrame):
+                            if isinstance(data_sink, ControlReceiver):
+                                data_sink.handle_control(data)
+                            continue
+                        # The turn may have been interrupted while this frame was in hand
+                        if data is not None and not self.epoch_clock.is_stale(epoch):
                             data_sink(data)
+                    return
                 except Exception as e:
                     logger.error(f"Error while writing to sink: {e}", traceback.format_exc())
         self.write_to_thread = threading.Thread(target=__write_to)
@@ -74,7 +190,7 @@ class DataStreamer(DataSource, DataSink):
     def close(self):
         super(DataStreamer, self).close()
         self.is_closed = True
-        self.msg_queue.put((None, True))
+        self.msg_queue.put((None, True, self.epoch_clock.value), force=True)
         pass
     
     def __enter__(self):
@@ -0,0 +1,103 @@
+from collections import deque
+
+import numpy as np
+
+
+class EnergyVAD:
+    """
+    Voice activity detector on the RMS level of a chunk against an adaptive noise floor.
+    Cheap enough to run on every mic callback and good enough for a close-talking mic.
+
+    The floor is the quietest chunk of the last `floor_window` chunks, speech or not
+    (minimum statistics): speech has pauses, so the minimum stays on the noise, and a steady
+    noise louder than the floor lifts it within `floor_window` chunks instead of passing for
+    speech for good. It starts from the level of the first chunk.
+
+    :param threshold_db: How far above the noise floor a chunk must be to count as speech.
+    :param min_level_db: Chunks quieter than this (dBFS) are never speech, whatever the floor.
+    :param floor_window: Chunks the floor is the minimum of, 150 is 3 s of 20 ms chunks.
+    """
+    # Any rate works, the gate feeds it audio as captured
+    sample_rate = None
+
+    def __init__(self, threshold_db=12.0, min_level_db=-50.0, floor_window=150) -> None:
+        self.threshold_db = threshold_db
+        self.min_level_db = min_level_db
+        self.floor_window = floor_window
+        self.reset()
+
+    def reset(self):
+        # (chunk index, level) with increasing levels, the front is the minimum of the window
+        self.minima = deque()
+        self.chunks = 0
+        self.floor_db = None
+
+    def __call__(self, samples: np.ndarray) -> float:
+        """
+        :param samples: Mono float32 samples in [-1, 1].
+        :returns: 1.0 for speech, 0.0 otherwise.
+        """
+        if len(samples) == 0:
+            return 0.0
+        level_db = 10.0 * np.log10(float(np.dot(samples, samples)) / len(samples) + 1e-10)
+        while len(self.minima) > 0 and self.minima[-1][1] >= level_db:
+            self.minima.pop()
+        self.minima.append((self.chunks, level_db))
+        if self.minima[0][0] <= self.chunks - self.floor_window:
+            self.minima.popleft()
+        self.chunks += 1
+        self.floor_db = self.minima[0][1]
+        if level_db > self.floor_db + self.threshold_db and level_db > self.min_level_db:
+            return 1.0
+        return 0.0
+
+
+class OnnxVAD:
+    """
+    Voice activity detector running a small ONNX model on CPU, e.g. Silero VAD v5
+    (inputs `input` [1, window], `state` [2, 1, 128], `sr`; outputs probability and state).
+    Needs onnxruntime, which is only imported here.
+
+    :param model_path: Path of the .onnx file.
+    :param sample_rate: Rate the model expects, the gate resamples to it.
+    :param window: Samples per model call (512 at 16 kHz for Silero).
+    """
+    def __init__(self, model_path: str, sample_rate=16000, window=512) -> None:
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise ImportError("OnnxVAD needs onnxruntime, install it or use EnergyVAD") from e
+        options = onnxruntime.SessionOptions()
+        # Tiny model, more threads only add wake-up latency
+        options.intra_op_num_threads = 1
+        options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.sample_rate = sample_rate
+        self.window = window
+        self.sr = np.array(sample_rate, dtype=np.int64)
+        self.pending = np.zeros(0, dtype=np.float32)
+        self.reset()
+
+    def reset(self):
+        self.state = np.zeros((2, 1, 128), dtype=np.float32)
+        self.pending = self.pending[:0]
+        self.last_probability = 0.0
+
+    def __call__(self, samples: np.ndarray) -> float:
+        """
+        :param samples: Mono float32 samples at `sample_rate`.
+        :returns: The highest speech probability of the windows completed by this chunk.
+        """
+        self.pending = np.concatenate([self.pending, samples])
+        complete = len(self.pending) - len(self.pending) % self.window
+        if complete == 0:
+            # Not a full window yet, keep the previous verdict
+            return self.last_probability
+        probability = 0.0
+        for start in range(0, complete, self.window):
+            chunk = self.pending[start:start + self.window].reshape(1, -1)
+            output, self.state = self.session.run(None, {"input": chunk, "state": self.state, "sr": self.sr})
+            probability = max(probability, float(output.reshape(-1)[0]))
+        self.pending = self.pending[complete:].copy()
+        self.last_probability = probability
+        return probability
@@ -14,30 +14,46 @@ from .ai_transcript import AITranscriptIterator
 
 class Stream2Sentence(InterruptCascadeStreamer):
     """
-    Processes incoming text chunks and generates sentences.
+    Processes incoming text chunks and generates sentences. The end of a reply
+    (AI_SPEECH_END_TOKEN) is passed on after its last sentence.
+    :param tokenizer: Sentence tokenizer backend of generate_sentences: "nltk" (default), "stanza"
+                      or "incremental" (no re-tokenization of the whole buffer per character).
     """
-    def __init__(self) -> None:
+    def __init__(self, tokenizer="nltk") -> None:
         super(Stream2Sentence, self).__init__()
         self.text_queue = Queue()
-        s2s.initialize_nltk()
+        # Epoch of the text currently being segmented, sentences are committed with it
+        self.text_epoch = 0
+        # Epoch of the reply whose end token ended the current run
+        self.reply_end_epoch = None
+        self.tokenizer = tokenizer
+        # Loaded once per process and shared, generate_sentences waits for it on the first turn
+        s2s.preload_tokenizer(tokenizer)
         logger.info("Stream2Sentence initialized")
-        def char_iterator():
+        def chunk_iterator():
             try:
                 while True:
-                    char = self.text_queue.get()
-                    if char is None or self.interrupted or self.is_closed:
-                        self.text_queue.task_done()
-                        break
-                    yield char
+                    chunk, epoch = self.text_queue.get()
                     self.text_queue.task_done()
+                    # None ends the current run whatever its epoch
+                    if chunk is None or self.is_closed:
+                        break
+                    if chunk == AI_SPEECH_END_TOKEN:
+                        if not self.epoch_clock.is_stale(epoch):
+                            self.reply_end_epoch = epoch
+                        break
+                    if self.epoch_clock.is_stale(epoch):
+                        continue
+                    self.text_epoch = epoch
+                    yield chunk
             except Exception as e:
-                logger.error(f"Error in char_iterator: {e}")
+                logger.error(f"Error in chunk_iterator: {e}")
                 traceback.print_exc()
 
         def sentence_generator():
             try:
-                while True:
-                    for sentence in s2s.generate_sentences(char_iterator(), log_characters=False):
+                while not self.is_closed:
+                    for sentence in s2s.generate_sentences(chunk_iterator(), tokenizer=self.tokenizer, log_characters=False):
                         print(colored(f"((Sentence: {sentence}))", "light_cyan"), end="")
                         if sentence is None:
                             continue
@@ -45,8 +61,12 @@ class Stream2Sentence(InterruptCascadeStreamer):
                         if self.is_closed:
                             return
                         
-                        if not self.interrupted:
-                            self.commit(sentence)
+                        # Stale sentences are dropped when dequeued
+                        self.commit(sentence, epoch=self.text_epoch)
+                    # The reply's last sentence is out, the TTS knows when it has been heard
+                    epoch, self.reply_end_epoch = self.reply_end_epoch, None
+                    if epoch is not None and not self.is_closed:
+                        self.commit(AI_SPEECH_END_TOKEN, epoch=epoch)
             except Exception as e:
                 logger.error(f"Error in sentence_generator: {e}")
                 traceback.print_exc()
@@ -55,32 +75,27 @@ class Stream2Sentence(InterruptCascadeStreamer):
 
     def __call__(self, data):
         print(colored(f"((Stream2Sentence: {data}))", "light_cyan"), end="")
+        epoch = self.current_epoch()
         if data == AI_SPEECH_END_TOKEN:
-            self.text_queue.put(None)
-        else:
-            for char in data:
-                self.text_queue.put(char)
+            self.text_queue.put((data, epoch))
+        elif len(data) > 0:
+            # One queue hop per LLM delta, generate_sentences walks the characters itself
+            self.text_queue.put((data, epoch))
     
-    def handle_interrupt(self):
+    def handle_interrupt(self, epoch_clock=None):
         print(colored("((Stream2Sentence: Interrupt))", "light_red"), end="")
-        self.text_queue.put(None)
-        return super().handle_interrupt()
+        result = super().handle_interrupt(epoch_clock)
+        # End the current segmentation run, whatever it still buffers is from the old epoch
+        self.text_queue.put((None, self.epoch_clock.value))
+        return result
     
     def handle_end(self):
         print(colored("((Stream2Sentence: End))", "light_red"), end="")
         # self.text_queue.put(None)
         return super().handle_end()
         
-    def clear(self):
-        print(colored("((Clearing TTS))", "light_red"), end="")
-        with self.text_queue.mutex:
-            self.text_queue.queue.clear()
-            # Reset the unfinished tasks count to zero so that join() doesn’t block forever
-            self.text_queue.unfinished_tasks = 0
-            self.text_queue.all_tasks_done.notify_all()
-        print(colored("((TTS cleared))", "light_red"), end="")
-        return super().clear()
-    
     def close(self):
-        self.text_queue.put(None)
-        return super().close()
\ No newline at end of file
+        # Closed first, so the sentence thread stops once the segmentation run ends
+        result = super().close()
+        self.text_queue.put((None, self.epoch_clock.value))
+        return result
\ No newline at end of file
@@ -0,0 +1,197 @@
+from typing import Any, List, NamedTuple
+from abc import ABC, abstractmethod
+from operator import attrgetter
+import threading
+from termcolor import colored
+
+from synapse.pipeline.streamers.common import SpeechToTextStreamer
+
+class TranscriptWord(NamedTuple):
+    """
+    Word of a recognizer hypothesis, for engines that don't have a word type of their own.
+    """
+    word: str
+    punctuated_word: str
+    start: float = 0.0
+    end: float = 0.0
+
+_word_text = attrgetter("word")
+_word_punctuated = attrgetter("punctuated_word")
+
+class TranscriptManager(ABC):
+    """
+    Turns the stream of hypotheses of a streaming recognizer into committed words.
+    Every hypothesis is the recognizer's current guess of the segment being spoken; words
+    past the part it shares with the previous guess are committed as new, and guessed
+    words that got revised are committed as a `<!words, iter=n>` marker.
+    Words only need `word` and `punctuated_word` attributes.
+    """
+    def __init__(self):
+        super(TranscriptManager, self).__init__()
+        # Current hypothesis of the segment being spoken, as plain word strings
+        self.uncommitted_words: List[str] = []
+        self.uncommitted_punctuated: List[str] = []
+        # Length of the prefix the last two hypotheses agreed on
+        self.stable_length = 0
+        self.words_since_last_speech = []
+        self._on_new_words_cb = lambda *x: print(colored(x, "yellow"), end='')
+        self._on_sentence_end_cb = lambda: print(colored("<$S_END>", "yellow"), end='')
+        self._on_speech_final_cb = lambda x: print(colored("<$S_FINAL{x}>", "red"), end='')
+        self.transcript_response_lock = threading.Lock()
+        # Local speech end seen, speech ends with the next finalized result rather than at speech_final
+        self.speech_end_pending = False
+        # Speech already ended locally, the recognizer's own speech_final for it is redundant
+        self.speech_ended_early = False
+
+    @abstractmethod
+    def commit_text(self, text: str, speaker="Ashish", arrived_time: float=None):
+        pass
+
+    def finalize_sentence(self):
+        if len(self.uncommitted_words) == 0:
+            return
+        self.uncommitted_words = []
+        self.uncommitted_punctuated = []
+        self.stable_length = 0
+        if self._on_sentence_end_cb is not None:
+            self._on_sentence_end_cb()
+            # self.thread_pool.submit(self.on_sentence_end)
+
+    def expect_speech_end(self):
+        self.speech_end_pending = True
+
+    def finalize_speech(self):
+        words = self.words_since_last_speech
+        self.words_since_last_speech = []
+        self._on_speech_final_cb(words)
+
+    def handle_new_words(self, words: list[str], speaker="Ashish", arrived_time: float=None):
+        self.speech_ended_early = False
+        self.words_since_last_speech += words
+        self.commit_text(words, speaker, arrived_time)
+        if self._on_new_words_cb is not None:
+            self._on_new_words_cb(words, speaker, arrived_time)
+
+    def handle_hypothesis(self, words: List[Any], arrived_time: float, is_final=False, speech_final=False, from_finalize=None):
+        """
+        :param is_final: The recognizer won't revise this segment anymore.
+        :param speech_final: The recognizer detected the end of the utterance.
+        :param from_finalize: Whether the segment was flushed on request, None if unknown.
+        """
+        # Plain strings, extracted at C speed and outside the lock
+        texts = list(map(_word_text, words))
+        with self.transcript_response_lock:
+            if speech_final:
+                print(colored("<$$final$$>", "red"), end='')
+            if len(texts) == 0:
+                self.finalize_sentence()
+                self.__finalize_pending_speech(is_final, from_finalize)
+                return
+
+            identity_length = self.__common_prefix_length(texts)
+            # Punctuation is only needed for the words that changed
+            new_punctuated = list(map(_word_punctuated, words[identity_length:]))
+            if len(new_punctuated) > 0:
+                self.handle_new_words(new_punctuated, arrived_time=arrived_time)
+            mispredicted_words = self.uncommitted_punctuated[identity_length:]
+            if len(mispredicted_words) > 0:
+                self.handle_new_words([f"<!{' '.join(mispredicted_words)}, iter={identity_length}>"])
+            self.uncommitted_words = texts
+            del self.uncommitted_punctuated[identity_length:]
+            self.uncommitted_punctuated += new_punctuated
+            self.stable_length = identity_length
+
+            if is_final:
+                self.finalize_sentence()
+            if speech_final:
+                print(colored("<$$speech-final$$>", "red"), end='')
+                if self.speech_ended_early:
+                    self.speech_ended_early = False
+                else:
+                    self.speech_end_pending = False
+                    self.finalize_speech()
+            else:
+                self.__finalize_pending_speech(is_final, from_finalize)
+
+    def __common_prefix_length(self, texts: List[str]) -> int:
+        """
+        Length of the prefix `texts` shares with the previous hypothesis. Interim results
+        mostly extend the previous one or revise its last few words, so the part up to where
+        the previous two hypotheses agreed is compared in one slice comparison, and only the
+        words after it are walked. A revision further back falls back to a binary search.
+        """
+        previous = self.uncommitted_words
+        limit = min(len(texts), len(previous))
+        cursor = min(self.stable_length, limit)
+        if texts[:cursor] != (previous if cursor == len(previous) else previous[:cursor]):
+            low, high = 0, cursor - 1
+            # texts[:low] matches, texts[:high + 1] doesn't
+            while low < high:
+                middle = (low + high + 1) // 2
+                if texts[low:middle] == previous[low:middle]:
+                    low = middle
+                else:
+                    high = middle - 1
+            return low
+        while cursor < limit and texts[cursor] == previous[cursor]:
+            cursor += 1
+        return cursor
+
+    def __finalize_pending_speech(self, is_final: bool, from_finalize):
+        if not self.speech_end_pending or not is_final or from_finalize is False:
+            return
+        self.speech_end_pending = False
+        if len(self.words_since_last_speech) > 0:
+            print(colored("<$$local-speech-final$$>", "red"), end='')
+            self.speech_ended_early = True
+            self.finalize_speech()
+
+    def on_new_words(self, callback):
+        self._on_new_words_cb = callback
+
+    def on_sentence_end(self, callback):
+        self._on_sentence_end_cb = callback
+
+    def on_speech_final(self, callback):
+        self._on_speech_final_cb = callback
+
+class TranscriptSTTStreamer(SpeechToTextStreamer, TranscriptManager):
+    """
+    SpeechToTextStreamer on top of a TranscriptManager: commits (words, speaker, arrived_time)
+    frames, raises new_words/sentence_end/speech_end and sends speech end downstream.
+    Subclasses feed audio to their recognizer in __call__ and its results to handle_hypothesis.
+    """
+    def __init__(self, channels, sample_rate):
+        super(TranscriptSTTStreamer, self).__init__()
+        self.channels = channels
+        self.sample_rate = sample_rate
+        self.on_sentence_end(lambda: self.trigger("sentence_end"))
+        def on_speech_final(*x):
+            self.trigger("speech_end", *x)
+            self.speech_end()
+        self.on_speech_final(on_speech_final)
+        def on_new_words(*x):
+            self.trigger("new_words", *x)
+        self.on_new_words(on_new_words)
+
+    def control_handlers(self):
+        # Sent by a VADGate upstream, if any
+        handlers = super(TranscriptSTTStreamer, self).control_handlers()
+        handlers["keepalive"] = self.keep_alive
+        handlers["speech_start"] = self.handle_local_speech_start
+        handlers["speech_end"] = self.handle_local_speech_end
+        return handlers
+
+    def keep_alive(self):
+        pass
+
+    def handle_local_speech_start(self):
+        self.trigger("local_speech_start")
+
+    def handle_local_speech_end(self):
+        self.trigger("local_speech_end")
+        self.expect_speech_end()
+
+    def commit_text(self, text: str, speaker="Ashish", arrived_time: float = None):
+        # print(colored(f"<{speaker}: {text}>", "light_blue"), end='')
+        self.commit((text, speaker, arrived_time))
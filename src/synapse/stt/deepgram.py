@@ -1,10 +1,13 @@
 from typing import Any, Callable, Dict, Iterator, AsyncGenerator
-from elevenlabs import stream as elevenlabs_stream
+from collections import deque
+import itertools
+import json
 import threading
 import time
 from termcolor import colored
 from deepgram import (
     DeepgramClient,
+    DeepgramClientOptions,
     LiveTranscriptionEvents,
     LiveOptions,
 )
@@ -14,12 +17,34 @@ from typing import Any, Callable, Iterator, AsyncGenerator, Dict, List
 from abc import ABC, abstractmethod
 
 from synapse.config import config
+from synapse.utils import logger, GLOBAL_THREAD_POOL
 from synapse.pipeline.streamers.common import SpeechToTextStreamer
+from .common import TranscriptManager, TranscriptSTTStreamer
 
-deepgram_client = DeepgramClient(config.DEEPGRAM_API_KEY)
+_deepgram_client = None
+_deepgram_client_lock = threading.Lock()
 
-def createDeepgramSocket(on_message_callback, channels, sample_rate):
-    dg_connection : LiveClient = deepgram_client.listen.live.v("1")
+def get_deepgram_client() -> DeepgramClient:
+    """
+    Created on first use rather than at import, so the module loads without an API key
+    (e.g. when a local STT engine is used instead).
+    """
+    global _deepgram_client
+    with _deepgram_client_lock:
+        if _deepgram_client is None:
+            _deepgram_client = make_deepgram_client(config.DEEPGRAM_URL)
+        return _deepgram_client
+
+def make_deepgram_client(url: str = None) -> DeepgramClient:
+    if url is None:
+        return DeepgramClient(config.DEEPGRAM_API_KEY)
+    return DeepgramClient(config.DEEPGRAM_API_KEY, DeepgramClientOptions(url=url))
+
+# Server side silence before speech_final, a local VAD can end speech earlier (see VADGate)
+ENDPOINTING_MS = 600
+
+def createDeepgramSocket(on_message_callback, channels, sample_rate, on_error_callback=None, client: DeepgramClient = None):
+    dg_connection : LiveClient = (client or get_deepgram_client()).listen.live.v("1")
     # Define event handlers
     def on_message(self, result:LiveResultResponse, **kwargs):
         arrived_time = time.time()
@@ -29,6 +54,8 @@ def createDeepgramSocket(on_message_callback, channels, sample_rate):
         print(f"Metadata: {metadata}")
     def on_error(self, error, **kwargs):
         print(f"Errors: {error}")
+        if on_error_callback is not None:
+            on_error_callback(error)
     def on_warning(self, warning, **kwargs):
         print(f"Warnings: {warning}")
 
@@ -48,13 +75,338 @@ def createDeepgramSocket(on_message_callback, channels, sample_rate):
         sample_rate=sample_rate,
         encoding="linear16",
         utterance_end_ms="1000",
-        endpointing=600,
+        endpointing=ENDPOINTING_MS,
         # vad_events=True,
     )
-    # Start the connection
-    dg_connection.start(options)
+    # Start the connection, recent SDKs report a failure instead of raising
+    if dg_connection.start(options) is False:
+        raise ConnectionError("Failed to open the Deepgram live connection")
     return dg_connection
 
+def stopDeepgramSocket(dg_connection: LiveClient):
+    """
+    Tears a socket down without the SDK's finish(), which deadlocks on a broken socket: a
+    failed ping leaves its send lock held, and finish() sends CloseStream under that lock.
+    Signals the SDK threads to exit and closes the websocket under them. deepgram-sdk 3.x
+    has no public call for it, this is the one place that relies on its internals.
+    """
+    lock_exit = getattr(dg_connection, "lock_exit", None)
+    if lock_exit is not None:
+        with lock_exit:
+            dg_connection.exit = True
+    websocket = getattr(dg_connection, "_socket", None)
+    try:
+        if websocket is not None:
+            websocket.close()
+    except Exception:
+        pass
+
+class _LiveConnection:
+    def __init__(self, generation: int, socket: LiveClient) -> None:
+        self.generation = generation
+        self.socket = socket
+        self.opened_at = time.time()
+        self.last_message_time = self.opened_at
+        self.last_send_time = self.opened_at
+        self.last_audio_time = 0.0
+        # Audio bytes sent on this socket, and how far its results have transcribed
+        self.sent_bytes = 0
+        self.acked_bytes = 0
+        # The replay this socket started with was transcribed up to here by the lost socket
+        self.skip_seconds = 0.0
+        self.is_retired = False
+
+class DeepgramConnectionManager:
+    """
+    Deepgram live connection that survives errors, server side timeouts and stalls.
+
+    A warm standby socket is kept open next to the active one (idle sockets get KeepAlives),
+    so a failover is a swap instead of a TLS + websocket handshake. Audio is kept until the
+    results cover it (their start + duration), plus `replay_ms` before that, and resent on the
+    new socket along with whatever arrived while no socket was usable, so the words at the
+    seam are transcribed. The words of the replay the lost socket had transcribed already are
+    dropped from the new socket's results. Results of retired sockets are ignored.
+
+    Exposes the LiveClient calls DeepgramSTTStreamer uses (send, keep_alive, finalize, finish).
+
+    :param on_reconnect: Called before the replay goes out on a new socket, whose results
+                         start a new stream.
+    :param response_timeout: Reconnect if audio went out but nothing came back for this long.
+    :param max_backlog_ms: Bound of the audio kept for replay, older audio is dropped.
+    """
+    def __init__(self, on_message: Callable, channels: int, sample_rate: int, client: DeepgramClient = None,
+                 on_reconnect: Callable = None, warm_standby=True, replay_ms=300, keepalive_interval=4.0,
+                 response_timeout=10.0, max_backlog_ms=10000) -> None:
+        self.on_message_callback = on_message
+        self.on_reconnect_callback = on_reconnect
+        self.channels = channels
+        self.sample_rate = sample_rate
+        self.client = client
+        self.warm_standby = warm_standby
+        self.keepalive_interval = keepalive_interval
+        self.response_timeout = response_timeout
+        self.bytes_per_second = 2 * channels * sample_rate
+        self.replay_bytes = int(replay_ms * self.bytes_per_second / 1000)
+        self.max_backlog_bytes = int(max_backlog_ms * self.bytes_per_second / 1000)
+        self.lock = threading.RLock()
+        self.generations = itertools.count(1)
+        # (end offset on the active socket, frame) of the audio not transcribed yet
+        self.replay = deque()
+        self.replay_size = 0
+        # Audio that arrived while reconnecting
+        self.backlog = deque()
+        self.backlog_size = 0
+        self.standby: _LiveConnection = None
+        self.standby_pending = False
+        self.is_reconnecting = False
+        self.is_closed = False
+        self.connect_latencies = []
+        self.reconnect_latencies = []
+        self.counters = {"reconnects": 0, "standby_swaps": 0, "errors": 0, "bytes_replayed": 0, "bytes_dropped": 0,
+                         "overlap_words_dropped": 0}
+        self.active = self.__connect()
+        self.__refill_standby()
+        self.monitor_thread = threading.Thread(target=self.__monitor, daemon=True)
+        self.monitor_thread.start()
+
+    def send(self, frame: bytes):
+        with self.lock:
+            if self.is_reconnecting:
+                self.__append_backlog(frame)
+                return
+            try:
+                self.__send_audio(self.active, frame)
+            except Exception as e:
+                # Resent with the rest of the backlog
+                self.__append_backlog(frame)
+                self.reconnect(f"send failed: {e}")
+
+    def keep_alive(self):
+        self.__send_control(self.active, "KeepAlive")
+
+    def finalize(self):
+        """
+        Flush the transcript of the audio sent so far (the Finalize message, any SDK version).
+        """
+        self.__send_control(self.active, "Finalize")
+
+    def reconnect(self, reason: str):
+        with self.lock:
+            if self.is_reconnecting or self.is_closed:
+                return
+            self.is_reconnecting = True
+            failed = self.active
+            failed.is_retired = True
+            self.counters["reconnects"] += 1
+        logger.warning(f"Deepgram connection {failed.generation} lost ({reason}), reconnecting")
+        GLOBAL_THREAD_POOL.submit(self.__reconnect, failed, time.time())
+
+    def stats(self) -> Dict[str, Any]:
+        def summary(samples):
+            if len(samples) == 0:
+                return {"count": 0}
+            return {"count": len(samples), "mean_ms": 1000 * sum(samples) / len(samples),
+                    "max_ms": 1000 * max(samples), "last_ms": 1000 * samples[-1]}
+        with self.lock:
+            return dict(self.counters,
+                        connect=summary(self.connect_latencies),
+                        reconnect=summary(self.reconnect_latencies),
+                        generation=self.active.generation,
+                        has_standby=self.standby is not None,
+                        is_reconnecting=self.is_reconnecting,
+                        unacknowledged_ms=1000 * self.replay_size / self.bytes_per_second)
+
+    def finish(self):
+        with self.lock:
+            self.is_closed = True
+            active, standby = self.active, self.standby
+            self.standby = None
+        if standby is not None:
+            GLOBAL_THREAD_POOL.submit(self.__retire, standby)
+        self.__retire(active)
+
+    def __connect(self) -> _LiveConnection:
+        connection = None
+        def on_message(result, arrived_time):
+            if connection is None or connection.is_retired:
+                return
+            connection.last_message_time = arrived_time
+            covered = int(((result.start or 0) + (result.duration or 0)) * self.bytes_per_second)
+            connection.acked_bytes = max(connection.acked_bytes, covered)
+            if connection is self.active and self.__skip_overlap(connection, result):
+                self.on_message_callback(result, arrived_time)
+        def on_error(error):
+            self.counters["errors"] += 1
+            if connection is None or connection.is_retired:
+                return
+            if connection is self.active:
+                self.reconnect(f"error: {error}")
+            else:
+                self.__drop_standby(connection)
+        start = time.time()
+        socket = createDeepgramSocket(on_message, self.channels, self.sample_rate, on_error, client=self.client)
+        connection = _LiveConnection(next(self.generations), socket)
+        with self.lock:
+            self.connect_latencies.append(time.time() - start)
+        return connection
+
+    def __reconnect(self, failed: _LiveConnection, started: float):
+        GLOBAL_THREAD_POOL.submit(self.__retire, failed, False)
+        with self.lock:
+            # How far into the replay the failed socket's results got, their words are committed.
+            # If it failed before getting past its own skip, the sockets before it got that far.
+            replay_start = self.replay[0][0] - len(self.replay[0][1]) if len(self.replay) > 0 else failed.sent_bytes
+            acked_bytes = max(failed.acked_bytes, int(failed.skip_seconds * self.bytes_per_second))
+            skip_seconds = max(0, acked_bytes - replay_start) / self.bytes_per_second
+        backoff = 0.05
+        while not self.is_closed:
+            with self.lock:
+                connection, self.standby = self.standby, None
+            is_swap = connection is not None
+            if connection is None:
+                try:
+                    connection = self.__connect()
+                except Exception as e:
+                    logger.error(f"Deepgram reconnect failed: {e}")
+                    time.sleep(backoff)
+                    backoff = min(2 * backoff, 2.0)
+                    continue
+            with self.lock:
+                # The seam: untranscribed audio, then what arrived meanwhile, before any new frame
+                frames = [frame for _, frame in self.replay] + list(self.backlog)
+                if self.on_reconnect_callback is not None:
+                    self.on_reconnect_callback()
+                # Results of the replay count already
+                connection.skip_seconds = skip_seconds
+                self.active = connection
+                self.replay.clear()
+                self.replay_size = 0
+                try:
+                    for frame in frames:
+                        self.__send_audio(connection, frame)
+                except Exception as e:
+                    logger.error(f"Deepgram replay failed: {e}")
+                    self.replay.clear()
+                    self.replay_size = 0
+                    self.backlog = deque(frames)
+                    self.backlog_size = sum(len(frame) for frame in frames)
+                    GLOBAL_THREAD_POOL.submit(self.__retire, connection, False)
+                    continue
+                self.backlog.clear()
+                self.backlog_size = 0
+                self.is_reconnecting = False
+                self.counters["bytes_replayed"] += sum(len(frame) for frame in frames)
+                if is_swap:
+                    self.counters["standby_swaps"] += 1
+                self.reconnect_latencies.append(time.time() - started)
+            logger.info(f"Deepgram connection {connection.generation} active ({'standby' if is_swap else 'new'} socket)")
+            self.__refill_standby()
+            return
+
+    def __skip_overlap(self, connection: _LiveConnection, result) -> bool:
+        """
+        Drops the words of `result` the lost socket transcribed already, False if nothing is left.
+        """
+        if connection.skip_seconds <= 0 or (result.start or 0) >= connection.skip_seconds:
+            return True
+        words = result.channel.alternatives[0].words
+        # A word started before the boundary was committed, even if only part of it had been heard
+        kept = [word for word in words if word.start >= connection.skip_seconds - 0.001]
+        if len(kept) == len(words):
+            return True
+        self.counters["overlap_words_dropped"] += len(words) - len(kept)
+        if len(kept) == 0 and not result.speech_final:
+            return False
+        result.channel.alternatives[0].words = kept
+        return True
+
+    def __send_audio(self, connection: _LiveConnection, frame: bytes):
+        connection.socket.send(frame)
+        connection.sent_bytes += len(frame)
+        connection.last_send_time = connection.last_audio_time = time.time()
+        self.replay.append((connection.sent_bytes, frame))
+        self.replay_size += len(frame)
+        # Keep what the results haven't covered yet, and replay_ms before it
+        keep_from = connection.acked_bytes - self.replay_bytes
+        while len(self.replay) > 1 and (self.replay[0][0] <= keep_from or self.replay_size > self.max_backlog_bytes):
+            self.replay_size -= len(self.replay.popleft()[1])
+
+    def __refill_standby(self):
+        with self.lock:
+            if not self.warm_standby or self.is_closed or self.standby is not None or self.standby_pending:
+                return
+            self.standby_pending = True
+        def __open():
+            try:
+                connection = self.__connect()
+            except Exception as e:
+                logger.error(f"Deepgram standby connection failed: {e}")
+                connection = None
+            with self.lock:
+                self.standby_pending = False
+                if connection is not None and not self.is_closed:
+                    self.standby = connection
+                    return
+            if connection is not None:
+                self.__retire(connection)
+        GLOBAL_THREAD_POOL.submit(__open)
+
+    def __drop_standby(self, connection: _LiveConnection):
+        with self.lock:
+            if self.standby is not connection:
+                return
+            self.standby = None
+            connection.is_retired = True
+        GLOBAL_THREAD_POOL.submit(self.__retire, connection, False)
+        self.__refill_standby()
+
+    def __append_backlog(self, frame: bytes):
+        self.backlog.append(frame)
+        self.backlog_size += len(frame)
+        while self.backlog_size > self.max_backlog_bytes and len(self.backlog) > 1:
+            dropped = self.backlog.popleft()
+            self.backlog_size -= len(dropped)
+            self.counters["bytes_dropped"] += len(dropped)
+
+    def __send_control(self, connection: _LiveConnection, message_type: str) -> bool:
+        try:
+            connection.socket.send(json.dumps({"type": message_type}))
+            connection.last_send_time = time.time()
+            return True
+        except Exception as e:
+            if connection is self.active:
+                self.reconnect(f"{message_type} failed: {e}")
+            else:
+                self.__drop_standby(connection)
+            return False
+
+    def __retire(self, connection: _LiveConnection, graceful=True):
+        connection.is_retired = True
+        if not graceful:
+            stopDeepgramSocket(connection.socket)
+            return
+        try:
+            connection.socket.finish()
+        except Exception as e:
+            # Raised before it stopped the SDK threads, which would keep running
+            logger.warning(f"Deepgram connection {connection.generation} did not close cleanly: {e}")
+            stopDeepgramSocket(connection.socket)
+
+    def __monitor(self):
+        while not self.is_closed:
+            time.sleep(0.5)
+            now = time.time()
+            with self.lock:
+                active = None if self.is_reconnecting else self.active
+                standby = self.standby
+            for connection in (active, standby):
+                if connection is not None and now - connection.last_send_time >= self.keepalive_interval:
+                    self.__send_control(connection, "KeepAlive")
+            # Audio went out, nothing came back
+            if active is not None and active.last_audio_time > active.last_message_time \
+                and now - active.last_message_time > self.response_timeout:
+                self.reconnect(f"no response for {now - active.last_message_time:.1f}s")
+
 def measure_overlap(referenceWord: Word, targetWord: Word):
     reference_start = referenceWord.start
     reference_end = referenceWord.end
@@ -63,111 +415,92 @@ def measure_overlap(referenceWord: Word, targetWord: Word):
     overlap = max(0, min(reference_end, target_end) - max(reference_start, target_start))
     return overlap / (target_end - target_start)
 
-class DeepgramTranscriptManager(ABC):
+class DeepgramTranscriptManager(TranscriptManager):
     def __init__(self):
         super(DeepgramTranscriptManager, self).__init__()
-        self.uncommitted_words = []
-        self.words_since_last_speech = []
-        self._on_new_words_cb = lambda *x: print(colored(x, "yellow"), end='')
-        self._on_sentence_end_cb = lambda: print(colored("<$S_END>", "yellow"), end='')
-        self._on_speech_final_cb = lambda x: print(colored("<$S_FINAL{x}>", "red"), end='')
-        self.transcript_response_lock = threading.Lock()
-        
-    @abstractmethod
-    def commit_text(self, text: str, speaker="Ashish", arrived_time: float=None):
-        pass
-        
-    def finalize_sentence(self):
-        if len(self.uncommitted_words) == 0:
-            return
-        self.uncommitted_words = []
-        if self._on_sentence_end_cb is not None:
-            self._on_sentence_end_cb()
-            # self.thread_pool.submit(self.on_sentence_end)
-            
-    def finalize_speech(self):
-        words = self.words_since_last_speech
-        self.words_since_last_speech = []
-        self._on_speech_final_cb(words)
-    
-    def handle_new_words(self, words: list[str], speaker="Ashish", arrived_time: float=None):
-        self.words_since_last_speech += words
-        self.commit_text(words, speaker, arrived_time)
-        if self._on_new_words_cb is not None:
-            self._on_new_words_cb(words, speaker, arrived_time)
         
     def handle_transcript_response(self, result: LiveResultResponse, arrived_time: float):
-        with self.transcript_response_lock:
-            try:
-                if result.speech_final:
-                    print(colored("<$$final$$>", "red"), end='')
-                words = result.channel.alternatives[0].words
-                if len(words) == 0:
-                    self.finalize_sentence()
-                    return
-                
-                identity_length = 0
-                for i in range(min(len(words), len(self.uncommitted_words))):
-                    if words[i].word == self.uncommitted_words[i].word:
-                        identity_length += 1
-                    else:
-                        break
-                    # TODO: Handle past mispredictions and corrections using some events, identified using overlap
-                    
-                new_words = words[identity_length:]
-                # print(f"<identiy_length: {identity_length}, new_words: {new_words}, uncommitted_words: {self.uncommitted_words}>")
-                if len(new_words) > 0:
-                    self.handle_new_words([i.punctuated_word for i in new_words], arrived_time=arrived_time)
-                mispredicted_words = self.uncommitted_words[identity_length:]
-                if len(mispredicted_words) > 0:
-                    # print(f"<!MISTAKE{' '.join([i.punctuated_word for i in mispredicted_words])}>", end='')
-                    self.handle_new_words([f"<!{' '.join([i.punctuated_word for i in mispredicted_words])}, iter={identity_length}>"])
-                self.uncommitted_words = words
-                
-                if result.is_final:
-                    self.finalize_sentence()
-                if result.speech_final:
-                    print(colored("<$$speech-final$$>", "red"), end='')
-                    self.finalize_speech()
-            except Exception as e:
-                print(colored(f"<!ERROR {e}, {result}>", "red"))
-        
-    def on_new_words(self, callback):
-        self._on_new_words_cb = callback
-        
-    def on_sentence_end(self, callback):
-        self._on_sentence_end_cb = callback
-        
-    def on_speech_final(self, callback):
-        self._on_speech_final_cb = callback
+        try:
+            self.handle_hypothesis(result.channel.alternatives[0].words, arrived_time,
+                                   is_final=result.is_final, speech_final=result.speech_final,
+                                   # Results flushed by a Finalize request are flagged on recent SDKs
+                                   from_finalize=getattr(result, "from_finalize", None))
+        except Exception as e:
+            print(colored(f"<!ERROR {e}, {result}>", "red"))
 
-class DeepgramSTTStreamer(SpeechToTextStreamer, DeepgramTranscriptManager):
-    def __init__(self, channels, sample_rate):
-        super(DeepgramSTTStreamer, self).__init__()
-        self.channels = channels
-        self.sample_rate = sample_rate
+class DeepgramSTTStreamer(TranscriptSTTStreamer, DeepgramTranscriptManager):
+    """
+    :param record_path: If set, every transcript result is appended there as a JSON line,
+                        to be replayed offline (see benchmarks/transcript_diff.py).
+    :param connection_options: Passed to DeepgramConnectionManager (client, warm_standby, replay_ms, ...).
+    """
+    def __init__(self, channels, sample_rate, record_path=None, **connection_options):
+        super(DeepgramSTTStreamer, self).__init__(channels, sample_rate)
+        self.record_file = open(record_path, "a", encoding="utf-8") if record_path is not None else None
+        # Uplink accounting, see get_bandwidth_stats
+        self.bytes_sent = 0
+        self.frames_sent = 0
+        self.first_frame_time = None
         def on_message(result, arrived_time):
+            if self.record_file is not None:
+                line = json.dumps(result.to_dict()) + "\n"
+                # Results of the standby and replacement sockets arrive on their own threads
+                with self.transcript_response_lock:
+                    if self.record_file is not None:
+                        self.record_file.write(line)
+                        self.record_file.flush()
             self.handle_transcript_response(result, arrived_time)
-        self.dg_connection = createDeepgramSocket(on_message, channels, sample_rate)
-        self.on_sentence_end(lambda: self.trigger("sentence_end"))
-        def on_speech_final(*x):
-            self.trigger("speech_end", *x)
-            self.speech_end()
-        self.on_speech_final(on_speech_final)
-        def on_new_words(*x):
-            self.trigger("new_words", *x)
-        self.on_new_words(on_new_words)
+        # Reconnects on its own, the new socket starts a new segment
+        self.dg_connection = DeepgramConnectionManager(on_message, channels, sample_rate,
+                                                       on_reconnect=self.handle_reconnect, **connection_options)
+        
+    def handle_reconnect(self):
+        with self.transcript_response_lock:
+            self.finalize_sentence()
+        
+    def keep_alive(self):
+        self.dg_connection.keep_alive()
         
-    def commit_text(self, text: str, speaker="Ashish", arrived_time: float = None):
-        # print(colored(f"<{speaker}: {text}>", "light_blue"), end='')
-        self.commit((text, speaker, arrived_time))
+    def handle_local_speech_end(self):
+        """
+        The trailing audio has been sent: ask Deepgram to flush its transcript now, speech
+        ends with the flushed result instead of after ENDPOINTING_MS of streamed silence.
+        """
+        super(DeepgramSTTStreamer, self).handle_local_speech_end()
+        self.dg_connection.finalize()
         
     def __call__(self, frame: bytes):
+        if self.first_frame_time is None:
+            self.first_frame_time = time.time()
+        self.bytes_sent += len(frame)
+        self.frames_sent += 1
         self.dg_connection.send(frame)
         
+    def get_bandwidth_stats(self):
+        """
+        Audio uplink to Deepgram: bytes sent and the bitrate they amount to (linear16).
+        """
+        audio_seconds = self.bytes_sent / (2 * self.channels * self.sample_rate)
+        elapsed = time.time() - self.first_frame_time if self.first_frame_time is not None else 0.0
+        return {
+            "channels": self.channels,
+            "sample_rate": self.sample_rate,
+            "frames_sent": self.frames_sent,
+            "bytes_sent": self.bytes_sent,
+            "audio_seconds": audio_seconds,
+            "kbps": 8 * self.bytes_sent / 1000 / elapsed if elapsed > 0 else 0.0,
+        }
+        
+    def get_connection_stats(self):
+        return self.dg_connection.stats()
+        
     def close(self):
         super(DeepgramSTTStreamer, self).close()
         self.dg_connection.finish()
+        with self.transcript_response_lock:
+            record_file, self.record_file = self.record_file, None
+        if record_file is not None:
+            record_file.close()
 
     def __enter__(self):
         return self
@@ -0,0 +1,84 @@
+from typing import Dict
+import json
+import threading
+import time
+
+from synapse.utils import logger
+from synapse.pipeline.audio import PCMConverter
+from .common import TranscriptSTTStreamer, TranscriptWord
+
+_models: Dict[tuple, object] = {}
+_models_lock = threading.Lock()
+
+def get_vosk_model(model_path: str = None, lang: str = "en-us"):
+    """
+    Vosk models take seconds to load and are read only, every streamer of a process shares one.
+    :param model_path: Directory of an unpacked model, or None to let Vosk fetch the small model of `lang`.
+    """
+    from vosk import Model, SetLogLevel
+    key = (model_path, lang)
+    with _models_lock:
+        model = _models.get(key)
+        if model is None:
+            SetLogLevel(-1)
+            start = time.time()
+            model = _models[key] = Model(model_path=model_path) if model_path is not None else Model(lang=lang)
+            logger.info(f"Vosk model {model_path or lang} loaded in {time.time() - start:.2f}s")
+        return model
+
+class VoskSTTStreamer(TranscriptSTTStreamer):
+    """
+    Speech to text on a local Vosk (Kaldi) recognizer, a drop-in for DeepgramSTTStreamer
+    without the network round trip or an API key. Audio is recognized on the thread that
+    delivers it; partial results are the hypotheses, and the recognizer's endpointing (or
+    a VADGate's speech end) closes the utterance.
+
+    :param model_path: Directory of an unpacked Vosk model, see get_vosk_model.
+    :param speaker: Speaker name committed with the words.
+    """
+    def __init__(self, channels, sample_rate, model_path=None, lang="en-us", speaker="Ashish"):
+        super(VoskSTTStreamer, self).__init__(channels, sample_rate)
+        from vosk import KaldiRecognizer
+        self.speaker = speaker
+        self.recognizer = KaldiRecognizer(get_vosk_model(model_path, lang), sample_rate)
+        # Kaldi takes mono int16
+        self.downmix = PCMConverter(sample_rate, channels, out_channels=1) if channels != 1 else None
+        self.recognize_time = 0.0
+        self.audio_seconds = 0.0
+        self.last_partial = None
+
+    def __call__(self, frame: bytes):
+        start = time.perf_counter()
+        if self.downmix is not None:
+            frame = self.downmix.convert(frame)
+        self.audio_seconds += len(frame) / (2 * self.sample_rate)
+        if self.recognizer.AcceptWaveform(bytes(frame)):
+            self.__handle_final(self.recognizer.Result())
+        else:
+            partial = json.loads(self.recognizer.PartialResult()).get("partial", "")
+            # Partials repeat between words, only changes are hypotheses
+            if partial != self.last_partial:
+                self.last_partial = partial
+                self.handle_hypothesis(self.__words(partial), time.time())
+        self.recognize_time += time.perf_counter() - start
+
+    def handle_local_speech_end(self):
+        # The trailing audio went through already, close the utterance now
+        super(VoskSTTStreamer, self).handle_local_speech_end()
+        self.__handle_final(self.recognizer.FinalResult())
+
+    def __handle_final(self, result: str):
+        self.last_partial = None
+        text = json.loads(result).get("text", "")
+        self.handle_hypothesis(self.__words(text), time.time(), is_final=True, speech_final=True)
+
+    def __words(self, text: str):
+        return [TranscriptWord(word, word) for word in text.split()]
+
+    def get_recognition_stats(self):
+        return {
+            "audio_seconds": self.audio_seconds,
+            "recognize_seconds": self.recognize_time,
+            # Below 1 keeps up with real time
+            "real_time_factor": self.recognize_time / self.audio_seconds if self.audio_seconds else 0.0,
+        }
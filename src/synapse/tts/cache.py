@@ -0,0 +1,172 @@
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional
+import hashlib
+import os
+import threading
+import unicodedata
+
+import numpy as np
+
+from synapse.utils import logger, GLOBAL_THREAD_POOL
+
+
+class SynthesisCache:
+    """
+    Cache of synthesized PCM16 audio keyed by (normalized text, voice, speed, sample rate),
+    so that repeated phrases (greetings, acknowledgements, error messages) skip synthesis.
+
+    The memory tier is an LRU bounded by `max_bytes`. The optional disk tier keeps one raw
+    PCM file per entry under `disk_dir`, bounded by `max_disk_bytes` and read back through
+    a memory map. Memory entries are written through to disk in the background, and disk
+    hits are promoted back to memory.
+
+    :param max_bytes: Byte budget of the memory tier.
+    :param max_entry_bytes: Larger syntheses are not cached (defaults to max_bytes / 8),
+                            so one long answer can't evict every short phrase.
+    :param disk_dir: Directory of the on-disk tier, None to keep the cache in memory only.
+    :param max_disk_bytes: Byte budget of the disk tier.
+    :param disk_chunk_bytes: Size of the chunks streamed from a disk hit.
+    """
+    def __init__(self, max_bytes=32 * 1024 * 1024, max_entry_bytes=None, disk_dir=None,
+                 max_disk_bytes=512 * 1024 * 1024, disk_chunk_bytes=9600) -> None:
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes or max_bytes // 8
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.disk_chunk_bytes = disk_chunk_bytes
+        self.lock = threading.Lock()
+        self.memory: OrderedDict[str, List[bytes]] = OrderedDict()
+        self.memory_bytes = 0
+        self.disk: OrderedDict[str, int] = OrderedDict()
+        self.disk_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        if self.disk_dir is not None:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self.__load_disk_index()
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(unicodedata.normalize("NFKC", text).split())
+
+    @staticmethod
+    def key(text: str, voice_id: str, speed: float, sample_rate: int) -> str:
+        raw = "\x1f".join([SynthesisCache.normalize(text), str(voice_id), f"{float(speed):.3f}", str(sample_rate)])
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Iterator[bytes]]:
+        """
+        Returns the cached PCM chunks of a synthesis, or None on a miss.
+        """
+        with self.lock:
+            chunks = self.memory.get(key)
+            if chunks is not None:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                self.bytes_saved += sum(len(chunk) for chunk in chunks)
+                return iter(chunks)
+            size = self.disk.get(key)
+            if size is None:
+                self.misses += 1
+                return None
+            self.disk.move_to_end(key)
+        try:
+            pcm = np.memmap(self.__path(key), dtype=np.int16, mode="r")
+        except (OSError, ValueError) as e:
+            logger.error(f"Error reading synthesis cache entry: {e}")
+            with self.lock:
+                if self.disk.pop(key, None) is not None:
+                    self.disk_bytes -= size
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+            self.disk_hits += 1
+            self.bytes_saved += size
+        return self.__stream_disk(key, pcm)
+
+    def put(self, key: str, chunks: List[bytes]):
+        size = sum(len(chunk) for chunk in chunks)
+        if size == 0 or size > self.max_entry_bytes:
+            return
+        with self.lock:
+            if key in self.memory:
+                return
+            self.memory[key] = list(chunks)
+            self.memory_bytes += size
+            while self.memory_bytes > self.max_bytes:
+                _, evicted = self.memory.popitem(last=False)
+                self.memory_bytes -= sum(len(chunk) for chunk in evicted)
+            write_to_disk = self.disk_dir is not None and key not in self.disk
+        if write_to_disk:
+            GLOBAL_THREAD_POOL.submit(self.__write_disk, key, b"".join(chunks))
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            self.memory_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "bytes_saved": self.bytes_saved,
+                "memory_entries": len(self.memory),
+                "memory_bytes": self.memory_bytes,
+                "disk_entries": len(self.disk),
+                "disk_bytes": self.disk_bytes,
+            }
+
+    def __path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.pcm")
+
+    def __load_disk_index(self):
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith(".pcm"):
+                continue
+            stat = os.stat(os.path.join(self.disk_dir, name))
+            entries.append((stat.st_mtime, name[:-len(".pcm")], stat.st_size))
+        for _, key, size in sorted(entries):
+            self.disk[key] = size
+            self.disk_bytes += size
+
+    def __stream_disk(self, key: str, pcm: np.memmap) -> Iterator[bytes]:
+        chunks = []
+        step = self.disk_chunk_bytes // 2
+        for start in range(0, len(pcm), step):
+            chunk = pcm[start:start + step].tobytes()
+            chunks.append(chunk)
+            yield chunk
+        # Fully replayed, promote it to the memory tier
+        self.put(key, chunks)
+
+    def __write_disk(self, key: str, pcm: bytes):
+        path = self.__path(key)
+        try:
+            with open(path + ".tmp", "wb") as f:
+                f.write(pcm)
+            os.replace(path + ".tmp", path)
+        except Exception as e:
+            logger.error(f"Error writing synthesis cache entry: {e}")
+            return
+        evicted = []
+        with self.lock:
+            if key not in self.disk:
+                self.disk_bytes += len(pcm)
+            self.disk[key] = len(pcm)
+            while self.disk_bytes > self.max_disk_bytes and len(self.disk) > 1:
+                old_key, size = self.disk.popitem(last=False)
+                self.disk_bytes -= size
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                os.remove(self.__path(old_key))
+            except OSError:
+                pass
@@ -10,7 +10,7 @@ import base64
 
 from synapse.pipeline.streamers.common import CancellableText2SpeechStreamer
 from synapse.processors import AITranscriptIterator
-from synapse.utils import logger
+from synapse.utils import logger, AI_SPEECH_END_TOKEN
 from synapse.config import config
 
 class ElevenLabsTTS_WS(CancellableText2SpeechStreamer):
@@ -53,7 +53,7 @@ class ElevenLabsTTS_WS(CancellableText2SpeechStreamer):
         
     def __call__(self, data: str):
         text = f'{data} '
-        if data == AITranscriptIterator.SPEECH_END_TOKEN:
+        if data == AI_SPEECH_END_TOKEN:
             print(colored(f"((Sending end))", "light_yellow"), end='')
             self.iter = 0   # Reset the counter
             req = {"flush": True}
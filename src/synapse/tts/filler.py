@@ -0,0 +1,160 @@
+from typing import Any, Callable, Dict, List
+import threading
+import time
+
+import numpy as np
+
+from synapse.utils import logger, GLOBAL_THREAD_POOL
+
+
+class FillerPlayer:
+    """
+    Short acknowledgement clips ("mm-hmm", "okay, let me think") played while the response
+    is on its way, so the user doesn't wait in silence after speaking.
+
+    The clips are synthesized once, in the background, by the TTS they are played on. When
+    a turn starts and the predicted time to its first audio is above `threshold` seconds,
+    the next clip is played right away, paced in `chunk_ms` chunks no more than one chunk
+    ahead of playback. The first chunk of the real response cuts it: the clip fades out over
+    `fade_ms` and the response plays after it.
+
+    The prediction is a moving average (weight `smoothing` for the newest turn) of the time
+    from turn start to the first response audio, the LLM's time to first token plus the
+    first synthesis. Until a turn was measured, clips are played.
+
+    Reported: the response latency and the perceived one, until the first audio of any
+    kind, clip or response.
+    """
+    DEFAULT_PHRASES = ["Mm-hmm.", "Okay, let me think.", "Hmm, let me see.", "Right."]
+
+    def __init__(self, phrases: List[str] = None, threshold=0.6, chunk_ms=40, fade_ms=15, smoothing=0.3) -> None:
+        self.phrases = list(phrases or self.DEFAULT_PHRASES)
+        self.threshold = threshold
+        self.chunk_ms = chunk_ms
+        self.fade_ms = fade_ms
+        self.smoothing = smoothing
+        self.clips: List[np.ndarray] = []
+        self.sample_rate = None
+        self.next_clip = 0
+        self.predicted_latency = None
+        self.lock = threading.Lock()
+        # Turn being answered: epoch, start time, whether a clip plays, and its stop event
+        self.epoch = None
+        self.turn_start = None
+        self.first_audio = None
+        self.stop_event = None
+        self.play_future = None
+        self.counters = {"turns": 0, "played": 0, "cut": 0, "completed": 0, "skipped": 0}
+        self.response_latencies = []
+        self.perceived_latencies = []
+
+    def prepare(self, synthesize: Callable[[str], List[bytes]], sample_rate: int):
+        """
+        Synthesizes the clips in the background with `synthesize(text) -> PCM16 chunks`.
+        """
+        self.sample_rate = sample_rate
+        def __prepare():
+            start = time.time()
+            for phrase in self.phrases:
+                try:
+                    pcm = np.frombuffer(b"".join(synthesize(phrase)), dtype=np.int16)
+                except Exception as e:
+                    logger.error(f"Error synthesizing filler clip {phrase!r}: {e}")
+                    continue
+                if len(pcm) > 0:
+                    with self.lock:
+                        self.clips.append(pcm)
+            logger.info(f"{len(self.clips)} filler clips synthesized in {1000 * (time.time() - start):.0f} ms")
+        return GLOBAL_THREAD_POOL.submit(__prepare)
+
+    def on_turn_start(self, epoch: int, emit: Callable[[bytes, int], None]):
+        """
+        A response turn starts, plays a clip if its first audio is predicted to be late.
+        """
+        with self.lock:
+            self.__stop()
+            self.epoch = epoch
+            self.turn_start = time.time()
+            self.first_audio = None
+            self.counters["turns"] += 1
+            if len(self.clips) == 0 or (self.predicted_latency is not None and self.predicted_latency < self.threshold):
+                self.counters["skipped"] += 1
+                return
+            clip = self.clips[self.next_clip % len(self.clips)]
+            self.next_clip += 1
+            self.counters["played"] += 1
+            self.stop_event = threading.Event()
+            self.play_future = GLOBAL_THREAD_POOL.submit(self.__play, clip, epoch, emit, self.stop_event)
+
+    def on_response_audio(self, epoch: int):
+        """
+        The first response audio of the turn is about to be emitted: cuts the clip and
+        waits for its fade out, so the response comes after it.
+        """
+        with self.lock:
+            if epoch != self.epoch or self.turn_start is None:
+                return
+            now = time.time()
+            response_latency = now - self.turn_start
+            self.response_latencies.append(response_latency)
+            self.perceived_latencies.append((self.first_audio or now) - self.turn_start)
+            self.predicted_latency = response_latency if self.predicted_latency is None else \
+                self.smoothing * response_latency + (1 - self.smoothing) * self.predicted_latency
+            self.turn_start = None
+            play_future = self.play_future
+            self.__stop()
+        if play_future is not None:
+            play_future.result()
+
+    def on_interrupt(self):
+        with self.lock:
+            self.turn_start = None
+            self.__stop()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            response = 1000 * np.array(self.response_latencies) if len(self.response_latencies) > 0 else None
+            perceived = 1000 * np.array(self.perceived_latencies) if len(self.perceived_latencies) > 0 else None
+            stats = dict(self.counters, clips=len(self.clips),
+                         predicted_latency_ms=1000 * self.predicted_latency if self.predicted_latency is not None else None)
+        if response is not None:
+            stats.update(response_latency_mean_ms=float(response.mean()), response_latency_p95_ms=float(np.percentile(response, 95)),
+                         perceived_latency_mean_ms=float(perceived.mean()), perceived_latency_p95_ms=float(np.percentile(perceived, 95)))
+        return stats
+
+    def __stop(self):
+        if self.stop_event is not None:
+            self.stop_event.set()
+        self.stop_event = None
+        self.play_future = None
+
+    def __play(self, clip: np.ndarray, epoch: int, emit: Callable[[bytes, int], None], stop_event: threading.Event):
+        step = max(1, self.sample_rate * self.chunk_ms // 1000)
+        chunk_time = step / self.sample_rate
+        start = time.time()
+        try:
+            for i, position in enumerate(range(0, len(clip), step)):
+                # One chunk ahead of playback, so a cut is heard within a chunk
+                delay = start + (i - 1) * chunk_time - time.time()
+                if stop_event.wait(delay) if delay > 0 else stop_event.is_set():
+                    self.__fade_out(clip, position, epoch, emit)
+                    with self.lock:
+                        self.counters["cut"] += 1
+                    return
+                emit(clip[position:position + step].tobytes(), epoch)
+                if i == 0:
+                    with self.lock:
+                        if self.epoch == epoch and self.first_audio is None:
+                            self.first_audio = time.time()
+            with self.lock:
+                self.counters["completed"] += 1
+        except Exception as e:
+            logger.error(f"Error playing filler clip: {e}")
+
+    def __fade_out(self, clip: np.ndarray, position: int, epoch: int, emit: Callable[[bytes, int], None]):
+        # Ramps the rest of the clip down to silence instead of stopping on a click
+        tail = clip[position:position + max(1, self.sample_rate * self.fade_ms // 1000)].astype(np.float32)
+        if position == 0 or len(tail) == 0:
+            return
+        tail *= np.linspace(1.0, 0.0, len(tail), dtype=np.float32)
+        emit(tail.astype(np.int16).tobytes(), epoch)
@@ -1,10 +1,17 @@
-from queue import Queue
-from typing import Any, Dict, Callable
+from queue import Queue, Empty
+from typing import Any, Dict, Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor
 import threading
+import time
 from termcolor import colored
 
 from synapse.pipeline.streamers.common import CancellableText2SpeechStreamer
-from .utils import float32_to_pcm16
+from synapse.utils import logger, AI_SPEECH_END_TOKEN
+from synapse.pipeline.audio import PCMConverter
+from .utils import PlayoutGapMeter
+from .cache import SynthesisCache
+from .filler import FillerPlayer
+from .pool import KokoroProcessPool, get_shared_kokoro_pool
 from synapse.utils.stream2sentence import generate_sentences
 
 class KokoroTTS(CancellableText2SpeechStreamer):
@@ -12,7 +19,11 @@ class KokoroTTS(CancellableText2SpeechStreamer):
     """
     Drop-in replacement for ElevenLabsTTS_WS, but uses Kokoro TTS locally.
     Extends CancellableText2SpeechStreamer to integrate with your pipeline.
+    Triggers "playback_end" with the epoch of a reply once its audio has played out at the
+    sink (AI_SPEECH_END_TOKEN after its last sentence), unless the reply was interrupted.
     """
+    # Kokoro always synthesizes mono float32 at this rate
+    NATIVE_SAMPLE_RATE = 24000
 
     def __init__(
         self,
@@ -20,49 +31,282 @@ class KokoroTTS(CancellableText2SpeechStreamer):
         lang_code='a',
         voice_id='af_heart',
         speed=1.1,
+        cache: SynthesisCache = None,
+        lookahead=0,
+        filler: FillerPlayer = None,
     ):
         """
         :param sample_rate: Bark/Kokoro typically use 24k. 
-                           Adjust to match your LocalSpeaker if needed.
+                           Adjust to match your LocalSpeaker if needed, audio is resampled
+                           from Kokoro's 24k when they differ.
         :param lang_code:  Passed to KPipeline (e.g. 'en', 'a', etc).
         :param voice_id:   The voice name or file path (like 'af_heart').
         :param speed:      Playback speed factor, used by Kokoro engine.
+        :param cache:      Optional SynthesisCache, repeated sentences are replayed from it
+                           instead of being synthesized again. Can be shared between instances.
+        :param lookahead:  Number of upcoming sentences synthesized on a worker pool while the
+                           current one plays, 0 synthesizes inline one sentence at a time.
+                           Output stays in sentence order. The in-process KPipeline isn't
+                           known to be thread safe, so its inference steps are serialized:
+                           above 1, workers only overlap cache replays, or synthesis on the
+                           processes of a PooledKokoroTTS.
+        :param filler:     Optional FillerPlayer, its clips are synthesized at startup and one
+                           is played at the start of a turn whose first audio is predicted late.
         # :param split_pattern: Regex for chunk-splitting input text in Kokoro.
         """
-        from kokoro import KPipeline
-
         super(KokoroTTS, self).__init__()
         self.sample_rate = sample_rate
         self.lang_code = lang_code
         self.voice_id = voice_id
         self.speed = speed
+        self.cache = cache
         # self.split_pattern = split_pattern
 
-        # Kokoro pipeline instance
-        self.pipeline = KPipeline(lang_code=self.lang_code)
+        # Kokoro pipeline instance, one inference step at a time (lookahead workers, filler clips)
+        self.pipeline = self.load_pipeline()
+        self.pipeline_lock = threading.Lock()
+        self.gap_meter = PlayoutGapMeter(sample_rate)
+        # One converter per synthesis thread, they keep resampler state and buffers
+        self.converters = threading.local()
+
+        self.filler = filler
+        if filler is not None:
+            filler.prepare(lambda text: list(self.synthesize_pcm(text, self.epoch_clock.value)), sample_rate)
+
+        self.lookahead = lookahead
+        if lookahead > 0:
+            self.synthesis_pool = ThreadPoolExecutor(max_workers=lookahead, thread_name_prefix="kokoro-lookahead")
+            # (epoch, chunk queue, future) per sentence, in sentence order
+            self.jobs = Queue()
+            # The sentence being played plus `lookahead` being synthesized
+            self.slots = threading.Semaphore(lookahead + 1)
+            self.emit_thread = threading.Thread(target=self.__emit_jobs, daemon=True)
+            self.emit_thread.start()
+
+    def load_pipeline(self):
+        from kokoro import KPipeline
+        return KPipeline(lang_code=self.lang_code)
 
     def __call__(self, data: str):
+        epoch = self.current_epoch()
+        if data == AI_SPEECH_END_TOKEN:
+            if self.lookahead > 0:
+                # Ends the reply once the sentences queued before it are emitted
+                self.jobs.put((epoch, None, None))
+            else:
+                self.__end_reply(epoch)
+            return
+        if self.lookahead > 0:
+            self.__submit(data, epoch)
+            return
+        for i, pcm_bytes in enumerate(self.synthesize(data, epoch)):
+            self.__emit(pcm_bytes, epoch, i == 0)
+
+    def synthesize(self, data: str, epoch: int) -> Iterator[bytes]:
+        """
+        Yields the PCM chunks of a sentence, from the cache when possible.
+        Stops as soon as `epoch` is interrupted.
+        """
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(data, self.voice_id, self.speed, self.sample_rate)
+            cached = self.cache.get(key)
+            if cached is not None:
+                for pcm_bytes in cached:
+                    if self.epoch_clock.is_stale(epoch) or self.is_closed:
+                        return
+                    yield pcm_bytes
+                return
+        chunks = []
+        for pcm_bytes in self.synthesize_pcm(data, epoch):
+            # Stop synthesizing as soon as the turn is interrupted
+            if self.epoch_clock.is_stale(epoch) or self.is_closed:
+                return
+            chunks.append(pcm_bytes)
+            yield pcm_bytes
+        # Only complete syntheses are cached
+        if key is not None and not self.epoch_clock.is_stale(epoch):
+            self.cache.put(key, chunks)
+
+    def synthesize_pcm(self, data: str, epoch: int) -> Iterator[bytes]:
+        """
+        Runs the Kokoro pipeline in this process.
+        """
         generator = self.pipeline(
             data,
             voice=self.voice_id,
             speed=self.speed,
             # split_pattern=self.split_pattern
         )
-        for i, (gs, ps, audio_tensor) in enumerate(generator):
-            if self.interrupted or self.is_closed:
-                break
-            pcm_bytes = float32_to_pcm16(audio_tensor.numpy())
-            self.commit(pcm_bytes)
+        converter = self.get_converter()
+        while True:
+            # The generator runs the model on next(), the lock isn't held while the chunk is consumed
+            with self.pipeline_lock:
+                result = next(generator, None)
+            if result is None:
+                return
+            gs, ps, audio_tensor = result
+            if self.epoch_clock.is_stale(epoch) or self.is_closed:
+                return
+            yield converter.convert(audio_tensor.numpy())
+
+    def get_converter(self) -> PCMConverter:
+        """
+        Float32 24k -> PCM16 at `sample_rate` converter of the calling thread, reset for a new sentence.
+        """
+        converter = getattr(self.converters, "converter", None)
+        if converter is None:
+            converter = self.converters.converter = PCMConverter(self.NATIVE_SAMPLE_RATE, 1, "float32", self.sample_rate, 1, "int16")
+        converter.reset()
+        return converter
+
+    def __emit(self, pcm_bytes: bytes, epoch: int, sentence_start: bool):
+        if sentence_start and self.filler is not None:
+            # The response takes over from the filler clip
+            self.filler.on_response_audio(epoch)
+        self.gap_meter.record(len(pcm_bytes), epoch, sentence_start)
+        self.commit(pcm_bytes, epoch=epoch)
+
+    def __end_reply(self, epoch: int):
+        if self.epoch_clock.is_stale(epoch) or self.is_closed:
+            return
+        # Audio is assumed to play out in real time from the moment it is committed
+        playout_end = self.gap_meter.playout_end_of(epoch)
+        delay = max(0.0, playout_end - time.time()) if playout_end is not None else 0.0
+        timer = threading.Timer(delay, self.__playback_end, args=(epoch,))
+        timer.daemon = True
+        timer.start()
+
+    def __playback_end(self, epoch: int):
+        if self.epoch_clock.is_stale(epoch) or self.is_closed:
+            return
+        self.trigger("playback_end", epoch)
+
+    def __submit(self, data: str, epoch: int):
+        # Wait for a lookahead slot, unless the turn is interrupted meanwhile
+        while not self.slots.acquire(timeout=0.05):
+            if self.epoch_clock.is_stale(epoch) or self.is_closed:
+                return
+        chunks = Queue()
+        def __synthesize():
+            try:
+                for pcm_bytes in self.synthesize(data, epoch):
+                    chunks.put(pcm_bytes)
+            except Exception as e:
+                logger.error(f"Error in lookahead synthesis: {e}")
+            finally:
+                chunks.put(None)
+        future = self.synthesis_pool.submit(__synthesize)
+        # A job cancelled before it started still has to end its chunk queue
+        future.add_done_callback(lambda f: f.cancelled() and chunks.put(None))
+        self.jobs.put((epoch, chunks, future))
+
+    def __emit_jobs(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            epoch, chunks, future = job
+            if chunks is None:
+                self.__end_reply(epoch)
+                continue
+            try:
+                first = True
+                for pcm_bytes in iter(chunks.get, None):
+                    # Keep draining a stale job until its worker notices the interrupt
+                    if self.epoch_clock.is_stale(epoch) or self.is_closed:
+                        continue
+                    self.__emit(pcm_bytes, epoch, first)
+                    first = False
+            except Exception as e:
+                logger.error(f"Error while emitting lookahead audio: {e}")
+            finally:
+                self.slots.release()
+
+    def handle_start(self):
+        super(KokoroTTS, self).handle_start()
+        if self.filler is not None:
+            self.filler.on_turn_start(self.epoch_clock.value, lambda pcm_bytes, epoch: self.commit(pcm_bytes, epoch=epoch))
+
+    def handle_interrupt(self, epoch_clock=None):
+        super(KokoroTTS, self).handle_interrupt(epoch_clock)
+        if self.filler is not None:
+            self.filler.on_interrupt()
+        if self.lookahead > 0:
+            # Sentences that haven't started synthesizing are dropped right away,
+            # running ones stop at their next chunk
+            with self.jobs.mutex:
+                jobs = list(self.jobs.queue)
+            for job in jobs:
+                if job is not None and job[2] is not None and self.epoch_clock.is_stale(job[0]):
+                    job[2].cancel()
+
+    def get_gap_stats(self) -> Dict[str, Any]:
+        """
+        Silence between consecutive sentences of a turn, as heard at the sink.
+        """
+        return self.gap_meter.stats()
+
+    def get_cache_stats(self) -> Dict[str, Any]:
+        return self.cache.stats() if self.cache is not None else {}
+
+    def get_filler_stats(self) -> Dict[str, Any]:
+        """
+        Clips played and cut, response and perceived latency of the turns.
+        """
+        return self.filler.stats() if self.filler is not None else {}
 
     def close(self):
         """
         Closes the pipeline, the background thread, etc.
         """
         super(KokoroTTS, self).close()
+        if self.lookahead > 0:
+            self.jobs.put(None)
+            self.synthesis_pool.shutdown(wait=False)
         print(colored("((KokoroTTS closed))", "light_red"))
 
     def __enter__(self):
         return self
     
     def __exit__(self, exc_type, exc_value, traceback):
-        self.close()
\ No newline at end of file
+        self.close()
+
+class PooledKokoroTTS(KokoroTTS):
+    """
+    KokoroTTS that synthesizes on a KokoroProcessPool instead of in this process,
+    so torch inference doesn't compete for the GIL with STT, the LLM and the transcript.
+    Many sessions can share one pool, each gets its own fairness queue in it.
+    """
+    def __init__(self, pool: KokoroProcessPool = None, session_id=None, **kwargs):
+        """
+        :param pool:       Pool to synthesize on, defaults to the process-wide shared pool
+                           for `lang_code`.
+        :param session_id: Key of this session's fairness queue in the pool.
+        Other parameters are the ones of KokoroTTS.
+        """
+        self.pool = pool or get_shared_kokoro_pool(lang_code=kwargs.get("lang_code", 'a'))
+        self.session_id = session_id if session_id is not None else id(self)
+        super(PooledKokoroTTS, self).__init__(**kwargs)
+
+    def load_pipeline(self):
+        # The workers each load their own KPipeline
+        return None
+
+    def synthesize_pcm(self, data: str, epoch: int) -> Iterator[bytes]:
+        job = self.pool.submit(self.session_id, data, self.voice_id, self.speed, self.sample_rate)
+        try:
+            while not (self.epoch_clock.is_stale(epoch) or self.is_closed):
+                try:
+                    pcm_bytes = job.next_chunk(timeout=0.05)
+                except Empty:
+                    continue
+                if pcm_bytes is None:
+                    return
+                yield pcm_bytes
+        finally:
+            # No-op once the job is over, frees the worker if we stopped early
+            job.cancel()
+
+    def get_pool_stats(self) -> Dict[str, Any]:
+        return self.pool.stats()
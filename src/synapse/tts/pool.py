@@ -0,0 +1,347 @@
+from collections import OrderedDict, deque
+from multiprocessing import shared_memory
+from queue import Empty, Queue
+from typing import Any, Dict, Optional
+import itertools
+import multiprocessing as mp
+import threading
+import time
+
+from synapse.utils import logger
+
+# Messages sent by the workers on the shared response queue
+_READY, _CHUNK, _DONE, _ERROR = "ready", "chunk", "done", "error"
+# Slot index of a chunk too large for the arena, sent through a one-off segment instead
+_OVERSIZE = -1
+# Seconds between two checks that the worker processes are still alive
+_LIVENESS_INTERVAL = 1.0
+
+
+def _kokoro_worker(worker_key, lang_code, arena_name, slot_bytes, slots, free_slots, cancelled, requests, responses):
+    """
+    Worker process: loads KPipeline once, then synthesizes requests one at a time.
+    Every response carries worker_key, the (worker_id, generation) pair of this process.
+    PCM chunks are written to this worker's shared memory arena, round robin over its slots;
+    the parent releases a slot (free_slots) once it has copied the chunk out.
+    """
+    from kokoro import KPipeline
+    from synapse.pipeline.audio import PCMConverter
+
+    # Spawned workers share the parent's resource tracker, which unlinks segments left at exit
+    arena = shared_memory.SharedMemory(name=arena_name)
+    try:
+        pipeline = KPipeline(lang_code=lang_code)
+    except Exception as e:
+        responses.put((_ERROR, worker_key, None, f"Failed to load KPipeline: {e}"))
+        return
+    responses.put((_READY, worker_key, None, None))
+    slot_counter = itertools.count()
+    # Converters from Kokoro's float32 24k output, per requested sample rate
+    converters = {}
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        job_id, text, voice_id, speed, sample_rate = request
+        try:
+            converter = converters.get(sample_rate)
+            if converter is None:
+                converter = converters[sample_rate] = PCMConverter(24000, 1, "float32", sample_rate, 1, "int16")
+            converter.reset()
+            for gs, ps, audio_tensor in pipeline(text, voice=voice_id, speed=speed):
+                if cancelled.value == job_id:
+                    break
+                # A view of the converter's buffer, copied once into shared memory
+                pcm_bytes = converter.convert(audio_tensor.numpy(), copy=False)
+                if len(pcm_bytes) > slot_bytes:
+                    shm = shared_memory.SharedMemory(create=True, size=len(pcm_bytes))
+                    shm.buf[:len(pcm_bytes)] = pcm_bytes
+                    # The parent unlinks it after the copy
+                    shm.close()
+                    responses.put((_CHUNK, worker_key, job_id, (_OVERSIZE, shm.name, len(pcm_bytes))))
+                    continue
+                free_slots.acquire()
+                slot = next(slot_counter) % slots
+                arena.buf[slot * slot_bytes:slot * slot_bytes + len(pcm_bytes)] = pcm_bytes
+                responses.put((_CHUNK, worker_key, job_id, (slot, None, len(pcm_bytes))))
+            responses.put((_DONE, worker_key, job_id, None))
+        except Exception as e:
+            responses.put((_ERROR, worker_key, job_id, str(e)))
+    arena.close()
+
+
+class PooledSynthesisJob:
+    """
+    Handle of one sentence submitted to a KokoroProcessPool.
+    """
+    def __init__(self, pool: "KokoroProcessPool", job_id: int, session_id: Any, request: tuple) -> None:
+        self.pool = pool
+        self.job_id = job_id
+        self.session_id = session_id
+        self.request = request
+        self.worker_id = None
+        self.chunks = Queue()
+        self.is_cancelled = False
+
+    def next_chunk(self, timeout: float = None) -> Optional[bytes]:
+        """
+        Next PCM chunk, None once the job is over. Raises queue.Empty on timeout.
+        """
+        return self.chunks.get(timeout=timeout)
+
+    def cancel(self):
+        self.pool.cancel(self)
+
+
+class KokoroProcessPool:
+    """
+    Pool of worker processes that each load Kokoro's KPipeline once, so torch inference
+    doesn't hold the GIL of the process running STT, the LLM and the transcript.
+
+    PCM comes back through a shared memory arena per worker instead of pickled bytes.
+    Jobs are queued per session and handed to idle workers round robin across sessions,
+    so one session with a long answer can't starve the others.
+
+    :param num_workers: Number of worker processes.
+    :param lang_code: Passed to KPipeline in every worker.
+    :param slot_bytes: Size of an arena slot, larger chunks use a one-off segment.
+    :param slots_per_worker: Chunks a worker can have in flight before the parent copies them out.
+    :param max_respawns: Times a worker process that died is restarted before it is given up on.
+    """
+    def __init__(self, num_workers=2, lang_code='a', slot_bytes=1024 * 1024, slots_per_worker=4, max_respawns=3) -> None:
+        self.lang_code = lang_code
+        self.slot_bytes = slot_bytes
+        self.slots_per_worker = slots_per_worker
+        self.max_respawns = max_respawns
+        self.ctx = mp.get_context("spawn")
+        self.responses = self.ctx.Queue()
+        self.lock = threading.Condition()
+        self.sessions: OrderedDict[Any, deque] = OrderedDict()
+        self.jobs: Dict[int, PooledSynthesisJob] = {}
+        self.job_ids = itertools.count(1)
+        self.idle = deque()
+        self.dead_workers = 0
+        self.is_closed = False
+        self.stats_counters = {"submitted": 0, "completed": 0, "cancelled": 0, "failed": 0, "bytes_returned": 0, "respawned": 0}
+        self.workers = [self.__spawn_worker(worker_id, 0) for worker_id in range(num_workers)]
+        self.response_thread = threading.Thread(target=self.__read_responses, daemon=True)
+        self.response_thread.start()
+
+    def submit(self, session_id: Any, text: str, voice_id: str, speed: float, sample_rate: int = 24000) -> PooledSynthesisJob:
+        with self.lock:
+            if self.is_closed:
+                raise RuntimeError("KokoroProcessPool is closed")
+            job = PooledSynthesisJob(self, next(self.job_ids), session_id, (text, voice_id, speed, sample_rate))
+            self.stats_counters["submitted"] += 1
+            if self.dead_workers == len(self.workers):
+                # Nothing left to run it, end it right away rather than let the caller wait
+                self.stats_counters["failed"] += 1
+                job.chunks.put(None)
+                return job
+            self.jobs[job.job_id] = job
+            self.sessions.setdefault(session_id, deque()).append(job)
+            self.__dispatch()
+        return job
+
+    def cancel(self, job: PooledSynthesisJob):
+        with self.lock:
+            if job.is_cancelled or job.job_id not in self.jobs:
+                return
+            job.is_cancelled = True
+            self.stats_counters["cancelled"] += 1
+            if job.worker_id is None:
+                self.sessions[job.session_id].remove(job)
+                self.__finish(job)
+            else:
+                # The worker stops at its next chunk and reports done
+                self.workers[job.worker_id]["cancelled"].value = job.job_id
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return dict(self.stats_counters,
+                        workers=len(self.workers),
+                        dead_workers=self.dead_workers,
+                        busy=sum(worker["job"] is not None for worker in self.workers),
+                        queued={session: len(jobs) for session, jobs in self.sessions.items() if jobs})
+
+    def close(self):
+        with self.lock:
+            if self.is_closed:
+                return
+            self.is_closed = True
+            for job in list(self.jobs.values()):
+                self.__finish(job)
+        for worker in self.workers:
+            worker["requests"].put(None)
+        for worker in self.workers:
+            worker["process"].join(timeout=5)
+            if worker["process"].is_alive():
+                worker["process"].terminate()
+        self.responses.put(None)
+        for worker in self.workers:
+            worker["arena"].close()
+            try:
+                worker["arena"].unlink()
+            except FileNotFoundError:
+                # Already released when the worker was given up on
+                pass
+
+    def __spawn_worker(self, worker_id: int, generation: int) -> dict:
+        arena = shared_memory.SharedMemory(create=True, size=self.slot_bytes * self.slots_per_worker)
+        worker = {
+            "arena": arena,
+            "free_slots": self.ctx.Semaphore(self.slots_per_worker),
+            "cancelled": self.ctx.Value("q", 0),
+            "requests": self.ctx.Queue(),
+            "job": None,
+            "generation": generation,
+            "is_dead": False,
+        }
+        worker["process"] = self.ctx.Process(
+            target=_kokoro_worker,
+            args=((worker_id, generation), self.lang_code, arena.name, self.slot_bytes, self.slots_per_worker,
+                  worker["free_slots"], worker["cancelled"], worker["requests"], self.responses),
+            daemon=True,
+        )
+        worker["process"].start()
+        return worker
+
+    # Callers hold self.lock
+    def __dispatch(self):
+        while self.idle:
+            job = self.__next_job()
+            if job is None:
+                return
+            worker_id = self.idle.popleft()
+            job.worker_id = worker_id
+            self.workers[worker_id]["job"] = job
+            self.workers[worker_id]["requests"].put((job.job_id, *job.request))
+
+    def __next_job(self) -> Optional[PooledSynthesisJob]:
+        # Round robin: the session served last moves to the back of the line
+        for session_id, jobs in self.sessions.items():
+            if jobs:
+                self.sessions.move_to_end(session_id)
+                return jobs.popleft()
+        return None
+
+    def __finish(self, job: PooledSynthesisJob):
+        self.jobs.pop(job.job_id, None)
+        job.chunks.put(None)
+        if job.session_id in self.sessions and not self.sessions[job.session_id]:
+            del self.sessions[job.session_id]
+
+    def __mark_dead(self, worker_id: int):
+        self.workers[worker_id]["is_dead"] = True
+        self.dead_workers += 1
+        if self.dead_workers == len(self.workers):
+            for job in list(self.jobs.values()):
+                self.__finish(job)
+            self.sessions.clear()
+
+    def __check_workers(self):
+        """
+        Ends the job of a worker process that died without reporting it (crash, OOM kill)
+        and restarts the process, up to max_respawns times.
+        """
+        with self.lock:
+            if self.is_closed:
+                return
+            for worker_id, worker in enumerate(self.workers):
+                if worker["is_dead"] or worker["process"].is_alive():
+                    continue
+                logger.error(f"Kokoro worker {worker_id} exited with code {worker['process'].exitcode}")
+                job = worker["job"]
+                if job is not None:
+                    if not job.is_cancelled:
+                        self.stats_counters["failed"] += 1
+                    self.__finish(job)
+                if worker_id in self.idle:
+                    self.idle.remove(worker_id)
+                worker["arena"].close()
+                worker["arena"].unlink()
+                if worker["generation"] >= self.max_respawns:
+                    worker["job"] = None
+                    self.__mark_dead(worker_id)
+                    continue
+                # Ready again once the new process has loaded its KPipeline
+                self.workers[worker_id] = self.__spawn_worker(worker_id, worker["generation"] + 1)
+                self.stats_counters["respawned"] += 1
+            self.__dispatch()
+
+    def __read_responses(self):
+        last_check = time.monotonic()
+        while True:
+            if time.monotonic() - last_check >= _LIVENESS_INTERVAL:
+                self.__check_workers()
+                last_check = time.monotonic()
+            try:
+                message = self.responses.get(timeout=_LIVENESS_INTERVAL)
+            except Empty:
+                continue
+            if message is None:
+                return
+            kind, (worker_id, generation), job_id, payload = message
+            worker = self.workers[worker_id]
+            if generation != worker["generation"]:
+                # Sent by a process that has been replaced, its arena is gone
+                if kind == _CHUNK and payload[0] == _OVERSIZE:
+                    self.__copy_chunk(worker, payload)
+                continue
+            if kind == _CHUNK:
+                pcm_bytes = self.__copy_chunk(worker, payload)
+                with self.lock:
+                    job = self.jobs.get(job_id)
+                    if job is not None and not job.is_cancelled:
+                        self.stats_counters["bytes_returned"] += len(pcm_bytes)
+                        job.chunks.put(pcm_bytes)
+                continue
+            with self.lock:
+                if kind == _READY:
+                    self.idle.append(worker_id)
+                elif job_id is None:
+                    # The worker couldn't load the model and exited
+                    logger.error(f"Kokoro worker {worker_id} failed: {payload}")
+                    self.__mark_dead(worker_id)
+                else:
+                    job = self.jobs.get(job_id)
+                    if kind == _ERROR:
+                        logger.error(f"Kokoro worker {worker_id} failed: {payload}")
+                        self.stats_counters["failed"] += 1
+                    elif job is not None and not job.is_cancelled:
+                        self.stats_counters["completed"] += 1
+                    if job is not None:
+                        self.__finish(job)
+                    worker["job"] = None
+                    self.idle.append(worker_id)
+                if not self.is_closed:
+                    self.__dispatch()
+
+    def __copy_chunk(self, worker: dict, payload: tuple) -> bytes:
+        slot, name, size = payload
+        if slot == _OVERSIZE:
+            shm = shared_memory.SharedMemory(name=name)
+            try:
+                return bytes(shm.buf[:size])
+            finally:
+                shm.close()
+                shm.unlink()
+        start = slot * self.slot_bytes
+        pcm_bytes = bytes(worker["arena"].buf[start:start + size])
+        worker["free_slots"].release()
+        return pcm_bytes
+
+
+_shared_pools: Dict[tuple, KokoroProcessPool] = {}
+_shared_pools_lock = threading.Lock()
+
+
+def get_shared_kokoro_pool(num_workers=2, lang_code='a') -> KokoroProcessPool:
+    """
+    Process-wide pool per language, shared by every session that asks for it.
+    """
+    with _shared_pools_lock:
+        pool = _shared_pools.get(lang_code)
+        if pool is None or pool.is_closed:
+            pool = _shared_pools[lang_code] = KokoroProcessPool(num_workers=num_workers, lang_code=lang_code)
+        return pool
@@ -1,3 +1,5 @@
+import threading
+import time
 
 import numpy as np
 
@@ -8,6 +10,56 @@ def float32_to_pcm16(audio: np.ndarray) -> bytes:
     # shape could be (channels, samples)
     if audio.ndim == 2:
         audio = audio[0]  # take first channel for mono
+    # One scratch copy scaled in place, PCMConverter avoids even that for streams
     audio = np.clip(audio, -1.0, 1.0)
-    audio_int16 = (audio * 32767.0).astype(np.int16)
-    return audio_int16.tobytes()
+    np.multiply(audio, 32767.0, out=audio)
+    return audio.astype(np.int16).tobytes()
+
+
+class PlayoutGapMeter:
+    """
+    Measures the silence heard between consecutive sentences of a turn.
+    Audio is assumed to play out in real time from the moment it is handed to the sink,
+    so the gap is how long after the previous sentence ran out the next one was ready.
+    """
+    def __init__(self, sample_rate: int, sample_width: int = 2, channels: int = 1) -> None:
+        self.bytes_per_second = sample_rate * sample_width * channels
+        self.lock = threading.Lock()
+        self.epoch = None
+        self.playout_end = None
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def record(self, num_bytes: int, epoch: int, sentence_start: bool):
+        now = time.time()
+        with self.lock:
+            if epoch != self.epoch:
+                # A new turn starts from silence, that is not an inter-sentence gap
+                self.epoch = epoch
+                self.playout_end = None
+            if sentence_start and self.playout_end is not None:
+                gap = max(0.0, now - self.playout_end)
+                self.count += 1
+                self.total += gap
+                self.max = max(self.max, gap)
+                self.last = gap
+            self.playout_end = max(now, self.playout_end or now) + num_bytes / self.bytes_per_second
+
+    def playout_end_of(self, epoch: int):
+        """
+        When the audio recorded so far for `epoch` runs out at the sink, None if there is none.
+        """
+        with self.lock:
+            return self.playout_end if epoch == self.epoch else None
+
+    def stats(self):
+        with self.lock:
+            return {
+                "count": self.count,
+                "mean_ms": 1000 * self.total / self.count if self.count else 0.0,
+                "max_ms": 1000 * self.max,
+                "last_ms": 1000 * self.last,
+                "total_ms": 1000 * self.total,
+            }
@@ -6,13 +6,15 @@ from a continuous stream of characters or text chunks
 import functools
 import logging
 import re
-import time
+import threading
+from concurrent.futures import Future
 from typing import (
     AsyncIterable,
     AsyncIterator,
     Awaitable,
     Callable,
     Concatenate,
+    Dict,
     Iterable,
     Iterator,
     ParamSpec,
@@ -21,54 +23,20 @@ from typing import (
 import emoji
 
 current_tokenizer = "nltk"
-stanza_initialized = False
-nltk_initialized = False
-nlp = None
 
 
 def initialize_nltk(debug=False):
     """
-    Initializes NLTK by downloading required data for sentence tokenization.
+    Initializes NLTK, the punkt model is downloaded and loaded once per process.
     """
-    global nltk_initialized
-    if nltk_initialized:
-        return
-
-    logging.info("Initializing NLTK Tokenizer")
-
-    try:
-        logging.info("Importing NLTK")
-        import nltk
-        logging.info("Downloading NLTK punkt tokenizer")
-        nltk.download("punkt_tab")
-        logging.info("NLTK punkt tokenizer downloaded")
-        nltk_initialized = True
-    except Exception as e:
-        print(f"Error initializing nltk tokenizer: {e}")
-        nltk_initialized = False
+    TOKENIZERS.get("nltk")
 
 
 def initialize_stanza(language: str = "en", offline=False):
     """
-    Initializes Stanza by downloading required data for sentence tokenization.
+    Initializes Stanza, the tokenize pipeline is loaded once per process and language.
     """
-    global nlp, stanza_initialized
-    if stanza_initialized:
-        return
-
-    logging.info("Initializing Stanza Tokenizer")
-
-    try:
-        import stanza
-
-        if not offline:
-            stanza.download(language)
-
-        nlp = stanza.Pipeline(language, download_method=None)
-        stanza_initialized = True
-    except Exception as e:
-        print(f"Error initializing stanza tokenizer: {e}")
-        stanza_initialized = False
+    TOKENIZERS.get("stanza", language, offline)
 
 
 def _remove_links(text: str) -> str:
@@ -102,30 +70,6 @@ def _remove_emojis(text: str) -> str:
     return emoji.replace_emoji(text, "")
 
 
-async def _generate_characters(
-    generator: AsyncIterable[str], log_characters: bool = False
-) -> AsyncIterator[str]:
-    """
-    Generates individual characters from a text generator.
-
-    Args:
-        generator (Iterator[str]): Input text generator
-        log_characters (bool): Whether to log the characters to the console
-
-    Yields:
-        Individual characters from the generator
-    """
-    if log_characters:
-        print("Stream: ", end="", flush=True)
-    async for chunk in generator:
-        for char in chunk:
-            if log_characters:
-                print(char, end="", flush=True)
-            yield char
-    if log_characters:
-        print()
-
-
 def _clean_text(
     text: str,
     cleanup_text_links: bool = False,
@@ -154,6 +98,223 @@ def _clean_text(
     return text
 
 
+# Words that end with a period without ending the sentence (lowercase, inner dots kept)
+_ABBREVIATIONS = frozenset({
+    "mr", "mrs", "ms", "dr", "prof", "sr", "jr", "st", "mt", "vs", "etc", "cf", "approx",
+    "dept", "est", "fig", "inc", "ltd", "corp", "vol", "jan", "feb", "mar", "apr", "jun",
+    "jul", "aug", "sep", "sept", "oct", "nov", "dec", "e.g", "i.e", "u.s", "u.k", "a.m", "p.m",
+})
+
+
+class IncrementalSentenceSegmenter:
+    """
+    Rule based sentence splitter for a buffer that only grows between calls.
+
+    Confirmed boundaries are cached, so each call only looks at the text appended since
+    the previous one (plus the last undecided terminator), instead of re-tokenizing the
+    whole buffer the way the nltk and stanza backends do. When the buffer is replaced
+    rather than extended the state is reset.
+
+    A terminator ends a sentence once the next word is visible and it is not part of
+    an abbreviation, an initial, a decimal number or list numbering, and a period or
+    ellipsis is not followed by a lowercase word.
+    """
+    TERMINATORS = ".?!…。！？\n"
+    FULLWIDTH_TERMINATORS = "。！？"
+    CLOSERS = "\"')]}»”’」』）"
+    OPENERS = "\"'([{“‘«"
+
+    def __init__(self, abbreviations=_ABBREVIATIONS) -> None:
+        self.abbreviations = abbreviations
+        self.candidates = re.compile(f"[{re.escape(self.TERMINATORS)}]")
+        self.trailers = (self.TERMINATORS + self.CLOSERS).replace("\n", "")
+        self.reset()
+
+    def reset(self):
+        self.text = ""
+        self.sentences = []     # Confirmed sentences, stripped
+        self.start = 0          # Offset of the sentence still being written
+        self.scan_pos = 0       # First offset not decided yet
+
+    def __call__(self, text: str) -> list[str]:
+        if not text.startswith(self.text):
+            self.reset()
+        self.text = text
+        self._scan()
+        tail = text[self.start:].strip()
+        return self.sentences + [tail] if tail else list(self.sentences)
+
+    def _scan(self):
+        text = self.text
+        while True:
+            match = self.candidates.search(text, self.scan_pos)
+            if match is None:
+                self.scan_pos = len(text)
+                return
+            decision = self._decide(text, match.start())
+            if decision is None:
+                # Not enough lookahead yet, resume from this terminator on the next call
+                self.scan_pos = match.start()
+                return
+            end, is_boundary = decision
+            if is_boundary:
+                sentence = text[self.start:end].strip()
+                if sentence:
+                    self.sentences.append(sentence)
+                self.start = end
+            self.scan_pos = end
+
+    def _decide(self, text: str, i: int):
+        """
+        Returns (end of the terminator run, is boundary), or None if undecidable yet.
+        """
+        if text[i] == "\n":
+            return i + 1, True
+        n = len(text)
+        j = i
+        while j < n and text[j] in self.trailers:
+            j += 1
+        if j == n:
+            return None
+        run = text[i:j]
+        if any(c in self.FULLWIDTH_TERMINATORS for c in run):
+            return j, True
+        if not text[j].isspace():
+            # 3.14, e.g.x, www.example.com
+            return j, False
+        k = j
+        while k < n and text[k] in " \t":
+            k += 1
+        if k == n:
+            return None
+        if "?" in run or "!" in run or text[k] == "\n":
+            return j, True
+        if text[k].islower():
+            return j, False
+        if run.rstrip(self.CLOSERS) == ".":
+            word = re.search(r"(\S*)$", text[max(self.start, i - 32):i]).group(1).lstrip(self.OPENERS)
+            if word.lower() in self.abbreviations:
+                return j, False
+            if len(word) == 1 and word.isupper():
+                return j, False
+            if word.isdigit() and text[self.start:i].strip() == word:
+                return j, False
+        return j, True
+
+
+def _load_nltk(language: str, offline: bool) -> Callable[[str], list[str]]:
+    logging.info("Initializing NLTK Tokenizer")
+    import nltk
+
+    try:
+        nltk.data.find("tokenizers/punkt_tab/english/")
+    except LookupError:
+        if offline:
+            raise
+        logging.info("Downloading NLTK punkt tokenizer")
+        nltk.download("punkt_tab")
+    # The first call unpickles the punkt model, nltk keeps it cached afterwards
+    nltk.tokenize.sent_tokenize("Warm up.")
+    logging.info("NLTK punkt tokenizer loaded")
+    return nltk.tokenize.sent_tokenize
+
+
+def _load_stanza(language: str, offline: bool) -> Callable[[str], list[str]]:
+    logging.info("Initializing Stanza Tokenizer")
+    import stanza
+
+    if not offline:
+        stanza.download(language, processors="tokenize")
+    nlp = stanza.Pipeline(language, processors="tokenize", download_method=None)
+    # The pipeline is shared by every stream, stanza does not promise thread safety
+    lock = threading.Lock()
+
+    def tokenize(text: str) -> list[str]:
+        with lock:
+            doc = nlp(text)
+        return [sentence.text for sentence in doc.sentences]
+    return tokenize
+
+
+def _load_incremental(language: str, offline: bool) -> Callable[[str], list[str]]:
+    # Stateless use, generate_sentences keeps one stateful segmenter per stream instead
+    return lambda text: IncrementalSentenceSegmenter()(text)
+
+
+class TokenizerRegistry:
+    """
+    Process-wide cache of sentence tokenizers, so punkt/stanza models are downloaded and
+    loaded once and shared by every stream and session instead of once per utterance.
+    Concurrent requests for the same tokenizer wait for the same load.
+    """
+    LOADERS = {
+        "nltk": _load_nltk,
+        "stanza": _load_stanza,
+        "incremental": _load_incremental,
+    }
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.loads: Dict[tuple, Future] = {}
+
+    def preload(self, tokenizer: str, language: str = "en", offline=False) -> Future:
+        """
+        Start loading a tokenizer in the background, returns the Future of the tokenize function.
+        """
+        from synapse.utils import GLOBAL_THREAD_POOL
+        return self.__load(tokenizer, language, offline, GLOBAL_THREAD_POOL.submit)
+
+    def get(self, tokenizer: str, language: str = "en", offline=False) -> Callable[[str], list[str]]:
+        """
+        Returns the tokenize function, loading it in the calling thread if nobody has yet.
+        """
+        return self.__load(tokenizer, language, offline, None).result()
+
+    def is_loaded(self, tokenizer: str, language: str = "en") -> bool:
+        future = self.loads.get(self.__key(tokenizer, language))
+        return future is not None and future.done() and future.exception() is None
+
+    def __key(self, tokenizer: str, language: str) -> tuple:
+        # Only stanza loads a model per language
+        return (tokenizer, language if tokenizer == "stanza" else None)
+
+    def __load(self, tokenizer: str, language: str, offline: bool, submit: Callable) -> Future:
+        if tokenizer not in self.LOADERS:
+            raise ValueError(f"Unknown tokenizer: {tokenizer}")
+        key = self.__key(tokenizer, language)
+        with self.lock:
+            future = self.loads.get(key)
+            if future is not None:
+                return future
+            future = self.loads[key] = Future()
+
+        def __run():
+            try:
+                future.set_result(self.LOADERS[tokenizer](language, offline))
+            except Exception as e:
+                logging.error(f"Error initializing {tokenizer} tokenizer: {e}")
+                # Forget the failed load so that the next request retries it
+                with self.lock:
+                    self.loads.pop(key, None)
+                future.set_exception(e)
+
+        if submit is None:
+            __run()
+        else:
+            submit(__run)
+        return future
+
+
+TOKENIZERS = TokenizerRegistry()
+
+
+def preload_tokenizer(tokenizer: str, language: str = "en", offline=False) -> Future:
+    """
+    Loads the sentence tokenizer in the background while the rest of the pipeline starts.
+    """
+    return TOKENIZERS.preload(tokenizer, language, offline)
+
+
 def _tokenize_sentences(text: str, tokenize_sentences=None) -> list[str]:
     """
     Tokenizes sentences from the input text.
@@ -169,34 +330,21 @@ def _tokenize_sentences(text: str, tokenize_sentences=None) -> list[str]:
     if tokenize_sentences:
         sentences = tokenize_sentences(text)
     else:
-        nlp_start_time = time.time()
-        if current_tokenizer == "nltk":
-            import nltk
-
-            sentences = nltk.tokenize.sent_tokenize(text)
-        elif current_tokenizer == "stanza":
-            import stanza
-
-            global nlp
-            doc = nlp(text)
-            sentences = [sentence.text for sentence in doc.sentences]
-        else:
-            raise ValueError(f"Unknown tokenizer: {current_tokenizer}")
-        nlp_end_time = time.time()
-        # logging.info("Time to split sentences: " f"{nlp_end_time - nlp_start_time}")
+        sentences = TOKENIZERS.get(current_tokenizer)(text)
     return sentences
 
 
 def init_tokenizer(tokenizer: str, language: str = "en", offline=False, debug=False):
     """
-    Initializes the sentence tokenizer.
+    Initializes the sentence tokenizer, a no-op once it is loaded.
     """
-    if tokenizer == "nltk":
-        initialize_nltk(debug)
-    elif tokenizer == "stanza":
-        initialize_stanza(language,offline=offline)
-    else:
+    try:
+        TOKENIZERS.get(tokenizer, language, offline)
+    except ValueError:
         logging.warning(f"Unknown tokenizer: {tokenizer}")
+    except Exception:
+        # Already logged by the registry, the next request retries the load
+        pass
 
 async def generate_sentences_async(
     generator: AsyncIterable[str],
@@ -258,7 +406,9 @@ async def generate_sentences_async(
         tokenize_sentences (Callable): A function that tokenizes sentences
           from the input text. Defaults to None.
         tokenizer (str): The tokenizer to use for sentence tokenization.
-          Default is "nltk". Can be "nltk" or "stanza".
+          Default is "nltk". Can be "nltk", "stanza" or "incremental"
+          (rule based, keeps its state between characters instead of
+          re-tokenizing the whole buffer, see IncrementalSentenceSegmenter).
         language (str): The language to use for sentence tokenization.
           Default is "en". Can be "multilingual" for stanze tokenizer.
         log_characters (bool): If True, logs each character to the console as
@@ -285,10 +435,14 @@ async def generate_sentences_async(
       making it versatile for different types of text processing applications.
     """
 
-     # Initialize the tokenizer based on the specified tokenizer and language
-    global current_tokenizer
-    current_tokenizer = tokenizer
-    init_tokenizer(current_tokenizer, language, debug)
+    # Resolve the tokenizer per stream rather than through a module global,
+    # the model itself is loaded once and shared (see TokenizerRegistry)
+    if tokenize_sentences is None:
+        if tokenizer == "incremental":
+            # One segmenter per stream, it caches the boundaries of this buffer
+            tokenize_sentences = IncrementalSentenceSegmenter()
+        else:
+            tokenize_sentences = TOKENIZERS.get(tokenizer, language)
 
     buffer = ""
     is_first_sentence = True
@@ -302,147 +456,157 @@ async def generate_sentences_async(
     if quick_yield_for_all_sentences:
         quick_yield_single_sentence_fragment = True
 
-    async for char in _generate_characters(generator, log_characters):
+    if log_characters:
+        print("Stream: ", end="", flush=True)
 
-        if char:
-            if len(buffer) == 0:
-                if not char.isalnum():
-                    continue
+    # Whole chunks are consumed per resume, the per-character work stays a tight local loop
+    async for chunk in generator:
+        if log_characters:
+            print(chunk, end="", flush=True)
 
-            buffer += char
-            buffer = buffer.lstrip()
+        for char in chunk:
+            if char:
+                if len(buffer) == 0:
+                    if not char.isalnum():
+                        continue
 
-            # Update word count on encountering space or sentence fragment delimiter
-            if char.isspace() or char in sentence_fragment_delimiters:
-                word_count += 1
+                buffer += char
+                buffer = buffer.lstrip()
 
-            if debug:
-                print("\033[36mDebug: Added char, buffer size: \"{}\"\033[0m".format(len(buffer)))
+                # Update word count on encountering space or sentence fragment delimiter
+                if char.isspace() or char in sentence_fragment_delimiters:
+                    word_count += 1
 
-            # Check conditions to yield first sentence fragment quickly
-            if (
-                is_first_sentence
-                and len(buffer) > minimum_first_fragment_length
-                and quick_yield_single_sentence_fragment
-            ):
+                if debug:
+                    print("\033[36mDebug: Added char, buffer size: \"{}\"\033[0m".format(len(buffer)))
 
+                # Check conditions to yield first sentence fragment quickly
                 if (
-                    buffer[-1] in sentence_fragment_delimiters
-                    or char.isspace() and word_count >= force_first_fragment_after_words
+                    is_first_sentence
+                    and len(buffer) > minimum_first_fragment_length
+                    and quick_yield_single_sentence_fragment
                 ):
 
-                    yield_text = _clean_text(
-                        buffer,
-                        cleanup_text_links,
-                        cleanup_text_emojis)
-                    if debug:
-                        if buffer[-1] in sentence_fragment_delimiters:
-                            print("\033[36mDebug: Yielding first sentence fragment: \"{}\" because buffer[-1] {} is sentence frag \033[0m".format(yield_text, buffer[-1]))
-                        else:
-                            print("\033[36mDebug: Yielding first sentence fragment: \"{}\" because word_count {} is >= force_first_fragment_after_words \033[0m".format(yield_text, word_count))
+                    if (
+                        buffer[-1] in sentence_fragment_delimiters
+                        or char.isspace() and word_count >= force_first_fragment_after_words
+                    ):
 
-                    yield yield_text
+                        yield_text = _clean_text(
+                            buffer,
+                            cleanup_text_links,
+                            cleanup_text_emojis)
+                        if debug:
+                            if buffer[-1] in sentence_fragment_delimiters:
+                                print("\033[36mDebug: Yielding first sentence fragment: \"{}\" because buffer[-1] {} is sentence frag \033[0m".format(yield_text, buffer[-1]))
+                            else:
+                                print("\033[36mDebug: Yielding first sentence fragment: \"{}\" because word_count {} is >= force_first_fragment_after_words \033[0m".format(yield_text, word_count))
 
-                    buffer = ""
-                    word_count = 0
-                    if not quick_yield_every_fragment:
-                        is_first_sentence = False
+                        yield yield_text
 
-                    continue
+                        buffer = ""
+                        word_count = 0
+                        if not quick_yield_every_fragment:
+                            is_first_sentence = False
 
-             # Continue accumulating characters if buffer is under minimum sentence length
-            if len(buffer) <= minimum_sentence_length + context_size:
+                        continue
 
-                continue
+                 # Continue accumulating characters if buffer is under minimum sentence length
+                if len(buffer) <= minimum_sentence_length + context_size:
 
-            # Update last delimiter position if a new delimiter is found
-            if char in full_sentence_delimiters:
-                last_delimiter_position = len(buffer) - 1
+                    continue
 
-            # Define context window for checking potential sentence boundaries
-            context_window_end_pos = len(buffer) - context_size - 1
-            context_window_start_pos = (
-                context_window_end_pos - context_size_look_overhead
-            )
-            if context_window_start_pos < 0:
-                context_window_start_pos = 0
+                # Update last delimiter position if a new delimiter is found
+                if char in full_sentence_delimiters:
+                    last_delimiter_position = len(buffer) - 1
+
+                # Define context window for checking potential sentence boundaries
+                context_window_end_pos = len(buffer) - context_size - 1
+                context_window_start_pos = (
+                    context_window_end_pos - context_size_look_overhead
+                )
+                if context_window_start_pos < 0:
+                    context_window_start_pos = 0
+
+                # Tokenize sentences from buffer
+                sentences = _tokenize_sentences(buffer, tokenize_sentences)
+
+                if debug:
+                    print("\033[36mbuffer: \"{}\"\033[0m".format(buffer))
+                    print("\033[36mlast_delimiter_position: {}\033[0m".format(last_delimiter_position))
+                    print("\033[36mlen(sentences) > 2: {}\033[0m".format(len(sentences) > 2))
+                    print("\033[36mcontext_window_start_pos: {}\033[0m".format(context_window_start_pos))
+                    print("\033[36mcontext_window_end_pos: {}\033[0m".format(context_window_end_pos))
+
+                # Combine sentences below minimum_sentence_length with the next sentence(s)
+                combined_sentences = []
+                temp_sentence = ""
+
+                for sentence in sentences:
+                    if len(sentence) < minimum_sentence_length:
+                        temp_sentence += sentence + " "
+                    else:
+                        if temp_sentence:
+                            temp_sentence += sentence
+                            combined_sentences.append(temp_sentence.strip())
+                            temp_sentence = ""
+                        else:
+                            combined_sentences.append(sentence.strip())
 
-            # Tokenize sentences from buffer
-            sentences = _tokenize_sentences(buffer, tokenize_sentences)
+                # If there's a leftover temp_sentence that hasn't been appended
+                if temp_sentence:
+                    combined_sentences.append(temp_sentence.strip())
 
-            if debug:
-                print("\033[36mbuffer: \"{}\"\033[0m".format(buffer))
-                print("\033[36mlast_delimiter_position: {}\033[0m".format(last_delimiter_position))
-                print("\033[36mlen(sentences) > 2: {}\033[0m".format(len(sentences) > 2))
-                print("\033[36mcontext_window_start_pos: {}\033[0m".format(context_window_start_pos))
-                print("\033[36mcontext_window_end_pos: {}\033[0m".format(context_window_end_pos))
-
-            # Combine sentences below minimum_sentence_length with the next sentence(s)
-            combined_sentences = []
-            temp_sentence = ""
-
-            for sentence in sentences:
-                if len(sentence) < minimum_sentence_length:
-                    temp_sentence += sentence + " "
-                else:
-                    if temp_sentence:
-                        temp_sentence += sentence
-                        combined_sentences.append(temp_sentence.strip())
-                        temp_sentence = ""
-                    else:
-                        combined_sentences.append(sentence.strip())
-
-            # If there's a leftover temp_sentence that hasn't been appended
-            if temp_sentence:
-                combined_sentences.append(temp_sentence.strip())
-
-            # Replace the original sentences with the combined_sentences
-            sentences = combined_sentences
-
-            # Process and yield sentences based on conditions
-            if len(sentences) > 2 or (
-                last_delimiter_position >= 0
-                and context_window_start_pos
-                <= last_delimiter_position
-                <= context_window_end_pos
-            ):
+                # Replace the original sentences with the combined_sentences
+                sentences = combined_sentences
+
+                # Process and yield sentences based on conditions
+                if len(sentences) > 2 or (
+                    last_delimiter_position >= 0
+                    and context_window_start_pos
+                    <= last_delimiter_position
+                    <= context_window_end_pos
+                ):
                 
-                if len(sentences) > 1:
-                    total_length_except_last = sum(
-                        len(sentence) for sentence in sentences[:-1]
-                    )
-                    if total_length_except_last >= minimum_sentence_length:
-                        for sentence in sentences[:-1]:
-                            yield_text = _clean_text(
-                                sentence,
-                                cleanup_text_links,
-                                cleanup_text_emojis)
-                            if debug:
-                                print("\033[36mDebug: Yielding sentence: \"{}\"\033[0m".format(yield_text))
-
-                            yield yield_text
-                            word_count = 0
-
-                        if quick_yield_for_all_sentences:
-                            is_first_sentence = True
-
-                        # we need to remember if the buffer ends with space
-                        # - sentences returned by the tokenizers are rtrimmed
-                        # - this takes any blank spaces away from the last unfinshed sentence
-                        # - we have to work around this by re-adding the blank space in this case
-                        ends_with_space = buffer.endswith(" ")
-
-                        # set buffer to last unfinshed sentence returned by tokenizers
-                        buffer = sentences[-1]
-
-                        # reset the blank space if it was there:
-                        if ends_with_space:
-                            buffer += " "
-
-                        # reset the last delimiter position after yielding
-                        last_delimiter_position = -1 
+                    if len(sentences) > 1:
+                        total_length_except_last = sum(
+                            len(sentence) for sentence in sentences[:-1]
+                        )
+                        if total_length_except_last >= minimum_sentence_length:
+                            for sentence in sentences[:-1]:
+                                yield_text = _clean_text(
+                                    sentence,
+                                    cleanup_text_links,
+                                    cleanup_text_emojis)
+                                if debug:
+                                    print("\033[36mDebug: Yielding sentence: \"{}\"\033[0m".format(yield_text))
+
+                                yield yield_text
+                                word_count = 0
+
+                            if quick_yield_for_all_sentences:
+                                is_first_sentence = True
+
+                            # we need to remember if the buffer ends with space
+                            # - sentences returned by the tokenizers are rtrimmed
+                            # - this takes any blank spaces away from the last unfinshed sentence
+                            # - we have to work around this by re-adding the blank space in this case
+                            ends_with_space = buffer.endswith(" ")
+
+                            # set buffer to last unfinshed sentence returned by tokenizers
+                            buffer = sentences[-1]
+
+                            # reset the blank space if it was there:
+                            if ends_with_space:
+                                buffer += " "
+
+                            # reset the last delimiter position after yielding
+                            last_delimiter_position = -1 
 
     
+    if log_characters:
+        print()
+
     # Yield remaining buffer as final sentence(s)
     if buffer:
         sentences = _tokenize_sentences(buffer, tokenize_sentences)
@@ -4,29 +4,88 @@ import sys
 from synapse.utils import logger
 from synapse.processors import AITranscriptIterator, Stream2Sentence
 from synapse.chatbot.simple import ChatBot
-from synapse.pipeline.sources import LocalMicrophone
+from synapse.pipeline.sources import LocalMicrophone, AsyncLocalMicrophone
 from synapse.pipeline.sinks import LocalSpeaker
-from synapse.stt.deepgram import DeepgramSTTStreamer
-from synapse.tts.kokoro import KokoroTTS
+from synapse.pipeline.queues import OverflowPolicy
+from synapse.pipeline.runtime import PipelineRuntime
+from synapse.pipeline.streamers import AsyncStreamerAdapter, AsyncSinkAdapter, AudioConverter, VADGate
+from synapse.stt.deepgram import DeepgramSTTStreamer, ENDPOINTING_MS
+from synapse.stt.vosk import VoskSTTStreamer
+from synapse.tts.kokoro import KokoroTTS, PooledKokoroTTS
+from synapse.tts.pool import KokoroProcessPool
+from synapse.tts.cache import SynthesisCache
+from synapse.tts.filler import FillerPlayer
+
+def make_kokoro_tts(sample_rate, tts_cache:SynthesisCache=None, tts_lookahead=0, tts_pool:KokoroProcessPool=None, tts_filler:FillerPlayer=None):
+    """
+    In-process Kokoro, or Kokoro on a process pool shared between agents if one is given.
+    """
+    if tts_pool is not None:
+        return PooledKokoroTTS(pool=tts_pool, sample_rate=sample_rate, cache=tts_cache or SynthesisCache(), lookahead=tts_lookahead, filler=tts_filler)
+    return KokoroTTS(sample_rate=sample_rate, cache=tts_cache or SynthesisCache(), lookahead=tts_lookahead, filler=tts_filler)
+
+def make_stt(stt_engine, channels, sample_rate):
+    """
+    :param stt_engine: "deepgram" (streamed to Deepgram) or "vosk" (local CPU recognizer, works offline).
+    """
+    if stt_engine == "deepgram":
+        return DeepgramSTTStreamer(channels, sample_rate)
+    if stt_engine == "vosk":
+        return VoskSTTStreamer(channels, sample_rate)
+    raise ValueError(f"Unknown STT engine: {stt_engine}")
+
+def make_vad_gate(vad, sample_rate, channels):
+    """
+    :param vad: False for no gate, True for the energy detector, or a detector instance.
+    Speech ends after the same pause as Deepgram's endpointing, each end flushes a reply.
+    """
+    if vad is False or vad is None:
+        return None
+    return VADGate(sample_rate, channels, detector=None if vad is True else vad, hangover_ms=ENDPOINTING_MS)
 
 class LocalVoiceAgent:
     def __init__(self, chatbot:ChatBot,
-                 channels=1 if sys.platform == 'darwin' else 2, sample_rate=24000, format=pyaudio.paInt16, frames_per_buffer=pyaudio.paFramesPerBufferUnspecified):
-        mic = LocalMicrophone(format=format, channels=channels, sample_rate=sample_rate, frames_per_buffer=frames_per_buffer)
-        stt = DeepgramSTTStreamer(channels, sample_rate)
+                 channels=1 if sys.platform == 'darwin' else 2, sample_rate=24000, format=pyaudio.paInt16, frames_per_buffer=pyaudio.paFramesPerBufferUnspecified,
+                 mic_buffer_frames=64, tts_buffer_chunks=16, tts_cache:SynthesisCache=None, tts_lookahead=0, tts_pool:KokoroProcessPool=None, tts_filler:FillerPlayer=None,
+                 stt_channels=1, stt_sample_rate=16000, vad=False, stt_engine="deepgram"):
+        # Mic audio is real-time, stale frames are dropped if STT stalls.
+        # Synthesized audio must not be lost, so TTS blocks once enough is buffered ahead of the speaker.
+        mic = LocalMicrophone(format=format, channels=channels, sample_rate=sample_rate, frames_per_buffer=frames_per_buffer, max_buffered_frames=mic_buffer_frames)
+        # Mic audio is downmixed/resampled before STT: mono 16 kHz is all Deepgram needs and cuts the uplink ~3x.
+        # None keeps the captured channels/rate, Deepgram's LiveOptions follow the converter's output either way.
+        mic_converter = AudioConverter(sample_rate, channels, out_rate=stt_sample_rate, out_channels=stt_channels)
+        stt = make_stt(stt_engine, mic_converter.out_channels, mic_converter.out_rate)
+        # With vad (True for EnergyVAD, or a detector) silence is not streamed to STT and speech end is detected locally
+        vad_gate = make_vad_gate(vad, mic_converter.out_rate, mic_converter.out_channels)
         # ai_iter = AITranscriptIterator()
-        s2s = Stream2Sentence()
-        tts = KokoroTTS(sample_rate=sample_rate)
+        # Sentences are cut by the incremental segmenter, it doesn't re-tokenize the buffer per character
+        s2s = Stream2Sentence(tokenizer="incremental")
+        # Repeated phrases are replayed from the cache, pass one in to share it between agents
+        # tts_lookahead synthesizes the next sentences while the current one plays, 0 (default) keeps synthesis inline
+        # A filler clip covers the wait for the response if one is given (tts_filler)
+        tts = make_kokoro_tts(sample_rate, tts_cache, tts_lookahead, tts_pool, tts_filler).configure_backpressure(tts_buffer_chunks, OverflowPolicy.BLOCK)
         speaker = LocalSpeaker(format=format, channels=1, sample_rate=sample_rate, frames_per_buffer=frames_per_buffer)
         
-        stt.read_from(mic)
+        upstream = mic
+        if not mic_converter.is_passthrough:
+            mic_converter.read_from(upstream)
+            upstream = mic_converter
+        if vad_gate is not None:
+            vad_gate.read_from(upstream)
+            upstream = vad_gate
+        stt.read_from(upstream)
         chatbot.read_from(stt)
         s2s.read_from(chatbot)
         tts.read_from(s2s)
         tts.write_to(speaker)
+        # Replies go into the response cache once they have been heard to the end
+        tts.on("playback_end", chatbot.handle_playback_end)
         
         self.mic = mic
+        self.mic_converter = mic_converter
+        self.vad_gate = vad_gate
         self.stt = stt
+        self.chatbot = chatbot
         self.s2s = s2s
         self.tts = tts
         self.speaker = speaker
@@ -34,9 +93,48 @@ class LocalVoiceAgent:
         # Start PyAudio stream
         logger.info("Recording...")
     
+    def get_backpressure_stats(self):
+        return {
+            "mic": self.mic.get_backpressure_stats(),
+            "stt": self.stt.get_backpressure_stats(),
+            "s2s": self.s2s.get_backpressure_stats(),
+            "tts": self.tts.get_backpressure_stats(),
+        }
+    
+    def get_control_latency_stats(self):
+        """
+        How long start/interrupt/end/speech_end signals took to reach every stage.
+        """
+        return {
+            "chatbot": self.chatbot.get_control_latency_stats(),
+            "s2s": self.s2s.get_control_latency_stats(),
+            "tts": self.tts.get_control_latency_stats(),
+            "speaker": self.speaker.get_control_latency_stats(),
+        }
+    
+    def get_tts_cache_stats(self):
+        return self.tts.get_cache_stats()
+    
+    def get_tts_gap_stats(self):
+        return self.tts.get_gap_stats()
+    
+    def get_filler_stats(self):
+        return self.tts.get_filler_stats()
+    
+    def get_stt_bandwidth_stats(self):
+        if not isinstance(self.stt, DeepgramSTTStreamer):
+            return None
+        return dict(self.stt.get_bandwidth_stats(), conversion=self.mic_converter.get_conversion_stats())
+    
+    def get_vad_stats(self):
+        return self.vad_gate.get_vad_stats() if self.vad_gate is not None else None
+    
     def close(self):
         logger.info("Recording finished.")
         self.mic.close()
+        self.mic_converter.close()
+        if self.vad_gate is not None:
+            self.vad_gate.close()
         self.stt.close()
         # self.ai_iter.close()
         self.tts.close()
@@ -48,6 +146,102 @@ class LocalVoiceAgent:
     def __exit__(self, exc_type, exc_value, traceback):
         self.close()
         
+class AsyncLocalVoiceAgent:
+    """
+    Same mic -> STT -> ChatBot -> Stream2Sentence -> TTS -> speaker graph as LocalVoiceAgent,
+    but every edge is a task on the shared PipelineRuntime loop instead of a pair of threads.
+    Every stage that blocks is offloaded to the runtime's blocking pool: the ChatBot (transcript
+    and scheduler locks, prompt building), Stream2Sentence, synthesis and speaker writes. Those
+    stages still do their own work on GLOBAL_THREAD_POOL (LLM streaming, segmentation), and
+    Deepgram on its socket threads, which the runtime doesn't bound.
+    """
+    def __init__(self, chatbot:ChatBot, runtime:PipelineRuntime,
+                 channels=1 if sys.platform == 'darwin' else 2, sample_rate=24000, format=pyaudio.paInt16, frames_per_buffer=pyaudio.paFramesPerBufferUnspecified,
+                 mic_buffer_frames=64, tts_buffer_chunks=16, tts_cache:SynthesisCache=None, tts_lookahead=0, tts_pool:KokoroProcessPool=None, tts_filler:FillerPlayer=None,
+                 stt_channels=1, stt_sample_rate=16000, vad=False, stt_engine="deepgram"):
+        self.runtime = runtime
+        runtime.run(self.__build(chatbot, channels, sample_rate, format, frames_per_buffer, mic_buffer_frames, tts_buffer_chunks, tts_cache, tts_lookahead, tts_pool, tts_filler, stt_channels, stt_sample_rate, vad, stt_engine))
+        logger.info("Recording...")
+        
+    async def __build(self, chatbot, channels, sample_rate, format, frames_per_buffer, mic_buffer_frames, tts_buffer_chunks, tts_cache, tts_lookahead, tts_pool, tts_filler, stt_channels, stt_sample_rate, vad, stt_engine):
+        mic = AsyncLocalMicrophone(format=format, channels=channels, sample_rate=sample_rate, frames_per_buffer=frames_per_buffer, max_buffered_frames=mic_buffer_frames)
+        converter = AudioConverter(sample_rate, channels, out_rate=stt_sample_rate, out_channels=stt_channels)
+        mic_converter = AsyncStreamerAdapter(converter)
+        gate = make_vad_gate(vad, converter.out_rate, converter.out_channels)
+        vad_gate = AsyncStreamerAdapter(gate) if gate is not None else None
+        stt = AsyncStreamerAdapter(make_stt(stt_engine, converter.out_channels, converter.out_rate))
+        bot = AsyncStreamerAdapter(chatbot, blocking=True)
+        s2s = AsyncStreamerAdapter(Stream2Sentence(tokenizer="incremental"), blocking=True)
+        tts = AsyncStreamerAdapter(make_kokoro_tts(sample_rate, tts_cache, tts_lookahead, tts_pool, tts_filler), blocking=True).configure_backpressure(tts_buffer_chunks, OverflowPolicy.BLOCK)
+        speaker = AsyncSinkAdapter(LocalSpeaker(format=format, channels=1, sample_rate=sample_rate, frames_per_buffer=frames_per_buffer), blocking=True)
+        
+        upstream = mic
+        if not converter.is_passthrough:
+            mic_converter.read_from(upstream)
+            upstream = mic_converter
+        if vad_gate is not None:
+            vad_gate.read_from(upstream)
+            upstream = vad_gate
+        stt.read_from(upstream)
+        bot.read_from(stt)
+        s2s.read_from(bot)
+        tts.read_from(s2s)
+        tts.write_to(speaker)
+        # Replies go into the response cache once they have been heard to the end
+        tts.streamer.on("playback_end", chatbot.handle_playback_end)
+        
+        self.mic = mic
+        self.mic_converter = mic_converter
+        self.vad_gate = vad_gate
+        self.stt = stt
+        self.bot = bot
+        self.s2s = s2s
+        self.tts = tts
+        self.speaker = speaker
+    
+    def get_control_latency_stats(self):
+        return {
+            "chatbot": self.bot.get_control_latency_stats(),
+            "s2s": self.s2s.get_control_latency_stats(),
+            "tts": self.tts.get_control_latency_stats(),
+            "speaker": self.speaker.sink.get_control_latency_stats(),
+        }
+    
+    def get_tts_cache_stats(self):
+        return self.tts.streamer.get_cache_stats()
+    
+    def get_tts_gap_stats(self):
+        return self.tts.streamer.get_gap_stats()
+    
+    def get_filler_stats(self):
+        return self.tts.streamer.get_filler_stats()
+    
+    def get_stt_bandwidth_stats(self):
+        if not isinstance(self.stt.streamer, DeepgramSTTStreamer):
+            return None
+        return dict(self.stt.streamer.get_bandwidth_stats(), conversion=self.mic_converter.streamer.get_conversion_stats())
+    
+    def get_vad_stats(self):
+        return self.vad_gate.streamer.get_vad_stats() if self.vad_gate is not None else None
+    
+    def close(self):
+        logger.info("Recording finished.")
+        self.mic.close()
+        self.mic_converter.close()
+        if self.vad_gate is not None:
+            self.vad_gate.close()
+        self.stt.close()
+        self.bot.close()
+        self.s2s.close()
+        self.tts.close()
+        self.speaker.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        
 def local_voice_bot(chatbot:ChatBot=None):
     agent = LocalVoiceAgent(chatbot=chatbot)
     return agent
\ No newline at end of file